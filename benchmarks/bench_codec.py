@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+micro benchmark for decoding pilight frames and encoding commands
+
+Decodes a set of pilight frames with every installed json backend, the
+old way through str and straight from bytes through the codec, and
+encodes control messages. Frames recorded from pilight, separated by a
+blank line as on the wire, can be passed as a file, otherwise a built in
+sample of update, values and config frames is used.
+
+    PYTHONPATH=. python benchmarks/bench_codec.py [frames.txt]
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+import time
+
+from pilight2mqtt import codec
+from pilight2mqtt.framing import DELIM
+
+SAMPLE = [
+    b'{"origin":"update","type":3,"devices":["weather"],'
+    b'"values":{"timestamp":1546300800,"temperature":21.5,'
+    b'"humidity":48.0,"battery":1}}',
+    b'{"origin":"update","type":1,"devices":["lamp"],'
+    b'"values":{"timestamp":1546300801,"state":"on"}}',
+    b'{"origin":"update","type":2,"devices":["dimmer"],'
+    b'"values":{"timestamp":1546300802,"state":"on","dimlevel":10}}',
+    b'{"message":"values","values":[' + b','.join(
+        b'{"type":3,"devices":["sensor%d"],"values":{"timestamp":1546300800,'
+        b'"temperature":%d.5,"humidity":%d.0}}' % (i, i, 40 + i)
+        for i in range(20)) + b']}',
+    b'{"message":"config","config":{"devices":{' + b','.join(
+        b'"device%d":{"uuid":"0000-d0-63-00-000000","origin":"0000-d0-63",'
+        b'"timestamp":0,"protocol":["kaku_switch"],"id":[{"id":%d,'
+        b'"unit":0}],"state":"off"}' % (i, i)
+        for i in range(50)) + b'}}}',
+]
+COMMAND = {'action': 'control',
+           'code': {'device': 'dimmer', 'state': 'on',
+                    'values': {'dimlevel': 10}}}
+ROUNDS = 2000
+
+
+def load_frames(path):
+    """frames from a file, separated like on the wire"""
+    with open(path, 'rb') as frames:
+        return [frame for frame in frames.read().split(DELIM) if frame]
+
+
+def timed(func, frames):
+    """seconds to call func with every frame ROUNDS times"""
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for frame in frames:
+            func(frame)
+    return time.perf_counter() - start
+
+
+def report(name, elapsed, count):
+    """print one result"""
+    print('%-22s %8.3f s %8.2f us/op' % (
+        name, elapsed, elapsed / count * 1e6))
+
+
+def main():
+    """run the benchmark"""
+    frames = load_frames(sys.argv[1]) if len(sys.argv) > 1 else SAMPLE
+    count = ROUNDS * len(frames)
+    print('%d frames, %d bytes' % (len(frames), sum(map(len, frames))))
+    report('json via str', timed(
+        lambda frame: json.loads(frame.decode('utf-8')), frames), count)
+    report('json dumps + bytes', timed(
+        lambda msg: bytes(json.dumps(msg) + '\n', 'utf-8'), [COMMAND]),
+           ROUNDS)
+    for name in codec.BACKENDS:
+        try:
+            codec.use(name)
+        except ImportError:
+            print('%-22s not installed' % name)
+            continue
+        report('%s loads' % name, timed(codec.loads, frames), count)
+        report('%s message' % name, timed(codec.message, [COMMAND]), ROUNDS)
+    codec.use()
+
+
+if __name__ == '__main__':
+    main()
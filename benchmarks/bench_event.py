@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+allocations of pilight events, decoded dicts against PilightEvent
+
+Decodes update frames as recorded from pilight, the old way into the
+plain dicts of the json codec and into PilightEvent objects, and keeps
+all of them alive, like queued or captured events are. Reports the time
+per event and the memory allocated per event. Only the parser is
+measured: the change filter, state store and publisher get the interned
+device and reading names of the events, not the events themselves.
+
+Every variant is warmed up first and its time is the best of several
+repeats. PilightEvent saves memory, not time: decoding into plain dicts
+is faster, the events take less than half of the memory.
+
+    PYTHONPATH=. python benchmarks/bench_event.py [--events 20000] [--repeat 5]
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+import tracemalloc
+
+from pilight2mqtt import codec
+from pilight2mqtt.event import parse_events
+
+EVENTS = 20000
+REPEAT = 5
+
+
+def frames(count):
+    """update frames of a few dozen devices, as pilight sends them"""
+    result = []
+    for i in range(count):
+        if i % 2:
+            frame = (b'{"origin":"update","type":1,"devices":["switch%d"],'
+                     b'"uuid":"0000-d0-63-00-000000","repeats":1,'
+                     b'"values":{"timestamp":%d,"state":"%s"}}'
+                     % (i % 40, 1546300800 + i, b'on' if i % 4 else b'off'))
+        else:
+            frame = (b'{"origin":"update","type":3,"devices":["weather%d"],'
+                     b'"uuid":"0000-d0-63-00-000000","repeats":1,'
+                     b'"values":{"timestamp":%d,"temperature":%d.%d,'
+                     b'"humidity":%d.0,"battery":1}}'
+                     % (i % 10, 1546300800 + i, 15 + i % 10, i % 10,
+                        40 + i % 20))
+        result.append(frame)
+    return result
+
+
+def decode_dicts(data):
+    """the old way, one dict per frame read as the bridge did"""
+    events = []
+    for frame in data:
+        evt_dct = codec.loads(frame)
+        if evt_dct.get('origin', '') == 'update':
+            evt_dct.get('type')
+            evt_dct.get('values', {})
+            evt_dct.get('devices', [])
+        events.append(evt_dct)
+    return events
+
+
+def decode_events(data):
+    """PilightEvent objects"""
+    events = []
+    for frame in data:
+        events.extend(parse_events(frame))
+    return events
+
+
+def measure(func, data, repeat=REPEAT):
+    """best seconds and bytes allocated per event, after a warm up"""
+    func(data)
+    elapsed = min(timeit.repeat(lambda: func(data), number=1,
+                                repeat=repeat))
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    kept = func(data)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return elapsed / len(data), (after - before) / len(data)
+
+
+def main():
+    """run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--events', default=EVENTS, type=int)
+    parser.add_argument('--repeat', default=REPEAT, type=int)
+    args = parser.parse_args()
+    data = frames(args.events)
+
+    print('%d events, codec %s, best of %d' % (len(data), codec.backend,
+                                               args.repeat))
+    results = []
+    for name, func in (('dict', decode_dicts),
+                       ('PilightEvent', decode_events)):
+        seconds, size = measure(func, data, args.repeat)
+        results.append(size)
+        print('%-14s %8.2f us/event %8.0f bytes/event' % (
+            name, seconds * 1e6, size))
+    print('saved %.0f bytes/event (%.0f%%)' % (
+        results[0] - results[1], 100.0 * (1 - results[1] / results[0])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+micro benchmark for splitting bursts of pilight frames
+
+Compares the FrameDecoder against the previous bytes concatenation
+approach for bursts of a few megabytes, once made of small update frames
+and once of a single large frame like a big config message. The time per
+megabyte of the decoder stays flat while the old approach grows with the
+size of the buffered data.
+
+    PYTHONPATH=. python benchmarks/bench_framing.py
+"""
+
+from __future__ import print_function
+
+import time
+
+from pilight2mqtt.framing import DELIM, FrameDecoder
+
+FRAME = (b'{"origin":"update","type":3,"devices":["weather"],'
+         b'"values":{"timestamp":1546300800,"temperature":21.5,'
+         b'"humidity":48.0,"battery":1}}')
+CHUNK = 1024
+
+
+class BurstSocket:  # pylint: disable=too-few-public-methods
+    """socket stand in returning a prepared burst in chunks"""
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def recv(self, size):
+        """socket.recv"""
+        data = self._view[self._pos:self._pos + size].tobytes()
+        self._pos += len(data)
+        return data
+
+    def recv_into(self, buf, size):
+        """socket.recv_into"""
+        data = self._view[self._pos:self._pos + size]
+        buf[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def make_burst(megabytes):
+    """build a burst of small frames of roughly the given size"""
+    frame = FRAME + DELIM
+    count = megabytes * 1024 * 1024 // len(frame)
+    return frame * count, count
+
+
+def make_large(megabytes):
+    """build a single frame of the given size"""
+    return b'x' * (megabytes * 1024 * 1024) + DELIM, 1
+
+
+def old_readlines(sock, total):
+    """the previous _readlines algorithm"""
+    buffer = b''
+    received = 0
+    while received < total:
+        data = sock.recv(CHUNK)
+        received += len(data)
+        buffer += data
+        while buffer.find(DELIM) != -1:
+            line, buffer = buffer.split(DELIM, 1)
+            yield line
+
+
+def decoder_readlines(sock, total):
+    """the FrameDecoder based algorithm"""
+    decoder = FrameDecoder(CHUNK)
+    received = 0
+    while received < total:
+        received += decoder.recv_from(sock)
+        for line in decoder.frames():
+            yield line
+
+
+def run(name, func, make, megabytes):
+    """time one algorithm for one burst size"""
+    data, count = make(megabytes)
+    start = time.perf_counter()
+    frames = sum(1 for _ in func(BurstSocket(data), len(data)))
+    elapsed = time.perf_counter() - start
+    assert frames == count
+    print('%-8s %3d MB %8d frames %8.3f s %8.3f s/MB' % (
+        name, megabytes, frames, elapsed, elapsed / megabytes))
+
+
+def main():
+    """run the benchmark"""
+    for make in (make_burst, make_large):
+        print(make.__doc__)
+        for megabytes in (1, 2, 4, 8):
+            run('old', old_readlines, make, megabytes)
+            run('decoder', decoder_readlines, make, megabytes)
+
+
+if __name__ == '__main__':
+    main()
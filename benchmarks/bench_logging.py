@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+events per second handled by the bridge at different log levels
+
+Log records are formatted into an in memory stream, so the numbers include
+the cost of formatting but not of writing to a terminal or file.
+
+    PYTHONPATH=. python benchmarks/bench_logging.py
+"""
+
+from __future__ import print_function
+
+import io
+import logging
+import time
+
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.log import traffic
+from pilight2mqtt.publish import Publisher
+
+EVENTS = 20000
+FRAMES = [
+    b'{"origin":"update","type":1,"devices":["lamp%d"],'
+    b'"values":{"state":"on"}}' % (i % 16) for i in range(8)
+] + [
+    b'{"origin":"update","type":3,"devices":["weather%d"],'
+    b'"values":{"temperature":%d.5,"humidity":48.0}}' % (i, i)
+    for i in range(8)
+]
+
+
+class NullClient:  # pylint: disable=too-few-public-methods
+    """mqtt client stand in"""
+
+    @staticmethod
+    def publish(topic, payload=None, qos=0, retain=False):
+        """accept and forget a message"""
+        return (0, 0)
+
+
+def run(name, level, sample=0):
+    """measure events per second with the given log level and sampling"""
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    traffic.configure(sample)
+    try:
+        p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost')
+        # pylint: disable=protected-access
+        p2m._publisher = Publisher(NullClient())
+        handle = p2m._handle_event
+        count = len(FRAMES)
+        start = time.perf_counter()
+        for i in range(EVENTS):
+            handle(FRAMES[i % count])
+        elapsed = time.perf_counter() - start
+    finally:
+        root.removeHandler(handler)
+        traffic.configure(0)
+    print('%-24s %10.0f events/s %10d bytes logged' % (
+        name, EVENTS / elapsed, len(stream.getvalue())))
+
+
+def main():
+    """run the benchmark"""
+    run('WARNING', logging.WARNING)
+    run('INFO (--verbose)', logging.INFO)
+    run('DEBUG (--debug)', logging.DEBUG)
+    run('DEBUG, trace 1/100', logging.DEBUG, 100)
+    run('DEBUG, trace all', logging.DEBUG, 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+throughput, latency and memory of the bridge on recorded traffic
+
+Replays a capture written with --capture, or a generated one, through a
+stand in pilight server. The reader, the parser and the publisher are
+measured on their own, then the real bridge runs against the replay and a
+stub MQTT broker. Every stage reports events per second, the 50th and 99th
+percentile of its latency and the peak memory allocated while it ran.
+Latencies are sampled with time.perf_counter into fine buckets, the
+buckets of the bridge metrics start at 100 µs.
+
+    PYTHONPATH=. python benchmarks/bench_replay.py [capture] [--speed 0] \
+        [--json out]
+    PYTHONPATH=. python benchmarks/bench_replay.py --compare baseline.json
+
+With --compare the run fails if the throughput of a stage dropped, or its
+memory grew, by more than the tolerance.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+
+from pilight2mqtt import codec
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.metrics import Histogram, metrics
+from pilight2mqtt.publish import Publisher
+from pilight2mqtt.replay import ReplayServer, StubBroker, read_capture
+
+EVENTS = 20000
+FINE_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+                0.0001, 0.00025, 0.0005, 0.001)
+
+
+def generate(count=EVENTS, interval=0.001):
+    """records of update events of switches, dimmers and weather stations"""
+    records = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            frame = (b'{"origin":"update","type":1,"devices":["switch%d"],'
+                     b'"values":{"timestamp":%d,"state":"%s"}}'
+                     % (i % 40, i, b'on' if i % 2 else b'off'))
+        elif kind == 1:
+            frame = (b'{"origin":"update","type":2,"devices":["dimmer%d"],'
+                     b'"values":{"timestamp":%d,"state":"on","dimlevel":%d}}'
+                     % (i % 20, i, i % 16))
+        else:
+            frame = (b'{"origin":"update","type":3,"devices":["weather%d"],'
+                     b'"values":{"timestamp":%d,"temperature":%d.%d,'
+                     b'"humidity":%d.0,"battery":1}}'
+                     % (i % 10, i, 15 + i % 10, i % 10, 40 + i % 20))
+        records.append((i * interval, frame))
+    return records
+
+
+def measure(name, func, latency):
+    """run func timed, then traced for its peak memory
+
+       func returns the number of events and, optionally, the seconds it
+       took to handle them. The latency histogram is read after the timed
+       run, tracing slows everything down.
+    """
+    metrics.reset()
+    latency.reset()
+    start = time.perf_counter()
+    count = func(False)
+    elapsed = time.perf_counter() - start
+    if isinstance(count, tuple):
+        count, elapsed = count
+    result = {
+        'stage': name,
+        'events': count,
+        'seconds': elapsed,
+        'events_per_second': count / elapsed if elapsed else 0,
+        'p50': latency.quantile(0.5),
+        'p99': latency.quantile(0.99),
+    }
+    tracemalloc.start()
+    func(True)
+    _, result['peak_bytes'] = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result
+
+
+def stage_reader(records):
+    """frames read from the replay as fast as it sends them"""
+    replay = ReplayServer(records, speed=0).start()
+    server = PilightServer('127.0.0.1', replay.port)
+    latency = Histogram('read', '', FINE_BUCKETS)
+
+    def read(traced):  # pylint: disable=unused-argument
+        server.connect()
+        server.request_config()
+        clock = time.perf_counter
+        count = 0
+        start = clock()
+        for _ in server._readlines():  # pylint: disable=protected-access
+            latency.observe(clock() - start)
+            count += 1
+            if count == len(replay):
+                break
+            start = clock()
+        server.disconnect()
+        return count
+
+    result = measure('reader', read, latency)
+    replay.stop()
+    return result
+
+
+def stage_parser(records):
+    """frames decoded by the json codec"""
+    frames = [frame for _, frame in records]
+    latency = Histogram('parse', '', FINE_BUCKETS)
+
+    def parse(traced):  # pylint: disable=unused-argument
+        clock = time.perf_counter
+        for frame in frames:
+            start = clock()
+            codec.loads(frame)
+            latency.observe(clock() - start)
+        return len(frames)
+
+    return measure('parser', parse, latency)
+
+
+class StubClient:
+    """accepts every message like a connected paho client"""
+
+    @staticmethod
+    def publish(topic, payload=None, qos=0, retain=False):
+        """nothing is sent"""
+        return (0, 0)
+
+
+def stage_publisher(records):
+    """messages of every event handed to the client in one batch each"""
+    batches = []
+    for _, frame in records:
+        event = codec.loads(frame)
+        if 'devices' not in event or 'values' not in event:
+            continue
+        batches.append([('PILIGHT/status/%s/%s' % (device, key.upper()),
+                         value)
+                        for device in event['devices']
+                        for key, value in event['values'].items()])
+    latency = Histogram('publish', '', FINE_BUCKETS)
+
+    def publish(traced):  # pylint: disable=unused-argument
+        publisher = Publisher(StubClient())
+        clock = time.perf_counter
+        for batch in batches:
+            start = clock()
+            for topic, payload in batch:
+                publisher.add(topic, payload, retain=True)
+            publisher.flush()
+            latency.observe(clock() - start)
+        return len(batches)
+
+    return measure('publisher', publish, latency)
+
+
+def stage_bridge(records, speed):
+    """events replayed through the real bridge to the stub broker"""
+    broker = StubBroker().start()
+    replay = ReplayServer(records, speed=speed).start()
+
+    broker.keep = False
+    latency = Histogram('handle', '', FINE_BUCKETS)
+
+    def bridge(traced):
+        broker.count = 0
+        p2m = Pilight2MQTT(PilightServer('127.0.0.1', replay.port),
+                           '127.0.0.1', mqtt_port=broker.port)
+        handle = p2m._handle_event  # pylint: disable=protected-access
+
+        def timed(evt, site=None):
+            start = time.perf_counter()
+            handle(evt, site)
+            latency.observe(time.perf_counter() - start)
+
+        p2m._handle_event = timed  # pylint: disable=protected-access
+
+        def stop():
+            replay.finished.wait()
+            seen = -1
+            while seen != broker.count:
+                seen = broker.count
+                time.sleep(0.2)
+            p2m._server.terminate()  # pylint: disable=protected-access
+
+        threading.Thread(target=stop, daemon=True).start()
+        p2m.run()
+        if not traced:
+            result['messages'] = broker.count
+        return len(replay), broker.last - replay.started
+
+    result = {}
+    result.update(measure('bridge', bridge, latency))
+    replay.stop()
+    broker.stop()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """list of regressions against a baseline"""
+    before = {result['stage']: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = before.get(result['stage'])
+        if old is None:
+            continue
+        if result['events_per_second'] < \
+                old['events_per_second'] * (1 - tolerance):
+            regressions.append('%s: %.0f events/s, was %.0f' % (
+                result['stage'], result['events_per_second'],
+                old['events_per_second']))
+        if result['peak_bytes'] > old['peak_bytes'] * (1 + tolerance):
+            regressions.append('%s: %d bytes peak, was %d' % (
+                result['stage'], result['peak_bytes'], old['peak_bytes']))
+    return regressions
+
+
+def main():
+    """run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('capture', nargs='?', default=None)
+    parser.add_argument('--speed', default=0, type=float,
+                        help='Replay speed of the bridge stage, 0 is max.')
+    parser.add_argument('--json', default=None,
+                        help='Write the results to this file.')
+    parser.add_argument('--compare', default=None,
+                        help='Results of an earlier run to compare with.')
+    parser.add_argument('--tolerance', default=0.25, type=float)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    records = read_capture(args.capture) if args.capture else generate()
+    results = [stage_reader(records),
+               stage_parser(records),
+               stage_publisher(records),
+               stage_bridge(records, args.speed)]
+
+    print('%-9s %8s %12s %10s %10s %12s' % (
+        'stage', 'events', 'events/s', 'p50 ms', 'p99 ms', 'peak KiB'))
+    for result in results:
+        print('%-9s %8d %12.0f %10.3f %10.3f %12.1f' % (
+            result['stage'], result['events'], result['events_per_second'],
+            result['p50'] * 1000, result['p99'] * 1000,
+            result['peak_bytes'] / 1024.0))
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline),
+                                  args.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
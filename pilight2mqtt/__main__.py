@@ -11,11 +11,50 @@ import sys
 import os
 import logging
 import argparse
+import functools
 import textwrap
+import time
 
-from pilight2mqtt.core import (PilightServer,
-                               Pilight2MQTT)
 from pilight2mqtt.const import __version__
+from pilight2mqtt.log import traffic
+
+
+def dedup_rule(text):
+    """argparse type for --dedup"""
+    from pilight2mqtt.dedup import parse_rule
+    try:
+        return parse_rule(text)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
+
+
+def publish_rule(text):
+    """argparse type for --publish"""
+    from pilight2mqtt.state import parse_publish_rule
+    try:
+        return parse_publish_rule(text)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
+
+
+def rollup_window(text):
+    """argparse type for --rollup"""
+    from pilight2mqtt.rollup import parse_window
+    try:
+        return parse_window(text)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
+
+
+def named_server(text):
+    """argparse type for --pilight, returns (name, address, port)"""
+    name, sep, location = text.partition('=')
+    address, _, port = location.partition(':')
+    if not sep or not name or '/' in name or not address or \
+            (port and not port.isdigit()):
+        raise argparse.ArgumentTypeError(
+            'invalid server "%s", expected NAME=HOST[:PORT]' % text)
+    return name, address, int(port or 5001)
 
 
 def get_arguments():
@@ -57,6 +96,240 @@ def get_arguments():
         help=textwrap.dedent('''\
             Port of the pilight server.
             Only used when pilight-server is also specified'''))
+    parser.add_argument(
+        '--pilight',
+        action='append',
+        default=[],
+        type=named_server,
+        metavar='NAME=HOST[:PORT]',
+        help=textwrap.dedent('''\
+            A pilight server to bridge, its topics are below
+            <mqtt-topic>/NAME. Can be given multiple times to bridge
+            several servers over one MQTT connection, which needs the
+            asyncio engine.'''))
+    parser.add_argument(
+        '--discovery-cache',
+        metavar='path_to_state_file',
+        default=None,
+        help=textwrap.dedent('''\
+            File remembering the discovered pilight server, so a restart
+            connects to it without waiting for discovery. The cache is on
+            by default and written to ~/.cache/pilight2mqtt/discovery.json
+            ($XDG_CACHE_HOME if set) once the server was connected to, an
+            empty path disables it.'''))
+    parser.add_argument(
+        '--discovery-ttl',
+        default=24 * 3600,
+        type=float,
+        help='Seconds a discovered pilight server is remembered.')
+    parser.add_argument(
+        '--pilight-recv-size',
+        default=4096,
+        type=int,
+        help='Number of bytes to request per read from pilight.')
+    parser.add_argument(
+        '--publish-window',
+        default=0,
+        type=float,
+        help=textwrap.dedent('''\
+            Seconds to collect MQTT messages before publishing them in
+            one batch. 0 publishes the messages of each event at once.'''))
+    parser.add_argument(
+        '--qos',
+        default=0,
+        type=int,
+        choices=[0, 1, 2],
+        help='MQTT QoS of status messages.')
+    parser.add_argument(
+        '--no-retain',
+        action='store_true',
+        help=textwrap.dedent('''\
+            Do not publish status messages retained. By default the broker
+            keeps the latest reading of every device for new subscribers.'''))
+    parser.add_argument(
+        '--publish',
+        action='append',
+        default=[],
+        type=publish_rule,
+        metavar='READING=QOS[:retain|:noretain]',
+        help=textwrap.dedent('''\
+            QoS and retain flag for one reading, e.g. STATE=1:retain.
+            Can be given multiple times.'''))
+    parser.add_argument(
+        '--rollup',
+        action='append',
+        default=[],
+        type=rollup_window,
+        metavar='WINDOW',
+        help=textwrap.dedent('''\
+            Also publish min, max, mean and count of numeric readings per
+            window, e.g. 1m, to $TOPIC/status/<device>/<reading>/1m.
+            Can be given multiple times.'''))
+    parser.add_argument(
+        '--rollup-readings',
+        default=None,
+        metavar='READING,...',
+        help=textwrap.dedent('''\
+            Readings to aggregate, e.g. TEMPERATURE,HUMIDITY. All numeric
+            readings by default.'''))
+    parser.add_argument(
+        '--spool',
+        metavar='path_to_spool',
+        default=None,
+        help=textwrap.dedent('''\
+            File keeping the messages published while the MQTT broker can
+            not be reached, they are published once it is back. Of the
+            readings in --spool-compact only the latest per topic is
+            kept, all values of other readings are kept.'''))
+    parser.add_argument(
+        '--spool-compact',
+        default='STATE,DIMLEVEL',
+        metavar='READING,...',
+        help=textwrap.dedent('''\
+            Readings that are the state of a device, of which the spool
+            only keeps the latest value per topic. An empty list keeps
+            every value.'''))
+    parser.add_argument(
+        '--spool-size',
+        default=16 << 20,
+        type=int,
+        help=textwrap.dedent('''\
+            Bytes of the spool file, the oldest messages are dropped when
+            it is full.'''))
+    parser.add_argument(
+        '--spool-rate',
+        default=500,
+        type=int,
+        help='Messages per second published from the spool.')
+    parser.add_argument(
+        '--event-types',
+        metavar='path_to_json',
+        default=None,
+        help=textwrap.dedent('''\
+            JSON file mapping pilight device types to readings, e.g.
+            {"2": {"STATE": "state", "DIMLEVEL": "dimlevel"}}. Merged
+            over the built in types.'''))
+    parser.add_argument(
+        '--dedup-window',
+        default=0,
+        type=float,
+        help=textwrap.dedent('''\
+            Seconds during which a repeated, unchanged reading of a device
+            is not published again. 0 publishes every reading.'''))
+    parser.add_argument(
+        '--dedup',
+        action='append',
+        default=[],
+        type=dedup_rule,
+        metavar='READING=WINDOW[:DEADBAND]',
+        help=textwrap.dedent('''\
+            Dedup window and numeric deadband for one reading, e.g.
+            TEMPERATURE=30:0.1 ignores changes under 0.1 within 30s.
+            Can be given multiple times.'''))
+    parser.add_argument(
+        '--dedup-size',
+        default=4096,
+        type=int,
+        help='Number of device readings remembered for dedup.')
+    parser.add_argument(
+        '--control-connections',
+        default=1,
+        type=int,
+        help=textwrap.dedent('''\
+            Number of connections to pilight reserved for commands
+            received through MQTT. Only used by the thread engine.'''))
+    parser.add_argument(
+        '--command-rate',
+        default=None,
+        type=float,
+        help=textwrap.dedent('''\
+            Queue commands received through MQTT and send at most this
+            many per second, 0 does not limit them. Only the latest
+            command per device is sent and commands do not wait for the
+            answer to the previous one. Only used by the thread engine,
+            replaces --control-connections.'''))
+    parser.add_argument(
+        '--command-burst',
+        default=2,
+        type=int,
+        help='Number of commands --command-rate lets through at once.')
+    parser.add_argument(
+        '--command-pipeline',
+        default=8,
+        type=int,
+        help='Number of commands sent before pilight answered them.')
+    parser.add_argument(
+        '--heartbeat-interval',
+        default=60,
+        type=float,
+        help=textwrap.dedent('''\
+            Seconds between heartbeats sent to pilight to check that the
+            connection is alive. 0 disables them.'''))
+    parser.add_argument(
+        '--heartbeat-misses',
+        default=2,
+        type=int,
+        help=textwrap.dedent('''\
+            Number of heartbeats in a row pilight may leave unanswered
+            before the bridge reconnects.'''))
+    parser.add_argument(
+        '--workers',
+        default=1,
+        type=int,
+        help=textwrap.dedent('''\
+            Number of threads handling pilight events, so reading from
+            pilight never waits for MQTT. 0 handles the events on the
+            reading thread. Only used by the thread engine, not with
+            --shards.'''))
+    parser.add_argument(
+        '--queue-size',
+        default=1024,
+        type=int,
+        help='Number of pilight events that can wait for a worker.')
+    parser.add_argument(
+        '--queue-policy',
+        choices=['block', 'drop-oldest', 'coalesce'],
+        default='drop-oldest',
+        help=textwrap.dedent('''\
+            What to do when the event queue is full: wait for room, drop
+            the oldest event, or replace a waiting update of the same
+            devices with the new one (dropping the oldest if none). The
+            default drops, so reading from pilight never waits for MQTT.
+            Events are only dropped or replaced while the queue is full.'''))
+    parser.add_argument(
+        '--shards',
+        default=0,
+        type=int,
+        help=textwrap.dedent('''\
+            Number of worker processes handling pilight events, each with
+            a connection to the MQTT broker of its own. The events of a
+            device always go to the same process. 0 handles them in the
+            process reading from pilight. Only used by the thread engine.'''))
+    parser.add_argument(
+        '--shard-buffer',
+        default=1 << 20,
+        type=int,
+        help='Bytes of pilight events that can wait for a worker process.')
+    parser.add_argument(
+        '--json-codec',
+        choices=['auto', 'orjson', 'ujson', 'json'],
+        default='auto',
+        help=textwrap.dedent('''\
+            JSON library used for pilight's messages. auto uses orjson
+            or ujson when installed and the standard library otherwise.'''))
+    parser.add_argument(
+        '--startup-profile',
+        action='store_true',
+        help=textwrap.dedent('''\
+            Print the time spent in imports, discovery, connecting to
+            MQTT and pilight and until the first event was handled.'''))
+    parser.add_argument(
+        '--engine',
+        choices=['thread', 'asyncio'],
+        default='thread',
+        help=textwrap.dedent('''\
+            Run the bridge on a blocking socket with a separate MQTT
+            thread or on a single asyncio event loop.'''))
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -65,6 +338,36 @@ def get_arguments():
         '--verbose',
         action='store_true',
         help='Start pilight2mqtt in verbose mode')
+    parser.add_argument(
+        '--metrics-port',
+        default=None,
+        type=int,
+        help=textwrap.dedent('''\
+            Serve metrics in the Prometheus text format on
+            http://localhost:<port>/metrics.'''))
+    parser.add_argument(
+        '--stats-interval',
+        default=0,
+        type=float,
+        help=textwrap.dedent('''\
+            Seconds between publications of the metrics to
+            <mqtt-topic>/bridge/stats. 0 disables them.'''))
+    parser.add_argument(
+        '--trace-traffic',
+        metavar='N',
+        default=0,
+        type=int,
+        help=textwrap.dedent('''\
+            Log every Nth frame exchanged with pilight and MQTT to the
+            pilight2mqtt.traffic logger. 0 disables the trace.'''))
+    parser.add_argument(
+        '--capture',
+        metavar='path_to_capture',
+        default=None,
+        help=textwrap.dedent('''\
+            Record every frame received from pilight with its arrival
+            time, for python -m pilight2mqtt.replay and the benchmarks.
+            With several servers the server's name is appended.'''))
     parser.add_argument(
         '--pid-file',
         metavar='path_to_pid_file',
@@ -77,6 +380,12 @@ def get_arguments():
             help='Run pilight2mqtt as daemon')
 
     arguments = parser.parse_args()
+    if arguments.pilight and arguments.engine != 'asyncio':
+        parser.error('--pilight needs --engine asyncio')
+    if arguments.shards and arguments.engine != 'thread':
+        parser.error('--shards needs --engine thread')
+    if arguments.shards and arguments.spool:
+        parser.error('--spool can not be used with --shards')
     if os.name != "posix" or arguments.debug:
         arguments.daemon = False
 
@@ -143,7 +452,13 @@ def write_pid(pid_file):
 
 def main():
     """main entry point"""
+    started = time.perf_counter()
     args = get_arguments()
+    startup = None
+    if args.startup_profile:
+        from pilight2mqtt.startup import StartupProfile
+        startup = StartupProfile(started)
+        startup.mark('arguments')
 
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
@@ -151,6 +466,7 @@ def main():
         logging.basicConfig(level=logging.INFO)
     else:
         logging.basicConfig(level=logging.WARNING)
+    traffic.configure(args.trace_traffic)
 
     # Daemon functions
     if args.pid_file:
@@ -160,19 +476,125 @@ def main():
     if args.pid_file:
         write_pid(args.pid_file)
 
-    if args.pilight_server:
-        server = PilightServer(args.pilight_server,
-                               args.pilight_port)
+    # imported once the arguments are known, --help and --version do not
+    # pay for it
+    from pilight2mqtt import codec
+    codec.use(args.json_codec)
+    if args.engine == 'asyncio':
+        from pilight2mqtt.aio import (AsyncPilightServer as server_cls,
+                                      AsyncPilight2MQTT as bridge_cls)
     else:
-        server = PilightServer.discover()
-
-    p2m = Pilight2MQTT(server,
-                       args.mqtt_server,
-                       mqtt_port=args.mqtt_port,
-                       mqtt_topic=args.mqtt_topic,
-                       mqtt_username=args.mqtt_username,
-                       mqtt_password=args.mqtt_password)
-    return p2m.run()
+        from pilight2mqtt.core import (PilightServer as server_cls,
+                                       Pilight2MQTT as bridge_cls)
+    if args.shards > 0:
+        from pilight2mqtt.shard import ShardedPilight2MQTT
+        factory = functools.partial(ShardedPilight2MQTT,
+                                    shards=args.shards,
+                                    ring_size=args.shard_buffer)
+    else:
+        factory = bridge_cls
+    if startup is not None:
+        startup.mark('imports')
+
+    if args.pilight:
+        server = {name: server_cls(address, port,
+                                   recv_size=args.pilight_recv_size)
+                  for name, address, port in args.pilight}
+    elif args.pilight_server:
+        server = server_cls(args.pilight_server,
+                            args.pilight_port,
+                            recv_size=args.pilight_recv_size)
+    else:
+        cache = None
+        if args.discovery_cache != '':
+            from pilight2mqtt.cache import DiscoveryCache, default_path
+            cache = DiscoveryCache(args.discovery_cache or default_path(),
+                                   ttl=args.discovery_ttl)
+        server = server_cls.discover(recv_size=args.pilight_recv_size,
+                                     cache=cache)
+    if startup is not None:
+        startup.mark('discovery')
+
+    captures = []
+    if args.capture:
+        from pilight2mqtt.replay import CaptureWriter
+        if isinstance(server, dict):
+            for name, named in server.items():
+                captures.append(CaptureWriter('%s.%s' % (args.capture, name)))
+                named.record(captures[-1])
+        else:
+            captures.append(CaptureWriter(args.capture))
+            server.record(captures[-1])
+
+    kwargs = {'startup': startup}
+    if args.engine == 'thread':
+        if args.command_rate is not None:
+            from pilight2mqtt.scheduler import CommandScheduler
+            kwargs['control'] = CommandScheduler.for_server(
+                server, rate=args.command_rate, burst=args.command_burst,
+                depth=args.command_pipeline)
+        else:
+            from pilight2mqtt.control import ControlPool
+            kwargs['control'] = ControlPool.for_server(
+                server, size=args.control_connections)
+        if args.shards == 0:
+            # worker processes handle the events of the sharded mode
+            kwargs['workers'] = args.workers
+            kwargs['queue_size'] = args.queue_size
+            kwargs['queue_policy'] = args.queue_policy
+
+    if args.event_types:
+        from pilight2mqtt.dispatch import EventDispatcher
+        kwargs['dispatcher'] = EventDispatcher.load(args.event_types)
+
+    from pilight2mqtt.state import StateStore
+    kwargs['state'] = StateStore(
+        args.qos, not args.no_retain, args.publish,
+        [reading.strip().upper()
+         for reading in args.spool_compact.split(',') if reading.strip()])
+
+    if args.rollup:
+        from pilight2mqtt.rollup import Rollups
+        readings = None
+        if args.rollup_readings:
+            readings = [reading.strip().upper()
+                        for reading in args.rollup_readings.split(',')]
+        kwargs['rollups'] = Rollups(args.rollup, readings)
+
+    if args.spool:
+        from pilight2mqtt.spool import Spool
+        kwargs['spool'] = Spool(args.spool, args.spool_size)
+        kwargs['spool_rate'] = args.spool_rate
+
+    from pilight2mqtt.dedup import ChangeFilter
+    change_filter = ChangeFilter(args.dedup_window,
+                                 args.dedup,
+                                 size=args.dedup_size)
+    if change_filter.enabled:
+        kwargs['change_filter'] = change_filter
+
+    p2m = factory(server,
+                  args.mqtt_server,
+                  mqtt_port=args.mqtt_port,
+                  mqtt_topic=args.mqtt_topic,
+                  mqtt_username=args.mqtt_username,
+                  mqtt_password=args.mqtt_password,
+                  publish_window=args.publish_window,
+                  stats_interval=args.stats_interval,
+                  heartbeat_interval=args.heartbeat_interval,
+                  heartbeat_misses=args.heartbeat_misses,
+                  **kwargs)
+    if args.metrics_port is not None:
+        from pilight2mqtt.metrics import MetricsServer
+        MetricsServer(args.metrics_port, 'localhost').start()
+    if startup is not None:
+        startup.mark('setup')
+
+    try:
+        return p2m.run()
+    finally:
+        for capture in captures:
+            capture.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+asyncio engine of pilight2mqtt
+
+Reading from pilight, control commands, heartbeats, reconnects and the MQTT
+client all run on a single event loop, nothing wakes up unless there is
+something to do.
+"""
+
+import asyncio
+import collections
+import functools
+import signal
+import time
+
+import paho.mqtt.client as mqtt
+
+from pilight2mqtt import codec
+from pilight2mqtt.core import (BEAT,
+                               HEART,
+                               HEARTBEAT_INTERVAL,
+                               HEARTBEAT_MISSES,
+                               HEARTBEAT_RTT,
+                               HEARTBEATS_MISSED,
+                               RECONNECTS,
+                               ConnectionLostException,
+                               PilightProtocol,
+                               Pilight2MQTT,
+                               MQTT_KEEPALIVE,
+                               is_response)
+from pilight2mqtt.backoff import Backoff
+from pilight2mqtt.framing import RECV_SIZE
+from pilight2mqtt.log import traffic
+
+__all__ = ['AsyncPilight2MQTT', 'AsyncPilightServer']
+
+# seconds between draining the spool while pilight is idle
+DRAIN_INTERVAL = 1.0
+
+
+class AsyncPilightServer(PilightProtocol):
+    """class to interact with pilight using asyncio
+
+       Once process_events runs it is the only reader of the connection.
+       Answers to requests are handed to the waiting callers in the order
+       the requests were sent, everything else goes to the event callback.
+       It shares the framing and messages of PilightServer, but not its
+       blocking methods: connecting, sending and reading are coroutines.
+    """
+
+    def __init__(self, address, port, recv_size=RECV_SIZE):
+        """initialize"""
+        super().__init__(address, port, recv_size=recv_size)
+        self._reader = None
+        self._writer = None
+        self._pending = collections.deque()
+        self._dispatching = False
+        self._wakeup = None
+
+    async def _read(self):
+        """read the next frame from the connection"""
+        decoder = self._decoder
+        frame = decoder.next_frame()
+        while frame is None:
+            data = await self._reader.read(decoder.recv_size)
+            if not data:
+                raise ConnectionLostException('connection closed by pilight')
+            decoder.feed(data)
+            self._received = time.perf_counter()
+            frame = decoder.next_frame()
+        self._frame_received(frame)
+        return frame
+
+    async def send_check_success(self, msg_dct):
+        """send message and check that it was successfull"""
+        self.log.debug('_send_check_success')
+        response = await self.send_json(msg_dct)
+        return response.get('status', '') == 'success'
+
+    async def send_json(self, msg_dct):
+        """send json data and read response, which is also json"""
+        self.log.debug('_send_json')
+        response = await self.send_raw(self._encode(msg_dct))
+        if self._should_terminate:
+            return {}
+        return codec.loads(response)
+
+    async def send_raw(self, msg):
+        """send and read raw data"""
+        self.log.debug('_send_raw')
+        if self._writer is None:
+            raise ConnectionLostException('not connected to pilight')
+        traffic('pilight<', msg)
+        if self._dispatching:
+            waiter = asyncio.get_event_loop().create_future()
+            self._pending.append(waiter)
+            self._writer.write(msg)
+            return await waiter
+        # only while (re)connecting, nobody else is reading
+        self._writer.write(msg)
+        await self._writer.drain()
+        return await self._read()
+
+    def send(self, msg_dct):
+        """send json data without waiting for a response
+
+           The response arrives through process_events.
+        """
+        self.log.debug('send')
+        if self._writer is None:
+            raise ConnectionLostException('not connected to pilight')
+        msg = self._encode(msg_dct)
+        traffic('pilight<', msg)
+        self._writer.write(msg)
+
+    async def _identify(self):
+        """open the connection and identify"""
+        self._reader, self._writer = await asyncio.open_connection(
+            self._address, int(self._port))
+        self._decoder.reset()
+        return await self.send_check_success(self.IDENTIFY_MSG)
+
+    async def connect(self, cb_recv=None):
+        """initialize connection progress.
+           registers handlers as well.
+        """
+        self.log.info('connect')
+        if cb_recv:
+            self._event_handler = cb_recv
+        self._should_terminate = False
+        self._wakeup = asyncio.Event()
+        if not await self._identify():
+            return False
+        self._connected()
+        return True
+
+    async def reconnect(self):
+        """try to reconnect until connected or terminated
+
+           Attempts are spaced by a jittered exponential backoff.
+        """
+        while not self._should_terminate:
+            self._close()
+            try:
+                if await self._identify():
+                    self.log.info('reconnected to pilight')
+                    self._backoff.reset()
+                    RECONNECTS.inc()
+                    return True
+            except (ConnectionLostException, OSError, ValueError) as ex:
+                self.log.warning('reconnect failed: %s', ex)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       self._backoff.next())
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    def _close(self):
+        """close the connection and fail all waiting requests"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        while self._pending:
+            waiter = self._pending.popleft()
+            if not waiter.done():
+                waiter.set_exception(
+                    ConnectionLostException('connection to pilight lost'))
+
+    def disconnect(self):
+        """disconnect from pilight"""
+        self.log.info('disconnect')
+        self._should_terminate = True
+        self._close()
+
+    async def process_events(self, callback):
+        """process incoming events from pilight"""
+        self.log.info('process_events')
+        self._dispatching = True
+        try:
+            while not self._should_terminate:
+                try:
+                    frame = await self._read()
+                except (ConnectionLostException, OSError) as ex:
+                    if self._should_terminate:
+                        break
+                    self.log.warning('lost connection to pilight: %s', ex)
+                    self._dispatching = False
+                    if not await self.reconnect():
+                        break
+                    self._dispatching = True
+                    self.resume()
+                    continue
+                if self._pending and is_response(frame):
+                    waiter = self._pending.popleft()
+                    if not waiter.done():
+                        waiter.set_result(frame)
+                else:
+                    callback(frame)
+        finally:
+            self._dispatching = False
+            self._close()
+
+    def terminate(self):
+        """indicate that the system should shut down"""
+        self.log.info('terminate')
+        self._should_terminate = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        self._close()
+
+    async def heartbeat(self):
+        """send and read heart beat to/from pilight"""
+        response = await self.send_raw(HEART)
+        return response == BEAT
+
+    async def keepalive(self, interval=HEARTBEAT_INTERVAL,
+                        misses=HEARTBEAT_MISSES):
+        """send heartbeats while processing events
+
+           Reconnects after misses heartbeats in a row were not answered
+           within the interval.
+        """
+        missed = 0
+        while not self._should_terminate and interval > 0:
+            await asyncio.sleep(interval)
+            if not self._dispatching:
+                continue
+            start = time.monotonic()
+            try:
+                alive = await asyncio.wait_for(self.heartbeat(), interval)
+            except (asyncio.TimeoutError, ConnectionLostException):
+                alive = False
+            if alive:
+                HEARTBEAT_RTT.observe(time.monotonic() - start)
+                missed = 0
+                continue
+            if self._should_terminate:
+                break
+            missed += 1
+            HEARTBEATS_MISSED.inc()
+            if missed >= misses:
+                self.log.warning('pilight missed %d heartbeats, '
+                                 'reconnecting', missed)
+                missed = 0
+                self._close()
+
+    async def _control(self, msg):
+        """send a control message while events are processed"""
+        if not self._dispatching:
+            raise ConnectionLostException('not connected to pilight')
+        return await self.send_check_success(msg)
+
+    def set_device_state(self, device, state, values=None):
+        """update the state and values of a device in pilight
+           returns a future as the answer arrives through process_events
+        """
+        self.log.info('set_device_state: "%s" to "%s" %s',
+                      device, state, values or '')
+        task = asyncio.ensure_future(
+            self._control(self._control_msg(device, state, values)))
+
+        def done(fut):  # pylint: disable=missing-docstring
+            if fut.cancelled():
+                return
+            if fut.exception() is not None or not fut.result():
+                self.log.error('failed to set "%s" to "%s"', device, state)
+        task.add_done_callback(done)
+        return task
+
+
+class AsyncPilight2MQTT(Pilight2MQTT):
+    """translate between pilight events and mqtt messages using asyncio
+
+       The paho client does not run its own thread, its socket is watched
+       by the event loop instead.
+    """
+
+    def __init__(self, server, *args, **kwargs):
+        """initialize
+
+           Control commands go through the server itself, it hands their
+           answers to the waiting callers while it processes events.
+           Several servers share the event loop and the mqtt client.
+        """
+        kwargs.pop('control', None)
+        super().__init__(server, *args, **kwargs)
+        self._mqtt_wakeup = None
+
+    @staticmethod
+    def _default_control(server):
+        """commands are sent by the server itself"""
+        return server
+
+    def _create_mqtt_client(self):
+        """a paho client driven by the event loop"""
+        client = super()._create_mqtt_client()
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        return client
+
+    def _on_socket_open(self, client, userdata, sock):
+        """watch the mqtt socket for incoming data"""
+        asyncio.get_event_loop().add_reader(sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        """stop watching the mqtt socket and trigger a reconnect"""
+        asyncio.get_event_loop().remove_reader(sock)
+        if self._mqtt_wakeup is not None:
+            self._mqtt_wakeup.set()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        """write pending mqtt data once the socket is writable"""
+        asyncio.get_event_loop().add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """nothing left to write"""
+        asyncio.get_event_loop().remove_writer(sock)
+
+    async def _mqtt_loop(self):
+        """drive paho's keepalive and reconnect the mqtt client"""
+        client = self._mqtt_client
+        backoff = Backoff()
+        while True:
+            self._mqtt_wakeup.clear()
+            if client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                timeout = MQTT_KEEPALIVE / 4
+            else:
+                try:
+                    self.log.info('MQTT reconnect')
+                    client.reconnect()
+                    backoff.reset()
+                    continue
+                except OSError as ex:
+                    self.log.warning('MQTT reconnect failed: %s', ex)
+                timeout = backoff.next()
+            try:
+                await asyncio.wait_for(self._mqtt_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _stats_loop(self):
+        """publish the metrics and drain the spool while pilight is idle"""
+        interval = self._stats_interval
+        if self._publisher.spool is not None:
+            interval = min(interval or DRAIN_INTERVAL, DRAIN_INTERVAL)
+        while True:
+            await asyncio.sleep(interval)
+            self._tick()
+
+    async def _serve(self, site):
+        """connect to the server of a site and process its events"""
+        server = site.server
+        keepalive = None
+        try:
+            suc = await server.connect()
+            if not suc:
+                self.log.error('Could not connect to server %s:%s',
+                               server.address, server.port)
+                return 1
+            self._startup_mark('pilight identify')
+            if not await server.heartbeat():
+                self.log.error('pilight did not answer the heartbeat')
+                return 1
+            server.request_config()
+            server.request_values()
+            keepalive = asyncio.ensure_future(
+                server.keepalive(self._heartbeat_interval,
+                                 self._heartbeat_misses))
+            await server.process_events(
+                functools.partial(self._handle_event, site=site))
+        finally:
+            if keepalive is not None:
+                keepalive.cancel()
+                await asyncio.gather(keepalive, return_exceptions=True)
+            server.disconnect()
+        return 0
+
+    def _terminate(self):
+        """stop processing the events of all servers"""
+        for site in self._sites:
+            site.server.terminate()
+
+    async def _run(self):
+        """main coroutine"""
+        loop = asyncio.get_event_loop()
+        try:
+            loop.add_signal_handler(signal.SIGINT, self._terminate)
+        except NotImplementedError:
+            pass
+
+        self._mqtt_wakeup = asyncio.Event()
+        self._publisher.set_scheduler(loop.call_later)
+        if not self._mqtt_connect():
+            return 1
+        self._startup_mark('mqtt connect')
+        mqtt_task = asyncio.ensure_future(self._mqtt_loop())
+        stats = None
+        if self._stats_interval > 0 or self._publisher.spool is not None:
+            stats = asyncio.ensure_future(self._stats_loop())
+        try:
+            results = await asyncio.gather(
+                *[self._serve(site) for site in self._sites])
+        finally:
+            self._terminate()
+            tasks = [mqtt_task] if stats is None else [mqtt_task, stats]
+            for task in tasks:
+                task.cancel()
+            # let the tasks finish, nothing is left pending on the loop
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._publisher.close()
+            self.log.info('disconnect MQTT')
+            self._mqtt_client.disconnect()
+        return max(results)
+
+    def run(self):
+        """main run method"""
+        self.log.debug('run')
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(self._run())
+        finally:
+            loop.close()
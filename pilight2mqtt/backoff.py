@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+retry delays for reconnects
+"""
+
+import random
+
+__all__ = ['Backoff']
+
+
+class Backoff:
+    """jittered exponential backoff
+
+       The delay starts at initial and grows by factor up to maximum. Each
+       delay is shortened by a random part of up to jitter, so that clients
+       losing their connection at the same time do not retry in lockstep.
+    """
+
+    def __init__(self, initial=0.25, maximum=30.0, factor=2.0, jitter=0.5,
+                 rand=random.random):
+        """initialize"""
+        self._initial = initial
+        self._maximum = maximum
+        self._factor = factor
+        self._jitter = jitter
+        self._rand = rand
+        self.attempts = 0
+
+    def reset(self):
+        """start over with the initial delay"""
+        self.attempts = 0
+
+    def next(self):
+        """the delay before the next attempt"""
+        delay = min(self._maximum,
+                    self._initial * self._factor ** self.attempts)
+        if delay < self._maximum:
+            # the exponent stops growing with the delay, it can not overflow
+            self.attempts += 1
+        return delay * (1 - self._jitter * self._rand())
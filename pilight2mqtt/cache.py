@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+cache of discovered pilight servers
+
+Discovery waits for multicast answers, which is slow and unreliable on
+some networks. The servers found are kept in a state file, so a restart
+can connect to a known server right away.
+"""
+
+import os
+import threading
+import time
+
+from pilight2mqtt import codec
+from pilight2mqtt.log import Loggable
+
+__all__ = ['DiscoveryCache', 'default_path']
+
+CACHE_TTL = 24 * 3600
+
+
+def default_path():
+    """the state file in the user's cache directory"""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pilight2mqtt', 'discovery.json')
+
+
+class DiscoveryCache(Loggable):
+    """servers found by discovery, valid for ttl seconds"""
+
+    def __init__(self, path, ttl=CACHE_TTL):
+        """initialize"""
+        self._path = path
+        self._ttl = ttl
+        self._thread = None
+
+    @property
+    def path(self):
+        """path of the state file"""
+        return self._path
+
+    def load(self, now=None):
+        """the cached (address, port) pairs, empty if missing or expired"""
+        now = time.time() if now is None else now
+        try:
+            with open(self._path, 'rb') as state:
+                data = codec.loads(state.read())
+            if now - data['timestamp'] > self._ttl:
+                self.log.debug('discovery cache expired')
+                return []
+            return [(address, int(port)) for address, port in data['servers']]
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            self.log.debug('no usable discovery cache: %s', ex)
+            return []
+
+    def store(self, servers, now=None):
+        """replace the cached servers, returns False if it failed"""
+        data = {'timestamp': time.time() if now is None else now,
+                'servers': [[address, port] for address, port in servers]}
+        tmp = '%s.tmp' % self._path
+        try:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            with open(tmp, 'wb') as state:
+                state.write(codec.dumps(data))
+            os.replace(tmp, self._path)
+        except OSError as ex:
+            self.log.warning('could not write discovery cache: %s', ex)
+            return False
+        return True
+
+    def refresh(self, search):
+        """store the result of search() on a background thread"""
+        def run():  # pylint: disable=missing-docstring
+            servers = search()
+            if servers:
+                self.store(servers)
+        self._thread = threading.Thread(target=run, name='discovery')
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+json codec of pilight2mqtt
+
+orjson or ujson is used when it is installed, the json module of the
+standard library otherwise. Frames are decoded from bytes and messages
+encoded to bytes, without going through str where the backend allows it.
+"""
+
+__all__ = ['BACKENDS', 'DecodeError', 'backend', 'dumps', 'loads',
+           'message', 'use']
+
+BACKENDS = ('orjson', 'ujson', 'json')
+
+# all backends raise a subclass of ValueError for invalid json
+DecodeError = ValueError  # pylint: disable=invalid-name
+
+
+def _orjson():
+    """functions of the orjson backend"""
+    import orjson
+
+    def dumps(obj, sort_keys=False):
+        """serialize obj to bytes"""
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS
+                            if sort_keys else None)
+
+    def message(obj):
+        """serialize obj to a message for pilight"""
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    return orjson.loads, dumps, message
+
+
+def _ujson():
+    """functions of the ujson backend"""
+    import ujson
+
+    def loads(data):
+        """deserialize bytes"""
+        if isinstance(data, (memoryview, bytearray)):
+            data = bytes(data)
+        return ujson.loads(data)
+
+    def dumps(obj, sort_keys=False):
+        """serialize obj to bytes"""
+        return ujson.dumps(obj, sort_keys=sort_keys).encode('utf-8')
+
+    def message(obj):
+        """serialize obj to a message for pilight"""
+        return (ujson.dumps(obj) + '\n').encode('utf-8')
+
+    return loads, dumps, message
+
+
+def _json():
+    """functions of the json backend"""
+    import json
+    decoder = json.JSONDecoder()
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    sorted_encoder = json.JSONEncoder(separators=(',', ':'), sort_keys=True)
+
+    def loads(data):
+        """deserialize bytes"""
+        if not isinstance(data, str):
+            data = str(data, 'utf-8')
+        return decoder.decode(data)
+
+    def dumps(obj, sort_keys=False):
+        """serialize obj to bytes"""
+        encode = sorted_encoder.encode if sort_keys else encoder.encode
+        return encode(obj).encode('utf-8')
+
+    def message(obj):
+        """serialize obj to a message for pilight"""
+        return (encoder.encode(obj) + '\n').encode('utf-8')
+
+    return loads, dumps, message
+
+
+_FACTORIES = {'orjson': _orjson, 'ujson': _ujson, 'json': _json}
+
+
+def use(name='auto'):
+    """select the backend called name, auto picks the fastest installed"""
+    global backend, loads, dumps, message  # pylint: disable=global-statement
+    if name == 'auto':
+        names = BACKENDS
+    elif name in _FACTORIES:
+        names = (name,)
+    else:
+        raise ValueError('unknown json codec "%s"' % name)
+    for candidate in names:
+        try:
+            loads, dumps, message = _FACTORIES[candidate]()
+        except ImportError:
+            if name != 'auto':
+                raise
+            continue
+        backend = candidate
+        return backend
+
+
+backend = None  # pylint: disable=invalid-name
+loads = dumps = message = None  # pylint: disable=invalid-name
+use()
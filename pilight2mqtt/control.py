@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+control channel of pilight2mqtt
+
+Commands received through MQTT are sent on connections of their own. These
+connections do not receive events, so an answer can never be mistaken for
+an event and the event stream can never swallow an answer.
+"""
+
+import queue
+import threading
+
+from pilight2mqtt import codec
+from pilight2mqtt.core import (ConnectionLostException,
+                               Loggable,
+                               PilightServer)
+
+__all__ = ['ControlConnection', 'ControlPool', 'probe']
+
+CONTROL_TIMEOUT = 2
+CONTROL_IDENTIFY = {
+    'action': 'identify',
+    'options': {
+        'receiver': 0,
+        'core': 0,
+        'config': 0,
+        'forward': 0
+    },
+    'uuid': '0000-d0-63-00-000001',
+    'media': 'all'
+}
+
+
+class ControlConnection(PilightServer):
+    """connection to pilight that is only used to send commands"""
+
+    IDENTIFY_MSG = codec.message(CONTROL_IDENTIFY)
+
+    def _on_timeout(self):
+        """a missing answer is an error, not a quiet event stream"""
+        raise ConnectionLostException('pilight did not answer in time')
+
+    def receive(self):
+        """the next answer, e.g. to a command written with send"""
+        frame = self._read()
+        if not frame:
+            raise ConnectionLostException('connection closed')
+        return codec.loads(frame)
+
+
+class ControlPool(Loggable):
+    """pool of control connections to one pilight server
+
+       Connections are opened on first use and reused afterwards. A
+       connection that fails is dropped and replaced on the next command.
+    """
+
+    def __init__(self, address, port, size=1, timeout=CONTROL_TIMEOUT):
+        """initialize"""
+        self.log.debug('__init__(%s, %s, %d)', address, port, size)
+        self._address = address
+        self._port = port
+        self._size = size
+        self._timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    @classmethod
+    def for_server(cls, server, size=1, timeout=CONTROL_TIMEOUT):
+        """create a pool connecting to the same pilight as server"""
+        return cls(server.address, server.port, size=size, timeout=timeout)
+
+    def _acquire(self):
+        """get an idle connection, opening one if the pool is not full"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self._size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get(timeout=self._timeout)
+        conn = ControlConnection(self._address, self._port,
+                                 timeout=self._timeout)
+        try:
+            if not conn.connect():
+                raise ConnectionLostException('identify failed')
+        except Exception:
+            self._discard(conn)
+            raise
+        return conn
+
+    def _release(self, conn):
+        """return a healthy connection to the pool"""
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        """close a broken connection and free its slot"""
+        conn.disconnect()
+        with self._lock:
+            self._created -= 1
+
+    def _call(self, method, *args, retries=1):
+        """call method on a control connection, retry on a fresh one"""
+        for attempt in range(retries + 1):
+            try:
+                conn = self._acquire()
+            except queue.Empty:
+                self.log.error('no control connection available')
+                return False
+            except (ConnectionLostException, OSError) as ex:
+                self.log.warning('could not open control connection: %s', ex)
+                continue
+            try:
+                suc = getattr(conn, method)(*args)
+            except (ConnectionLostException, OSError, ValueError) as ex:
+                self.log.warning('control connection failed (%d): %s',
+                                 attempt, ex)
+                self._discard(conn)
+                continue
+            self._release(conn)
+            return suc
+        return False
+
+    def send_check_success(self, msg_dct):
+        """send message and check that it was successfull"""
+        return self._call('send_check_success', msg_dct)
+
+    def set_device_state(self, device, state, values=None):
+        """update the state and values of a device in pilight"""
+        return self._call('set_device_state', device, state, values)
+
+    def close(self):
+        """close all idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+def probe(address, port, timeout=CONTROL_TIMEOUT):
+    """check that pilight accepts connections at address:port"""
+    conn = ControlConnection(address, port, timeout=timeout)
+    try:
+        return conn.connect()
+    except (ConnectionLostException, OSError, ValueError):
+        return False
+    finally:
+        conn.disconnect()
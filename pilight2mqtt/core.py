@@ -9,89 +9,335 @@ from __future__ import print_function
 
 import socket
 import sys
-import re
-import json
 import signal
+import collections
+import functools
 import logging
+import threading
+import time
 
-import paho.mqtt.client as mqtt
-
+from pilight2mqtt import codec
+from pilight2mqtt.backoff import Backoff
 from pilight2mqtt.discover import discover
-
-__all__ = ['Pilight2MQTT', 'PilightServer']
+from pilight2mqtt.dispatch import (TOPIC_CACHE_SIZE, EventDispatcher,
+                                   TopicCache)
+from pilight2mqtt.event import UPDATE, parse_events
+from pilight2mqtt.eventqueue import QUEUE_SIZE, WorkerPool
+from pilight2mqtt.framing import DELIM, RECV_SIZE, FrameDecoder
+from pilight2mqtt.log import Loggable, traffic
+from pilight2mqtt.metrics import metrics
+from pilight2mqtt.publish import DRAIN_RATE, Publisher
+from pilight2mqtt.registry import DeviceRegistry
+from pilight2mqtt.router import CommandRouter
+from pilight2mqtt.startup import FIRST_EVENT
+from pilight2mqtt.state import StateStore
+
+__all__ = ['Pilight2MQTT', 'PilightProtocol', 'PilightServer']
 
 DISCOVER_SCHEMA = "urn:schemas-upnp-org:service:pilight:1"
-DELIM = b'\n\n'
+MQTT_KEEPALIVE = 60
+HEARTBEAT_INTERVAL = 60
+HEARTBEAT_MISSES = 2
+IDENTIFY = {
+    'action': 'identify',
+    'options': {
+        'receiver': 1,
+        'core': 0,
+        'config': 1,
+        'forward': 1
+    },
+    'uuid': '0000-d0-63-00-000000',
+    'media': 'all'
+}
+# constant messages are serialized once
+HEART = b'HEART'
+BEAT = b'BEAT'
+REQUEST_CONFIG = codec.message({'action': 'request config'})
+REQUEST_VALUES = codec.message({'action': 'request values'})
+
+FRAMES_RECEIVED = metrics.counter(
+    'pilight2mqtt_frames_received_total',
+    'Frames received from pilight')
+READ_SECONDS = metrics.histogram(
+    'pilight2mqtt_read_seconds',
+    'Time from receiving a frame from pilight until it is handed on')
+PARSE_SECONDS = metrics.histogram(
+    'pilight2mqtt_parse_seconds',
+    'Time to parse a frame')
+HANDLE_SECONDS = metrics.histogram(
+    'pilight2mqtt_handle_seconds',
+    'Time to handle an event, from parsing to queueing its messages')
+EVENTS_FAILED = metrics.counter(
+    'pilight2mqtt_events_failed_total',
+    'Frames that could not be handled')
+RECONNECTS = metrics.counter(
+    'pilight2mqtt_reconnects_total',
+    'Successful reconnects to pilight')
+HEARTBEAT_RTT = metrics.histogram(
+    'pilight2mqtt_heartbeat_rtt_seconds',
+    'Round trip time of heartbeats to pilight')
+HEARTBEATS_MISSED = metrics.counter(
+    'pilight2mqtt_heartbeats_missed_total',
+    'Heartbeats pilight did not answer within the heartbeat interval')
+COMMANDS_RECEIVED = metrics.counter(
+    'pilight2mqtt_commands_received_total',
+    'Commands received through MQTT')
+COMMANDS_REJECTED = metrics.counter(
+    'pilight2mqtt_commands_rejected_total',
+    'Commands that were invalid or rejected by the device registry')
+
+
+def is_response(frame):
+    """check if a frame answers a request instead of being an event"""
+    return frame == BEAT or frame.startswith(b'{"status"')
 
 
 class ConnectionLostException(Exception):
     """Connection lost exception"""
 
 
-class Loggable:  # pylint: disable=too-few-public-methods
-    """base class for objects that need logging"""
+class PilightProtocol(Loggable):
+    """what talking to pilight takes, independent of the I/O model
 
-    @property
-    def log(self):
-        """log message to a logger named like the class"""
-        return logging.getLogger(self.__class__.__name__)
+       PilightServer reads from a blocking socket, the asyncio engine has a
+       server of its own. Both frame, build and record messages alike.
+    """
 
-
-class PilightServer(Loggable):
-    """class to interact with pilight"""
+    IDENTIFY_MSG = codec.message(IDENTIFY)
 
     @classmethod
-    def discover(cls):
-        """discover pilight servers in the network"""
+    def discover(cls, recv_size=RECV_SIZE, timeout=2, cache=None):
+        """discover pilight servers in the network
+
+           The servers in cache, a DiscoveryCache, are tried first. If one
+           of them answers it is used, otherwise the servers are
+           discovered. The cache is only refreshed, or the discovered
+           servers stored, once the server was connected to.
+        """
         log = logging.getLogger('PilightAutoDiscover')
 
+        if cache is not None:
+            # control imports this module
+            from pilight2mqtt.control import probe
+            for location, port in cache.load():
+                if probe(location, port):
+                    log.info('Using cached server at %s:%d', location, port)
+                    server = cls(location, port, recv_size=recv_size)
+                    server._on_connected = functools.partial(
+                        cache.refresh,
+                        functools.partial(discover, DISCOVER_SCHEMA, timeout))
+                    return server
+                log.info('Cached server at %s:%d does not answer',
+                         location, port)
+
         log.debug('trying to discover servers')
-        responses = discover(DISCOVER_SCHEMA)
-        if not responses:
+        servers = discover(DISCOVER_SCHEMA, timeout, count=1)
+        if not servers:
             log.error('failed to locate any servers - terminating')
             sys.exit(1)
-        locationsrc = re.search('Location:([0-9.]+):([0-9.]+)',
-                                str(responses[0]),
-                                re.IGNORECASE)
-        if locationsrc:
-            location = locationsrc.group(1)
-            port = locationsrc.group(2)
-        else:
-            log.error("Whoops, could not find any servers")
-            sys.exit(1)
-        log.info('Found server at %s:%d', location, int(port))
-        return PilightServer(location, int(port))
-
-    def __init__(self, address, port):
+        location, port = servers[0]
+        log.info('Found server at %s:%d', location, port)
+        server = cls(location, port, recv_size=recv_size)
+        if cache is not None:
+            server._on_connected = functools.partial(cache.store, servers)
+        return server
+
+    def __init__(self, address, port, recv_size=RECV_SIZE):
         """initialize"""
         self.log.debug('__init__(%s, %s)', address, port)
         self._address = address
         self._port = port
-        self._socket = None
         self._should_terminate = True
         self._event_handler = None
+        self._capture = None
+        self._decoder = FrameDecoder(recv_size, DELIM)
+        self._received = 0
+        self._backoff = Backoff()
+        self._on_connected = None
+
+    def _connected(self):
+        """the first connection succeeded, e.g. update the discovery cache"""
+        callback, self._on_connected = self._on_connected, None
+        if callback is not None:
+            callback()
+
+    def _frame_received(self, frame):
+        """account for a frame read from pilight and record it"""
+        FRAMES_RECEIVED.inc()
+        READ_SECONDS.observe(time.perf_counter() - self._received)
+        traffic('pilight>', frame)
+        if self._capture is not None:
+            self._capture.write(frame)
+
+    def record(self, capture):
+        """record every received frame with capture, e.g. a CaptureWriter"""
+        self._capture = capture
+
+    @property
+    def address(self):
+        """address of the pilight server"""
+        return self._address
+
+    @property
+    def port(self):
+        """port of the pilight server"""
+        return int(self._port)
+
+    @staticmethod
+    def _encode(msg_dct):
+        """message for pilight, msg_dct may already be serialized"""
+        if isinstance(msg_dct, bytes):
+            return msg_dct
+        return codec.message(msg_dct)
+
+    @staticmethod
+    def _control_msg(device, state, values=None):
+        """build the message to update the state of a device"""
+        code = {'device': device}
+        if state is not None:
+            code['state'] = state
+        if values:
+            code['values'] = values
+        return {
+            'action': 'control',
+            'code': code
+        }
+
+    def send(self, msg_dct):
+        """send json data without waiting for a response"""
+        raise NotImplementedError
+
+    def request_config(self):
+        """ask pilight to send its config"""
+        self.send(REQUEST_CONFIG)
+
+    def request_values(self):
+        """ask pilight to send the current values of all devices"""
+        self.send(REQUEST_VALUES)
+
+    def resume(self):
+        """bring the bridge up to date after a reconnect
+
+           Events that happened while disconnected are lost, so the current
+           config and values are requested. They arrive as events.
+        """
+        self.request_config()
+        self.request_values()
+
+
+class PilightServer(PilightProtocol):
+    """class to interact with pilight"""
+
+    def __init__(self, address, port, recv_size=RECV_SIZE, timeout=1):
+        """initialize"""
+        super().__init__(address, port, recv_size=recv_size)
+        self._timeout = timeout
+        self._socket = None
+        self._idle_callback = None
+        self._heartbeat_interval = 0
+        self._heartbeat_misses = HEARTBEAT_MISSES
+        self._beats = collections.deque()
+        self._late_beats = 0
+        self._beat_due = 0
+        self._missed = 0
+        self._lines = None
+        self._stopped = threading.Event()
 
     def _readlines(self):
-        buffer = b''
+        """yield frames from the socket until terminated
+
+           Answers to the heartbeats of keepalive are not yielded.
+        """
+        decoder = self._decoder
         while not self._should_terminate:
+            line = decoder.next_frame()
+            if line is not None:
+                self._frame_received(line)
+                if line == BEAT and (self._beats or self._late_beats):
+                    self._on_beat()
+                    continue
+                yield line
+                continue
+            if self._heartbeat_interval > 0:
+                self._check_heartbeat()
+            sock = self._socket
+            if sock is None:
+                raise ConnectionLostException('connection closed')
             try:
-                data = self._socket.recv(1024)
-                buffer += data
-                self.log.debug('_readlines buffer is %s', buffer)
-                while buffer.find(DELIM) != -1:
-                    line, buffer = buffer.split(DELIM, 1)
-                    self.log.debug('_readlines yield line %s', line)
-                    yield line
+                if not decoder.recv_from(sock):
+                    raise ConnectionLostException(
+                        'connection closed by pilight')
+                self._received = time.perf_counter()
             except socket.timeout:
-                continue
+                self._on_timeout()
+
+    def keepalive(self, interval=HEARTBEAT_INTERVAL,
+                  misses=HEARTBEAT_MISSES):
+        """send a heartbeat every interval seconds while reading events
+
+           The connection is considered lost once misses heartbeats in a
+           row were not answered within the interval. 0 disables it.
+        """
+        self._heartbeat_interval = interval
+        self._heartbeat_misses = misses
+        self._reset_heartbeat()
+
+    def _reset_heartbeat(self):
+        """forget outstanding heartbeats, e.g. after a reconnect"""
+        self._beats.clear()
+        self._late_beats = 0
+        self._missed = 0
+        self._beat_due = time.monotonic() + self._heartbeat_interval
+
+    def _check_heartbeat(self):
+        """send the next heartbeat when it is due, count missed ones"""
+        now = time.monotonic()
+        if now < self._beat_due:
+            return
+        if self._beats and now - self._beats[-1] >= self._heartbeat_interval:
+            self._missed += 1
+            HEARTBEATS_MISSED.inc()
+            # answers that still arrive are not timed against later beats
+            self._late_beats += len(self._beats)
+            self._beats.clear()
+            if self._missed >= self._heartbeat_misses:
+                raise ConnectionLostException(
+                    'pilight missed %d heartbeats' % self._missed)
+        self._beat_due = now + self._heartbeat_interval
+        traffic('pilight<', HEART)
+        self._socket.send(HEART)
+        self._beats.append(now)
+
+    def _on_beat(self):
+        """pilight answered the oldest outstanding heartbeat
+
+           Late answers to missed heartbeats are dropped without timing.
+        """
+        if self._late_beats:
+            self._late_beats -= 1
+            return
+        HEARTBEAT_RTT.observe(time.monotonic() - self._beats.popleft())
+        self._missed = 0
+
+    def _on_timeout(self):
+        """called when no data arrived within the socket timeout"""
+        if self._idle_callback is not None:
+            self._idle_callback()
 
     def _read(self):
-        """read data from socket"""
-        self.log.debug('read')
-        lines_generator = self._readlines()
-        text = next(lines_generator)
-        self.log.debug('_read received %s', text)
-        return text
+        """read data from socket
+
+           Frames come from one _readlines iterator per connection. It is
+           dropped when reading fails, the next read starts a new one.
+        """
+        lines = self._lines
+        if lines is None:
+            lines = self._lines = self._readlines()
+        try:
+            return next(lines, b'')
+        except Exception:
+            self._lines = None
+            raise
 
     def send_check_success(self, msg_dct):
         """send message and check that it was successfull"""
@@ -104,15 +350,28 @@ class PilightServer(Loggable):
     def send_json(self, msg_dct):
         """send json data and read response, which is also json"""
         self.log.debug('_send_json')
-        msg = bytes(json.dumps(msg_dct)+'\n', 'utf-8')
-        response = self.send_raw(msg)
+        response = self.send_raw(self._encode(msg_dct))
         if self._should_terminate:
             return {}
-        return json.loads(response.decode("utf-8"))
+        return codec.loads(response)
+
+    def send(self, msg_dct):
+        """send json data without waiting for a response
+
+           The response arrives through process_events.
+        """
+        self.log.debug('send')
+        sock = self._socket
+        if sock is None:
+            raise ConnectionLostException('connection closed')
+        msg = self._encode(msg_dct)
+        traffic('pilight<', msg)
+        sock.send(msg)
 
     def send_raw(self, msg):
         """send and read raw data"""
         self.log.debug('_send_raw')
+        traffic('pilight<', msg)
         self._socket.send(msg)
         response = self._read()
         return response
@@ -121,9 +380,24 @@ class PilightServer(Loggable):
         """open a socket to pilight"""
         self.log.debug('open socket')
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.settimeout(1)
+        self._socket.settimeout(self._timeout)
         self._socket.connect((self._address, int(self._port)))
-        self._should_terminate = False
+        self._decoder.reset()
+        self._lines = None
+
+    def _close_socket(self):
+        """close the socket to pilight"""
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+        self._lines = None
+
+    def _identify(self):
+        """open a socket and identify"""
+        self._close_socket()
+        self._open_socket()
+        self._reset_heartbeat()
+        return self.send_check_success(self.IDENTIFY_MSG)
 
     def connect(self, cb_recv=None):
         """initialize connection progress.
@@ -132,71 +406,110 @@ class PilightServer(Loggable):
         self.log.info('connect')
         if cb_recv:
             self._event_handler = cb_recv
-        self._open_socket()
-        suc = self.send_check_success({
-            'action': 'identify',
-            'options': {
-                'receiver': 1,
-                'core': 0,
-                'config': 1,
-                'forward': 1
-            },
-            'uuid': '0000-d0-63-00-000000',
-            'media': 'all'
-        })
-        return suc
+        self._should_terminate = False
+        self._stopped.clear()
+        if not self._identify():
+            return False
+        self._connected()
+        return True
 
     def reconnect(self):
-        """try to reconnect if the connection got lost"""
-        try:
-            connected = False
-            while not self._should_terminate and not connected:
-                connected = self.connect()
-            return connected
-        except Exception:  # pylint: disable=broad-except
-            pass
+        """try to reconnect until connected or terminated
+
+           Attempts are spaced by a jittered exponential backoff.
+        """
+        while not self._should_terminate:
+            try:
+                if self._identify():
+                    self.log.info('reconnected to pilight')
+                    self._backoff.reset()
+                    RECONNECTS.inc()
+                    return True
+            except (ConnectionLostException, OSError, ValueError) as ex:
+                self.log.warning('reconnect failed: %s', ex)
+            self._close_socket()
+            self._stopped.wait(self._backoff.next())
         return False
 
     def disconnect(self):
         """disconnect from pilight"""
         self.log.info('disconnect')
         self._should_terminate = True
-        if self._socket:
-            self._socket.close()
-            self._socket = None
+        self._stopped.set()
+        self._close_socket()
 
-    def process_events(self, callback):
-        """process incoming events from pilight"""
+    def process_events(self, callback, idle=None):
+        """process incoming events from pilight
+           idle is called whenever no data arrived within the timeout
+        """
         self.log.info('process_events')
-        while not self._should_terminate:
-            response = self._read()
-            if not self._should_terminate:
-                self.log.debug('call callback')
-                callback(response)
+        self._idle_callback = idle
+        try:
+            while not self._should_terminate:
+                try:
+                    response = self._read()
+                except (ConnectionLostException, OSError) as ex:
+                    if self._should_terminate:
+                        break
+                    self.log.warning('lost connection to pilight: %s', ex)
+                    if not self.reconnect():
+                        break
+                    self.resume()
+                    continue
+                if not self._should_terminate:
+                    callback(response)
+        finally:
+            self._idle_callback = None
 
     def terminate(self):
         """indicate that the system should shut down"""
         self.log.info('terminate')
         self._should_terminate = True
+        self._stopped.set()
 
     def heartbeat(self):
         """send and read heart beat to/from pilight"""
-        response = self.send_raw(b'HEART')
-        if response == b'BEAT':
+        response = self.send_raw(HEART)
+        if response == BEAT:
             return True
         return False
 
-    def set_device_state(self, device, state):
-        """update the state of a device in pilight"""
-        self.log.info('set_device_state: "%s" to "%s"', device, state)
-        msg = {
-            'action': 'control',
-            'code': {
-                'device': device,
-                'state': state
-            }
-        }
-        return self.send_check_success(msg)
+    def set_device_state(self, device, state, values=None):
+        """update the state and values of a device in pilight"""
+        self.log.info('set_device_state: "%s" to "%s" %s',
+                      device, state, values or '')
+        return self.send_check_success(
+            self._control_msg(device, state, values))
+
+
+class Site:  # pylint: disable=too-few-public-methods
+    """a pilight server and the state the bridge keeps for it"""
+
+    def __init__(self, server, prefix, control=None, name=None):
+        """initialize, prefix is the topic prefix of the server's devices"""
+        self.name = name
+        self.server = server
+        self.control = control if control is not None else server
+        self.topics = TopicCache(prefix)
+        self.registry = DeviceRegistry(self.topics)
+        self.router = None
+        self._qualified = {}
+
+    def qualify(self, device):
+        """device name that is unique among all servers
+
+           The same string is returned for a device every time, so the
+           change filter keys on one shared string per device.
+        """
+        if self.name is None:
+            return device
+        name = self._qualified.get(device)
+        if name is None:
+            if len(self._qualified) >= TOPIC_CACHE_SIZE:
+                self._qualified.clear()
+            name = self._qualified[device] = sys.intern(
+                '%s/%s' % (self.name, device))
+        return name
 
 
 class Pilight2MQTT(Loggable):
@@ -208,27 +521,164 @@ class Pilight2MQTT(Loggable):
                  mqtt_username=None,
                  mqtt_password=None,
                  mqtt_port=1883,
-                 mqtt_topic='PILIGHT'):
-        """initialize"""
+                 mqtt_topic='PILIGHT',
+                 control=None,
+                 publish_window=0,
+                 change_filter=None,
+                 dispatcher=None,
+                 stats_interval=0,
+                 workers=0,
+                 queue_size=QUEUE_SIZE,
+                 queue_policy='drop-oldest',
+                 heartbeat_interval=HEARTBEAT_INTERVAL,
+                 heartbeat_misses=HEARTBEAT_MISSES,
+                 state=None,
+                 rollups=None,
+                 startup=None,
+                 spool=None,
+                 spool_rate=DRAIN_RATE):
+        """initialize
+
+           server can also be a dictionary of servers by name. Each server
+           then has its own topics below $TOPIC/<name>, commands sent to
+           $TOPIC/set go to the server that knows the device.
+           control sends the commands received through MQTT, e.g. a
+           CommandScheduler, with several servers a dictionary of them by
+           name. By default each server gets a ControlPool of its own, so
+           commands are not sent on the connection events are read from.
+           publish_window is the number of seconds messages are collected
+           before they are published, 0 publishes once per event.
+           change_filter, e.g. a ChangeFilter, drops repeated readings.
+           dispatcher maps event types to readings, see EventDispatcher.
+           stats_interval is the number of seconds between publications of
+           the metrics to $TOPIC/bridge/stats, 0 disables them.
+           workers is the number of threads handling events, 0 handles
+           them on the thread reading from pilight. Events wait for a
+           worker in queues of queue_size frames, queue_policy is what
+           happens when they are full, see EventQueue.
+           A heartbeat is sent to pilight every heartbeat_interval seconds,
+           after heartbeat_misses unanswered ones in a row it reconnects.
+           state, a StateStore, keeps the latest readings and decides how
+           they are published, by default retained with qos 0, and of
+           which readings the spool only keeps the latest value.
+           rollups, e.g. Rollups, aggregates numeric readings over windows
+           and publishes them to $TOPIC/status/<device>/<reading>/<window>.
+           startup, a StartupProfile, is told when the connections are
+           made and the first event was handled.
+           spool, a Spool, keeps the messages published while the broker
+           can not be reached and publishes spool_rate of them per second
+           once it is back.
+        """
         self.log.debug('__init__')
         self._mqtt_host = mqtt_host
         self._mqtt_port = mqtt_port
         self._mqtt_topic = mqtt_topic
-        self._server = server
+        if isinstance(server, dict):
+            controls = control or {}
+            self._sites = [Site(server[name], '%s/%s' % (mqtt_topic, name),
+                                controls.get(name) or
+                                self._default_control(server[name]),
+                                name=name)
+                           for name in sorted(server)]
+        else:
+            if control is None:
+                control = self._default_control(server)
+            self._sites = [Site(server, mqtt_topic, control)]
+        self._server = self._sites[0].server
+        self._change_filter = change_filter
+        self._state = state if state is not None else StateStore()
+        self._rollups = rollups
+        self._startup = startup
+        self._dispatcher = dispatcher if dispatcher is not None \
+            else EventDispatcher()
+        self._stats_interval = stats_interval
+        self._stats_due = 0
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_misses = heartbeat_misses
+        self._stats_topic = '%s/bridge/stats' % mqtt_topic
         self._mqtt_username = mqtt_username
         self._mqtt_password = mqtt_password
 
+        self._routers = []
+        for site in self._sites:
+            site.router = CommandRouter(site.topics.prefix, functools.partial(
+                self._on_command, site=site))
+            self._routers.append(site.router)
+        if len(self._sites) > 1:
+            self._routers.append(CommandRouter(mqtt_topic, self._on_command))
+        self._client = None
+        self._publisher = Publisher(None, publish_window, spool,
+                                    spool_rate)
+        self._workers = WorkerPool(self._handle_event, workers, queue_size,
+                                   queue_policy) if workers > 0 else None
+        self._register_metrics()
+
+    @staticmethod
+    def _default_control(server):
+        """what sends the commands of server without a control given"""
+        from pilight2mqtt.control import ControlPool
+        return ControlPool.for_server(server)
+
+    def _close_controls(self):
+        """close the control connections of all servers"""
+        for site in self._sites:
+            if site.control is not site.server:
+                site.control.close()
+
+    @property
+    def _mqtt_client(self):
+        """the paho client, created and paho imported on first use"""
+        if self._client is None:
+            self._mqtt_client = self._create_mqtt_client()
+        return self._client
+
+    @_mqtt_client.setter
+    def _mqtt_client(self, client):
+        """use client to talk to the broker"""
+        self._client = client
+        self._publisher.client = client
+
+    def _create_mqtt_client(self):
+        """a paho client with the callbacks and routes of the bridge"""
+        import paho.mqtt.client as mqtt
+
         def on_connect(client, userdata, flags, result_code):
             # pylint: disable=missing-docstring
             return self._on_connect(client, userdata, flags, result_code)
 
+        def on_disconnect(client, userdata, result_code):
+            # pylint: disable=missing-docstring
+            return self._on_disconnect(client, userdata, result_code)
+
         def on_message(client, userdata, msg):
             # pylint: disable=missing-docstring
             return self._on_message(client, userdata, msg)
 
-        self._mqtt_client = mqtt.Client()
-        self._mqtt_client.on_connect = on_connect
-        self._mqtt_client.on_message = on_message
+        client = mqtt.Client()
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        client.on_message = on_message
+        for router in self._routers:
+            router.attach(client)
+        return client
+
+    def _register_metrics(self):
+        """expose the counters of the bridge's parts as metrics"""
+        change_filter = self._change_filter
+        metrics.gauge('pilight2mqtt_readings_suppressed',
+                      'Readings dropped by the change filter',
+                      lambda: change_filter.suppressed
+                      if change_filter is not None else 0)
+        metrics.gauge('pilight2mqtt_events_unknown',
+                      'Events of unsupported types',
+                      lambda: sum(self._dispatcher.unknown.values()))
+        metrics.gauge('pilight2mqtt_devices',
+                      'Devices known to the bridge',
+                      lambda: sum(len(site.registry)
+                                  for site in self._sites))
+        metrics.gauge('pilight2mqtt_publish_pending',
+                      'Messages waiting for the next flush',
+                      lambda: len(self._publisher))
 
     def _on_connect(self, client, userdata, flags, result_code):
         """execute setup of mqtt, i.e. subscribe to a channel"""
@@ -240,73 +690,181 @@ class Pilight2MQTT(Loggable):
             self.log.debug(
                 "Connected with result code %s",
                 str(result_code))
+        self._publisher.connected = result_code == 0
 
         # Subscribing in on_connect() means that if we lose the connection and
         # reconnect then subscriptions will be renewed.
-        self.log.info('MQTT Subscribe %s', self._mqtt_topic)
-        client.subscribe("%s/#" % self._mqtt_topic)
+        subs = [sub for router in self._routers
+                for sub in router.subscriptions()]
+        if subs:
+            self.log.info('MQTT Subscribe %s/set', self._mqtt_topic)
+            client.subscribe(subs)
+        self._republish()
+
+    def _on_disconnect(self, client, userdata, result_code):
+        """spool messages until connected again"""
+        self._publisher.connected = False
+        if self._publisher.spool is not None:
+            self.log.warning('MQTT disconnected (%s), spooling messages',
+                             result_code)
+
+    def _republish(self):
+        """publish the retained state again, e.g. after the broker restarted"""
+        messages = self._state.snapshot()
+        if messages:
+            self.log.info('Republishing %d retained readings', len(messages))
+            for topic, value, qos, retain in messages:
+                self._publisher.add(topic, value, qos, retain)
+            self._publisher.flush()
 
     def _on_message(self, client, userdata, msg):
-        """process messages received from MQTT"""
-        self.log.debug("%s %s", msg.topic, str(msg.payload))
-        match = re.search('%s/set/(.*?)/STATE' % self._mqtt_topic, msg.topic)
-        if match:
-            device = match.group(1)
-            state = msg.payload
-            self._server.set_device_state(device, state.decode('utf-8'))
-
-    def _send_mqtt_msg(self, device, topic, payload):
-        self.log.info(
-            'Update for device "%s" on topic "%s", new value "%s"',
-            device, topic, payload)  # flake8: NOQA
-        (result, mid) = self._mqtt_client.publish(topic,
-                                                  payload=payload,
-                                                  qos=0,
-                                                  retain=False)
-        assert result == mqtt.MQTT_ERR_SUCCESS, (
-            "Failed to send message (%s)" % str(result))
-        self.log.debug('Message send with id %d', mid)
-
-    def _mktopic(self, device, reading):
-        return '%s/status/%s/%s' % (self._mqtt_topic, device, reading)
-
-    def _handle_event(self, evt):
-        """event handling for message from pilight"""
-        self.log.debug(evt)
+        """process messages received from MQTT without a verb callback"""
+        traffic('mqtt>', msg.topic, msg.payload)
+        for router in self._routers:
+            if router.route(msg.topic, msg.payload):
+                return
+
+    def _owner(self, device):
+        """the site of the server that knows device, or None"""
+        if len(self._sites) == 1:
+            return self._sites[0]
+        for site in self._sites:
+            if device in site.registry:
+                return site
+        return None
+
+    def _on_command(self, device, verb, payload, site=None):
+        """send a command received through MQTT to pilight
+
+           Without a site the command goes to the server owning device.
+        """
+        COMMANDS_RECEIVED.inc()
         try:
-            evt_dct = json.loads(evt.decode('utf-8'))
-            if evt_dct.get('origin', '') == 'update':
-                evt_type = evt_dct.get('type', None)
-                if evt_type == 1:  # switch
-                    for device in evt_dct.get('devices', []):
-                        self._send_mqtt_msg(
-                            device,
-                            self._mktopic(device, 'STATE'),
-                            evt_dct['values']['state'])
-                elif evt_type == 3:
-                    for device in evt_dct.get('devices', []):
-                        self._send_mqtt_msg(
-                            device,
-                            self._mktopic(device, 'HUMIDITY'),
-                            evt_dct['values']['humidity'])
-                        self._send_mqtt_msg(
-                            device,
-                            self._mktopic(device, 'TEMPERATURE'),
-                            evt_dct['values']['temperature'])
+            values = None
+            if verb == 'STATE':
+                state = payload.decode('utf-8')
+            elif verb == 'DIMLEVEL':
+                state, values = 'on', {'dimlevel': int(payload)}
+            else:
+                values = codec.loads(payload)
+                if not isinstance(values, dict):
+                    raise ValueError('VALUES must be a JSON object')
+                state = values.pop('state', None)
+        except ValueError as ex:
+            COMMANDS_REJECTED.inc()
+            self.log.warning('Invalid %s command for "%s": %s',
+                             verb, device, ex)
+            return
+        if site is None:
+            site = self._owner(device)
+            if site is None:
+                COMMANDS_REJECTED.inc()
+                self.log.warning('Rejected command: no pilight server knows '
+                                 'device "%s"', device)
+                return
+        error = site.registry.check(device, state)
+        if error is not None:
+            COMMANDS_REJECTED.inc()
+            self.log.warning('Rejected command: %s', error)
+            return
+        site.control.set_device_state(device, state, values or None)
+
+    def _send_mqtt_msg(self, device, topic, payload, qos=0, retain=False,
+                       compact=False):
+        """queue a message, it is published when the batch is flushed"""
+        traffic('mqtt<', topic, payload, device)
+        self._publisher.add(topic, payload, qos, retain, compact)
+
+    def _publish_reading(self, site, device, reading, value):
+        """publish a reading unless the change filter drops it
+
+           device and reading are the interned strings of the event, the
+           stages below key on them instead of building their own.
+        """
+        topic = site.topics.get(device, reading)
+        if self._rollups is not None:
+            self._publish_rollups(self._rollups.add(topic, reading, value))
+        device = site.qualify(device)
+        if self._change_filter is not None and not \
+                self._change_filter.accept(device, reading, value):
+            return
+        self._state.update(topic, reading, value)
+        qos, retain = self._state.options(reading)
+        self._send_mqtt_msg(device, topic, value, qos, retain,
+                            self._state.compact(reading))
+
+    def _publish_rollups(self, messages):
+        """queue the aggregates of finished rollup windows"""
+        for topic, reading, payload in messages:
+            qos, retain = self._state.options(reading)
+            traffic('mqtt<', topic, payload)
+            self._publisher.add(topic, payload, qos, retain)
+
+    def _handle_event(self, evt, site=None):
+        """event handling for message from pilight
+
+           site is the server the event came from, the first by default.
+        """
+        if site is None:
+            site = self._sites[0]
+        start = time.perf_counter()
+        try:
+            events = parse_events(evt)
+            PARSE_SECONDS.observe(time.perf_counter() - start)
+            for event in events:
+                if event.origin == UPDATE:
+                    self._handle_update(site, event)
                 else:
-                    raise RuntimeError('Unsupported event type %d' % evt_type)
+                    site.registry.load(event.values)
         except Exception as ex:  # pylint: disable=broad-except
+            EVENTS_FAILED.inc()
             self.log.error('%s: %s', ex.__class__.__name__, ex)
-
-    def run(self):
-        """main run method"""
-        self.log.debug('run')
-
-        def stop_server(signum, frame):  # pylint: disable=missing-docstring
-            self.log.debug("SIGINT")
-            self._server.terminate()
-        signal.signal(signal.SIGINT, stop_server)
-
+        HANDLE_SECONDS.observe(time.perf_counter() - start)
+        self._tick()
+        if self._startup is not None:
+            self._startup_mark(FIRST_EVENT)
+
+    def _startup_mark(self, phase):
+        """end a phase of the startup profile"""
+        startup = self._startup
+        if startup is not None:
+            startup.mark(phase)
+            if phase == FIRST_EVENT:
+                self._startup = None
+
+    def _handle_update(self, site, event):
+        """publish the readings of an update, or of a device's values"""
+        readings = self._dispatcher.readings(event.type)
+        if readings is not None:
+            values = event.values
+            devices = event.devices
+            site.registry.update(devices, values)
+            for device in devices:
+                for reading, key in readings:
+                    if key in values:
+                        self._publish_reading(site, device, reading,
+                                              values[key])
+
+    def _tick(self):
+        """periodic work, runs after every event and while pilight is idle"""
+        if self._rollups is not None:
+            self._publish_rollups(self._rollups.collect())
+        self._publisher.maybe_flush()
+        self._publisher.drain()
+        if self._stats_interval > 0:
+            now = time.monotonic()
+            if now >= self._stats_due:
+                self._stats_due = now + self._stats_interval
+                self._publish_stats()
+
+    def _publish_stats(self):
+        """publish a snapshot of all metrics"""
+        self._mqtt_client.publish(self._stats_topic,
+                                  codec.dumps(metrics.snapshot(),
+                                              sort_keys=True))
+
+    def _mqtt_connect(self):
+        """connect to the mqtt broker, returns True on success"""
         self.log.info('MQTT Connect %s:%d',
                       self._mqtt_host, self._mqtt_port)
         try:
@@ -315,27 +873,61 @@ class Pilight2MQTT(Loggable):
                 self._mqtt_client.username_pw_set(
                     self._mqtt_username,
                     self._mqtt_password)
-            self._mqtt_client.connect(self._mqtt_host, self._mqtt_port, 60)
+            self._mqtt_client.connect(self._mqtt_host,
+                                      self._mqtt_port,
+                                      MQTT_KEEPALIVE)
         except Exception as ex:  # pylint: disable=broad-except
             self.log.error('Failed to connect to MQTT server: %s', str(ex))
+            return False
+        return True
+
+    def run(self):
+        """main run method"""
+        self.log.debug('run')
+        if len(self._sites) > 1:
+            self.log.error('Several pilight servers need the asyncio engine')
+            return 1
+
+        def stop_server(signum, frame):  # pylint: disable=missing-docstring
+            self.log.debug("SIGINT")
+            self._server.terminate()
+        signal.signal(signal.SIGINT, stop_server)
+
+        if not self._mqtt_connect():
             return 1
         self._mqtt_client.loop_start()
+        self._startup_mark('mqtt connect')
 
         suc = self._server.connect()
         if not suc:
             self.log.error('Could not connect to server')
             return 1
+        self._startup_mark('pilight identify')
 
-        assert self._server.heartbeat()
-
-        def callback(event):  # pylint: disable=missing-docstring
-            self._handle_event(event)
+        if not self._server.heartbeat():
+            self.log.error('pilight did not answer the heartbeat')
+            self._server.disconnect()
+            return 1
+        self._server.keepalive(self._heartbeat_interval,
+                               self._heartbeat_misses)
+        self._server.request_config()
+        self._server.request_values()
+
+        if self._workers is not None:
+            self._workers.start()
+            callback = self._workers.put
+        else:
+            callback = self._handle_event
 
-        self._server.process_events(callback)
+        self._server.process_events(callback, idle=self._tick)
         self._server.disconnect()
+        if self._workers is not None:
+            self._workers.stop()
+        self._publisher.close()
+        self._close_controls()
 
         self.log.info('disconnect MQTT')
-        self._mqtt_client.loop_stop(force=False)
+        self._mqtt_client.loop_stop()
         self._mqtt_client.disconnect()
 
         return 0
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+suppression of repeated readings
+
+433MHz senders repeat every frame several times and pilight forwards each
+repeat as an update of its own.
+"""
+
+import collections
+import threading
+import time
+
+from pilight2mqtt.log import Loggable
+
+__all__ = ['ChangeFilter', 'parse_rule']
+
+CACHE_SIZE = 4096
+
+
+def parse_rule(text):
+    """parse READING=WINDOW[:DEADBAND] into (reading, window, deadband)"""
+    try:
+        reading, spec = text.split('=', 1)
+        window, _, deadband = spec.partition(':')
+        return (reading.strip().upper(),
+                float(window),
+                float(deadband) if deadband else 0.0)
+    except ValueError:
+        raise ValueError(
+            'invalid rule "%s", expected READING=WINDOW[:DEADBAND]' % text)
+
+
+class ChangeFilter(Loggable):
+    """remember the last published value per device and reading
+
+       A value is dropped if it equals the last published value, or differs
+       by less than the deadband of its reading, and the last publication
+       is younger than the window of its reading. The least recently
+       updated entries are evicted once more than size are cached.
+    """
+
+    def __init__(self, window=0, rules=(), size=CACHE_SIZE):
+        """initialize, rules is a sequence of (reading, window, deadband)"""
+        self._window = window
+        self._rules = {reading: (rwindow, deadband)
+                       for reading, rwindow, deadband in rules}
+        self._size = size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    @property
+    def enabled(self):
+        """check if any value can be suppressed at all"""
+        return self._window > 0 or any(
+            window > 0 for window, _ in self._rules.values())
+
+    def __len__(self):
+        """number of cached readings"""
+        return len(self._cache)
+
+    @staticmethod
+    def _unchanged(last, value, deadband):
+        """compare two values taking the deadband into account"""
+        if deadband and isinstance(value, (int, float)) \
+                and isinstance(last, (int, float)):
+            return abs(value - last) < deadband
+        return value == last
+
+    def accept(self, device, reading, value, now=None):
+        """check if value should be published and remember it if so"""
+        if now is None:
+            now = time.monotonic()
+        window, deadband = self._rules.get(reading, (self._window, 0.0))
+        key = (device, reading)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[1] < window and \
+                    self._unchanged(entry[0], value, deadband):
+                self.suppressed += 1
+                return False
+            self._cache[key] = (value, now)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self._size:
+                self._cache.popitem(last=False)
+        return True
+
+    def forget(self, device=None):
+        """forget cached values of one or all devices"""
+        with self._lock:
+            if device is None:
+                self._cache.clear()
+                return
+            for key in [key for key in self._cache if key[0] == device]:
+                del self._cache[key]
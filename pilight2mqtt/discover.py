@@ -25,93 +25,162 @@
 """
 Support for discovery of pilight servers.
 Code adapted from the original pilight python example.
+
+An M-SEARCH is sent on every interface at once and all answers are
+collected until the deadline, or until the requested number of servers
+answered.
 """
 
 from __future__ import print_function
 
+import select
 import socket
 import struct
-import re
+import time
+
+__all__ = ['discover', 'interface_addresses', 'parse_location']
+
+GROUP = ("239.255.255.250", 1900)
+SIOCGIFADDR = 0x8915
+RECV_SIZE = 1024 + 1
 
 
-def discover(service, timeout=2, retries=1):
-    """discover pilight servers"""
-    group = ("239.255.255.250", 1900)
-    message = "\r\n".join([
+def _search_msg(service, group):
+    """the M-SEARCH datagram"""
+    return "\r\n".join([
         'M-SEARCH * HTTP/1.1',
         'HOST: {0}:{1}'.format(*group),
         'MAN: "ssdp:discover"',
-        'ST: {st}', 'MX: 3', '', ''])
-
-    responses = {}  # pylint: disable=redefined-outer-name
-    i = 0
-    for _ in range(retries):
-        i += 1
-        sock = socket.socket(socket.AF_INET,
-                             socket.SOCK_DGRAM,
-                             socket.IPPROTO_UDP)
-        sock.setsockopt(socket.SOL_SOCKET,
-                        socket.SO_RCVTIMEO,
-                        struct.pack('LL', 0, 10000))
-        sock.setsockopt(socket.SOL_SOCKET,
-                        socket.SO_REUSEADDR,
-                        1)
-        sock.setsockopt(socket.IPPROTO_IP,
-                        socket.IP_MULTICAST_TTL,
-                        2)
-        sock.settimeout(timeout)
-        sock.sendto(bytes(message.format(st=service), 'UTF-8'), group)
-        while True:
+        'ST: {0}'.format(service), 'MX: 3', '', '']).encode('utf-8')
+
+
+def interface_addresses():
+    """the IPv4 addresses of the local interfaces, except loopback
+
+       Only supported on Linux, elsewhere the list is empty and the
+       default interface is used.
+    """
+    try:
+        import fcntl
+        names = [name for _, name in socket.if_nameindex()]
+    except (ImportError, AttributeError, OSError):
+        return []
+    addresses = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for name in names:
             try:
-                responses[i] = sock.recv(1024+1)
-                break
-            except socket.timeout:
-                break
-            except Exception as ex:  # pylint: disable=broad-except
-                print("no pilight ssdp connections found")
-                print(ex)
-                break
+                packed = fcntl.ioctl(sock.fileno(), SIOCGIFADDR,
+                                     struct.pack('256s',
+                                                 name[:15].encode('utf-8')))
+            except OSError:
+                continue
+            address = socket.inet_ntoa(packed[20:24])
+            if not address.startswith('127.') and address not in addresses:
+                addresses.append(address)
+    finally:
         sock.close()
-    return list(responses.values())
+    return addresses
+
+
+def parse_location(response, service=None):
+    """(address, port) from the LOCATION header of a response or None
+
+       pilight answers with "Location:<address>:<port>", a url is accepted
+       too. Responses for another service than service are ignored.
+    """
+    headers = {}
+    for line in response.decode('utf-8', 'replace').split('\n'):
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    if service is not None and headers.get('st', service) != service:
+        return None
+    location = headers.get('location', '')
+    if '://' in location:
+        location = location.split('://', 1)[1]
+    location = location.split('/', 1)[0]
+    address, sep, port = location.rpartition(':')
+    if not sep or not address or not port.isdigit():
+        return None
+    return address, int(port)
+
+
+def _open(address):
+    """udp socket sending on the interface with address"""
+    sock = socket.socket(socket.AF_INET,
+                         socket.SOCK_DGRAM,
+                         socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP,
+                    socket.IP_MULTICAST_TTL,
+                    2)
+    if address:
+        sock.setsockopt(socket.IPPROTO_IP,
+                        socket.IP_MULTICAST_IF,
+                        socket.inet_aton(address))
+    sock.bind((address, 0))
+    sock.setblocking(False)
+    return sock
+
+
+def discover(service, timeout=2, retries=1, count=None,
+             group=GROUP, interfaces=None):
+    """discover pilight servers, a list of (address, port)
+
+       Returns when count servers answered or after timeout seconds. The
+       search is sent retries times, spread over the timeout. interfaces
+       are the addresses to search from, by default all interfaces.
+    """
+    if interfaces is None:
+        interfaces = interface_addresses() or ['']
+    message = _search_msg(service, group)
+    socks = []
+    for address in interfaces:
+        try:
+            socks.append(_open(address))
+        except OSError:
+            continue
+
+    found = []
+    start = time.monotonic()
+    deadline = start + timeout
+    interval = timeout / max(1, retries)
+    sent = 0
+    try:
+        while socks and (count is None or len(found) < count):
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if sent < retries and now >= start + sent * interval:
+                sent += 1
+                for sock in socks:
+                    try:
+                        sock.sendto(message, group)
+                    except OSError:
+                        pass
+            wake = start + sent * interval if sent < retries else deadline
+            readable, _, _ = select.select(socks, [], [],
+                                           max(0, min(wake, deadline) - now))
+            for sock in readable:
+                try:
+                    response = sock.recv(RECV_SIZE)
+                except OSError:
+                    continue
+                location = parse_location(response, service)
+                if location is not None and location not in found:
+                    found.append(location)
+    finally:
+        for sock in socks:
+            sock.close()
+    if count is not None:
+        return found[:count]
+    return found
 
 
 def main():
     """main test program"""
-    responses = discover("urn:schemas-upnp-org:service:pilight:1")
-    if responses:
-        locationsrc = re.search('Location:([0-9.]+):([0-9.]+)',
-                                str(responses[0]),
-                                re.IGNORECASE)
-        if locationsrc:
-            location = locationsrc.group(1)
-            port = locationsrc.group(2)
-
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-        socket.setdefaulttimeout(0)
-        print("identfy")
-        sock.connect((location, int(port)))
-        sock.send(b'{"action":"identify","options":{"receiver":1}}\n')
-        text = b""
-        while True:
-            line = sock.recv(1024)
-            text += line
-            if b"\n\n" in line[-2:]:
-                text = text[:-2]
-                break
-        if text == b'{"status":"success"}':
-            print("success")
-            text = b""
-            while True:
-                print("read")
-                line = sock.recv(1024)
-                text += line
-                if "\n\n" in line[-2:]:
-                    text = text[:-2]
-                    for line in iter(text.splitlines()):
-                        print(line)
-                    text = ""
-        sock.close()
+    for address, port in discover("urn:schemas-upnp-org:service:pilight:1"):
+        print("pilight at %s:%d" % (address, port))
 
 
 if __name__ == '__main__':
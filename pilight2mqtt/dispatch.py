@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+mapping of pilight events to mqtt readings
+"""
+
+import collections
+import sys
+
+from pilight2mqtt.log import Loggable
+
+__all__ = ['EventDispatcher', 'TopicCache', 'EVENT_TYPES']
+
+# pilight device type -> ((reading, key in values), ...)
+EVENT_TYPES = {
+    1: (('STATE', 'state'),),  # switch
+    2: (('STATE', 'state'), ('DIMLEVEL', 'dimlevel')),  # dimmer
+    3: (('HUMIDITY', 'humidity'),
+        ('TEMPERATURE', 'temperature'),
+        ('BATTERY', 'battery')),  # weather
+    4: (('STATE', 'state'),),  # relay
+    5: (('STATE', 'state'),),  # screen
+    6: (('STATE', 'state'),),  # contact
+    7: (('STATE', 'state'),),  # pending switch
+    12: (('STATE', 'state'),),  # motion
+    13: (('STATE', 'state'),),  # dusk
+    15: (('LABEL', 'label'), ('COLOR', 'color')),  # label
+    16: (('STATE', 'state'),),  # alarm
+}
+TOPIC_CACHE_SIZE = 16384
+
+
+class EventDispatcher(Loggable):
+    """look up the readings to publish for a pilight event type
+
+       Events of unknown types are counted and dropped. Readings and keys
+       are interned like the keys of a PilightEvent.
+    """
+
+    def __init__(self, event_types=None):
+        """initialize, event_types maps a type to (reading, key) pairs"""
+        self._table = {}
+        for evt_type, readings in (event_types or EVENT_TYPES).items():
+            self._table[int(evt_type)] = tuple(
+                (sys.intern(reading), sys.intern(key))
+                for reading, key in readings)
+        self.unknown = collections.Counter()
+
+    @classmethod
+    def load(cls, path):
+        """load event types from a json file, merged over the defaults
+
+           The file maps a type to an object of reading: key pairs, e.g.
+           {"2": {"STATE": "state", "DIMLEVEL": "dimlevel"}}
+        """
+        import json
+        with open(path, 'r') as config:
+            loaded = json.load(config)
+        table = dict(EVENT_TYPES)
+        for evt_type, readings in loaded.items():
+            table[int(evt_type)] = tuple(readings.items())
+        return cls(table)
+
+    def readings(self, evt_type):
+        """(reading, key) pairs of evt_type, None if it is unknown"""
+        readings = self._table.get(evt_type)
+        if readings is None:
+            self.unknown[evt_type] += 1
+            if self.unknown[evt_type] == 1:
+                self.log.info('Dropping events of unsupported type %s',
+                              evt_type)
+        return readings
+
+
+class TopicCache:  # pylint: disable=too-few-public-methods
+    """build status topics once per device and reading"""
+
+    def __init__(self, prefix, size=TOPIC_CACHE_SIZE):
+        """initialize"""
+        self.prefix = prefix
+        self._prefix = '%s/status/' % prefix
+        self._size = size
+        self._topics = {}
+
+    def get(self, device, reading):
+        """topic of a reading of a device"""
+        key = (device, reading)
+        topic = self._topics.get(key)
+        if topic is None:
+            if len(self._topics) >= self._size:
+                self._topics.clear()
+            topic = self._topics[key] = '%s%s/%s' % (
+                self._prefix, device, reading)
+        return topic
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+events received from pilight
+
+A frame is decoded once into PilightEvent objects holding only what the
+bridge uses. Device names and the keys of values are interned, so the
+change filter, the state store and the topic cache share one string per
+device and reading instead of one per event.
+"""
+
+import sys
+
+from pilight2mqtt import codec
+
+__all__ = ['PilightEvent', 'parse_events', 'UPDATE', 'CONFIG']
+
+UPDATE = 'update'
+CONFIG = 'config'
+
+
+class PilightEvent:  # pylint: disable=too-few-public-methods
+    """the type, devices and values of an update, or a config"""
+
+    __slots__ = ('origin', 'type', 'devices', 'values')
+
+    def __init__(self, origin, evt_type=None, devices=(), values=None):
+        """initialize"""
+        self.origin = origin
+        self.type = evt_type
+        self.devices = devices
+        self.values = values if values is not None else {}
+
+    def __repr__(self):
+        """representation for logs and tests"""
+        return 'PilightEvent(%r, %r, %r, %r)' % (
+            self.origin, self.type, self.devices, self.values)
+
+    def __eq__(self, other):
+        """events are equal if all their fields are"""
+        if not isinstance(other, PilightEvent):
+            return NotImplemented
+        return (self.origin, self.type, self.devices, self.values) == \
+            (other.origin, other.type, other.devices, other.values)
+
+
+def _update(dct, intern=sys.intern):
+    """the event of one update, or of the values of some devices"""
+    values = dct.get('values')
+    if values:
+        values = {intern(key): value for key, value in values.items()}
+    devices = tuple([intern(name) for name in dct.get('devices', ())])
+    return PilightEvent(UPDATE, dct.get('type'), devices, values)
+
+
+def parse_events(frame):
+    """the events of a frame, a tuple that is empty for other messages
+
+       An update is one event, the answer to a request for the values of
+       all devices is one event per entry and a config is one event with
+       the config as values.
+    """
+    dct = codec.loads(frame)
+    if dct.get('origin') == UPDATE:
+        return (_update(dct),)
+    if dct.get('message') == 'values':
+        return tuple([_update(entry) for entry in dct.get('values', ())])
+    config = dct.get(CONFIG)
+    if config is not None:
+        return (PilightEvent(CONFIG, values=config),)
+    return ()
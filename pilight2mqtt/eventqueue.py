@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bounded queues between reading frames from pilight and handling them
+
+Reading from pilight must keep up with pilight, otherwise pilight drops
+the client. Handling an event may wait for the MQTT client, so frames are
+handed to worker threads through bounded queues.
+"""
+
+import collections
+import re
+import threading
+
+from pilight2mqtt.log import Loggable
+from pilight2mqtt.metrics import metrics
+
+__all__ = ['EventQueue', 'WorkerPool', 'frame_key', 'POLICIES']
+
+POLICIES = ('block', 'drop-oldest', 'coalesce')
+QUEUE_SIZE = 1024
+
+FRAMES_DROPPED = metrics.counter(
+    'pilight2mqtt_queue_dropped_total',
+    'Frames dropped because the queue was full')
+FRAMES_COALESCED = metrics.counter(
+    'pilight2mqtt_queue_coalesced_total',
+    'Queued frames replaced by a newer frame of the same devices')
+
+_DEVICES = re.compile(rb'"devices"\s*:\s*(\[[^\]]*\])')
+_UPDATE = b'"origin":"update"'
+
+
+def frame_key(frame):
+    """the devices an update frame is about, None for other frames
+
+       This looks at the raw frame only, it is not parsed.
+    """
+    if _UPDATE not in frame:
+        return None
+    match = _DEVICES.search(frame)
+    return match.group(1) if match else None
+
+
+class EventQueue:
+    """bounded fifo of frames with an overflow policy
+
+       The policy only applies once the queue is full: block waits for
+       room, drop-oldest drops the oldest frame and coalesce replaces the
+       latest queued update of the same devices, or drops the oldest frame
+       if there is none. drop-oldest is the default, so reading from
+       pilight never waits for the handlers.
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, policy='drop-oldest',
+                 key=frame_key):
+        """initialize"""
+        if policy not in POLICIES:
+            raise ValueError('unknown overflow policy "%s"' % policy)
+        self._maxsize = max(1, maxsize)
+        self._policy = policy
+        self._key = key
+        self._items = collections.deque()
+        self._slots = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        """number of queued frames"""
+        return len(self._items)
+
+    def _drop_oldest(self):
+        """drop the oldest frame to make room"""
+        key, _ = slot = self._items.popleft()
+        if key is not None and self._slots.get(key) is slot:
+            del self._slots[key]
+        self.dropped += 1
+        FRAMES_DROPPED.inc()
+
+    def put(self, frame, key=None):
+        """queue a frame, key defaults to the key function's result"""
+        if self._policy != 'coalesce':
+            key = None
+        elif key is None:
+            key = self._key(frame)
+        with self._cond:
+            while len(self._items) >= self._maxsize and not self._closed:
+                if self._policy == 'block':
+                    self._cond.wait()
+                    continue
+                if key is not None:
+                    slot = self._slots.get(key)
+                    if slot is not None:
+                        slot[1] = frame
+                        self.coalesced += 1
+                        FRAMES_COALESCED.inc()
+                        return
+                self._drop_oldest()
+            slot = [key, frame]
+            self._items.append(slot)
+            if key is not None:
+                self._slots[key] = slot
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """next frame, None once the queue is closed and empty"""
+        with self._cond:
+            while not self._items:
+                if self._closed:
+                    return None
+                if not self._cond.wait(timeout):
+                    return None
+            key, frame = slot = self._items.popleft()
+            if key is not None and self._slots.get(key) is slot:
+                del self._slots[key]
+            self._cond.notify_all()
+            return frame
+
+    def close(self):
+        """stop accepting frames, queued frames can still be taken"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class WorkerPool(Loggable):
+    """threads handling frames from bounded queues
+
+       Every worker has a queue of its own. Updates are assigned to a
+       worker by their devices, so the updates of a device are handled in
+       order. Other frames go to the first worker.
+    """
+
+    def __init__(self, handler, workers=1, maxsize=QUEUE_SIZE,
+                 policy='drop-oldest'):
+        """initialize, handler is called with every frame"""
+        self._handler = handler
+        workers = max(1, workers)
+        self._queues = [EventQueue(max(1, maxsize // workers), policy)
+                        for _ in range(workers)]
+        self._threads = []
+        metrics.gauge('pilight2mqtt_queue_depth',
+                      'Frames waiting to be handled',
+                      lambda: len(self))
+
+    def __len__(self):
+        """number of queued frames"""
+        return sum(len(queue) for queue in self._queues)
+
+    @property
+    def dropped(self):
+        """number of frames dropped because a queue was full"""
+        return sum(queue.dropped for queue in self._queues)
+
+    @property
+    def coalesced(self):
+        """number of frames replaced by a newer one"""
+        return sum(queue.coalesced for queue in self._queues)
+
+    def _work(self, queue):
+        """handle frames until the queue is closed and empty"""
+        while True:
+            frame = queue.get()
+            if frame is None:
+                return
+            try:
+                self._handler(frame)
+            except Exception as ex:  # pylint: disable=broad-except
+                self.log.error('%s: %s', ex.__class__.__name__, ex)
+
+    def start(self):
+        """start the worker threads"""
+        for index, queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(queue,),
+                                      name='worker-%d' % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, frame):
+        """hand a frame to its worker"""
+        queues = self._queues
+        if len(queues) == 1:
+            queues[0].put(frame)
+            return
+        key = frame_key(frame)
+        queue = queues[hash(key) % len(queues)] if key else queues[0]
+        queue.put(frame, key)
+
+    def stop(self, timeout=None):
+        """handle the queued frames and stop the workers"""
+        for queue in self._queues:
+            queue.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
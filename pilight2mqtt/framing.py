@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+framing of the pilight socket protocol
+"""
+
+__all__ = ['FrameDecoder']
+
+DELIM = b'\n\n'
+RECV_SIZE = 4096
+
+
+class FrameDecoder:
+    """incremental decoder for DELIM separated frames
+
+       The decoder is meant to live as long as the connection it reads
+       from. Received data is written straight into a reusable bytearray
+       with recv_into, the delimiter search resumes where the previous scan
+       stopped and consumed space is reclaimed lazily, so decoding a burst
+       of frames is linear in the amount of data received.
+    """
+
+    def __init__(self, recv_size=RECV_SIZE, delim=DELIM):
+        """initialize"""
+        self._recv_size = int(recv_size)
+        if self._recv_size <= 0:
+            raise ValueError('recv_size must be positive')
+        self._delim = delim
+        self._buf = bytearray(2 * self._recv_size)
+        self._start = 0   # first byte not yet returned as part of a frame
+        self._end = 0     # end of valid data in the buffer
+        self._scan = 0    # offset the next delimiter search starts from
+
+    @property
+    def recv_size(self):
+        """number of bytes requested per receive"""
+        return self._recv_size
+
+    def __len__(self):
+        """number of buffered bytes not yet returned as a frame"""
+        return self._end - self._start
+
+    def reset(self):
+        """drop all buffered data, e.g. after a reconnect"""
+        self._start = self._end = self._scan = 0
+
+    def _reserve(self, size):
+        """make sure there is room for size bytes after the valid data"""
+        if len(self._buf) - self._end >= size:
+            return
+        pending = self._end - self._start
+        if self._start and self._start >= pending:
+            # reclaim consumed space at the front, this is cheap because
+            # at most as many bytes are moved as have been consumed
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._scan -= self._start
+            self._start, self._end = 0, pending
+        if len(self._buf) - self._end < size:
+            self._buf.extend(bytes(max(size, len(self._buf))))
+
+    def recv_from(self, sock):
+        """receive data from sock into the buffer, returns bytes read"""
+        self._reserve(self._recv_size)
+        with memoryview(self._buf) as view:
+            count = sock.recv_into(view[self._end:], self._recv_size)
+        self._end += count
+        return count
+
+    def feed(self, data):
+        """append already received data to the buffer"""
+        size = len(data)
+        self._reserve(size)
+        self._buf[self._end:self._end + size] = data
+        self._end += size
+
+    def next_frame(self):
+        """return the next complete frame or None"""
+        idx = self._buf.find(self._delim, self._scan, self._end)
+        if idx == -1:
+            # a delimiter may straddle the end of the valid data
+            self._scan = max(self._start,
+                             self._end - len(self._delim) + 1)
+            return None
+        frame = bytes(self._buf[self._start:idx])
+        self._start = self._scan = idx + len(self._delim)
+        if self._start == self._end:
+            self.reset()
+        return frame
+
+    def frames(self):
+        """iterate over all complete frames in the buffer"""
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+logging helpers of pilight2mqtt
+"""
+
+import logging
+
+__all__ = ['Loggable', 'TrafficTrace', 'traffic', 'TRAFFIC_LOGGER']
+
+TRAFFIC_LOGGER = 'pilight2mqtt.traffic'
+
+
+class Loggable:  # pylint: disable=too-few-public-methods
+    """base class for objects that need logging"""
+
+    @property
+    def log(self):
+        """log message to a logger named like the class"""
+        cls = self.__class__
+        logger = cls.__dict__.get('_logger')
+        if logger is None:
+            # cached per class, subclasses get a logger of their own
+            logger = cls._logger = logging.getLogger(cls.__name__)
+        return logger
+
+
+class TrafficTrace:
+    """sampled log of the frames exchanged with pilight and mqtt
+
+       Frames are not part of the regular debug output, so a verbose or
+       debug bridge does not format every message it handles. Tracing
+       every sample'th frame is enabled with configure.
+    """
+
+    def __init__(self, name=TRAFFIC_LOGGER):
+        """initialize, tracing is disabled"""
+        self._log = logging.getLogger(name)
+        self._count = 0
+        self.sample = 0
+
+    def configure(self, sample):
+        """trace every sample'th frame, 0 disables tracing"""
+        self.sample = max(0, int(sample))
+        self._count = 0
+        self._log.setLevel(logging.DEBUG if self.sample else logging.WARNING)
+
+    def __call__(self, direction, data, *args):
+        """trace a frame, args are logged along with it"""
+        if not self.sample:
+            return
+        self._count += 1
+        if self._count >= self.sample:
+            self._count = 0
+            self._log.debug('%s %s%s', direction, data,
+                            ''.join(' %s' % (arg,) for arg in args))
+
+
+traffic = TrafficTrace()  # pylint: disable=invalid-name
+traffic.configure(0)
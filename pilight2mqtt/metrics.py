@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+metrics of pilight2mqtt
+
+Counters and histograms are created once when a module is imported and
+updated in place afterwards. They can be rendered in the Prometheus text
+format, served through a small http server, or taken as a snapshot.
+"""
+
+import bisect
+import threading
+
+from pilight2mqtt.log import Loggable
+
+__all__ = ['Counter', 'Gauge', 'Histogram', 'HistogramFamily', 'Metrics',
+           'MetricsServer', 'metrics']
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _finite(value):
+    """value, or None if it is infinite and can not be put into json"""
+    return value if value != float('inf') else None
+
+
+def _label(name, value):
+    """a label of the Prometheus text format"""
+    value = value.replace('\\', '\\\\').replace('"', '\\"')
+    return '%s="%s"' % (name, value.replace('\n', '\\n'))
+
+
+class Counter:
+    """monotonically increasing value"""
+
+    __slots__ = ('name', 'help', 'value')
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        """initialize"""
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        """increase the counter"""
+        self.value += amount
+
+    def reset(self):
+        """start counting from zero"""
+        self.value = 0
+
+    def render(self, lines):
+        """append the Prometheus text format of the counter to lines"""
+        lines.append('%s %s' % (self.name, self.value))
+
+    def snapshot(self):
+        """current value"""
+        return self.value
+
+
+class Gauge:
+    """value read from a callable whenever it is rendered"""
+
+    __slots__ = ('name', 'help', 'func')
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, func):
+        """initialize"""
+        self.name = name
+        self.help = help_text
+        self.func = func
+
+    def reset(self):
+        """gauges are read from their callable, nothing to reset"""
+
+    def render(self, lines):
+        """append the Prometheus text format of the gauge to lines"""
+        lines.append('%s %s' % (self.name, self.func()))
+
+    def snapshot(self):
+        """current value"""
+        return self.func()
+
+
+class Histogram:
+    """distribution of observed values in fixed buckets"""
+
+    __slots__ = ('name', 'help', '_bounds', '_counts', 'sum', 'count')
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        """initialize"""
+        self.name = name
+        self.help = help_text
+        self._bounds = tuple(buckets)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """record a value"""
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def reset(self):
+        """forget all observed values"""
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def quantile(self, fraction):
+        """upper bound of the bucket containing the given quantile"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        total = 0
+        for bound, count in zip(self._bounds, self._counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def render(self, lines, label=None):
+        """append the Prometheus text format of the histogram to lines"""
+        prefix = label + ',' if label else ''
+        suffix = '{%s}' % label if label else ''
+        total = 0
+        for bound, count in zip(self._bounds, self._counts):
+            total += count
+            lines.append('%s_bucket{%sle="%s"} %d' % (
+                self.name, prefix, bound, total))
+        lines.append('%s_bucket{%sle="+Inf"} %d' % (
+            self.name, prefix, self.count))
+        lines.append('%s_sum%s %s' % (self.name, suffix, self.sum))
+        lines.append('%s_count%s %d' % (self.name, suffix, self.count))
+
+    def snapshot(self):
+        """count, sum and the 50th and 99th percentile"""
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': _finite(self.quantile(0.5)),
+            'p99': _finite(self.quantile(0.99)),
+        }
+
+
+class HistogramFamily:
+    """one histogram per value of a label, e.g. per device"""
+
+    __slots__ = ('name', 'help', 'label', '_buckets', '_children', '_lock')
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label, buckets=BUCKETS):
+        """initialize"""
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._buckets = tuple(buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        """the histogram of a label value, created on first use"""
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(
+                    value, Histogram(self.name, self.help, self._buckets))
+        return child
+
+    def reset(self):
+        """forget all label values"""
+        with self._lock:
+            self._children = {}
+
+    def render(self, lines):
+        """append the Prometheus text format of all histograms to lines"""
+        for value, child in sorted(self._children.items()):
+            child.render(lines, _label(self.label, value))
+
+    def snapshot(self):
+        """the snapshot of the histogram of every label value"""
+        return {value: child.snapshot()
+                for value, child in self._children.items()}
+
+
+class Metrics:
+    """collection of named metrics"""
+
+    def __init__(self):
+        """initialize"""
+        self._metrics = {}
+
+    def _add(self, metric):
+        """register metric, an existing one of the same name is kept"""
+        existing = self._metrics.get(metric.name)
+        if existing is not None and existing.kind == metric.kind:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        """get or create a counter"""
+        return self._add(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=BUCKETS):
+        """get or create a histogram"""
+        return self._add(Histogram(name, help_text, buckets))
+
+    def histogram_family(self, name, help_text, label, buckets=BUCKETS):
+        """get or create a histogram per value of label"""
+        family = self._add(HistogramFamily(name, help_text, label, buckets))
+        if not isinstance(family, HistogramFamily):
+            raise ValueError('%s is not labelled by %s' % (name, label))
+        return family
+
+    def gauge(self, name, help_text, func):
+        """register a gauge, replacing the callable of an existing one"""
+        gauge = self._add(Gauge(name, help_text, func))
+        gauge.func = func
+        return gauge
+
+    def __getitem__(self, name):
+        """the metric called name"""
+        return self._metrics[name]
+
+    def reset(self):
+        """reset all metrics, e.g. between benchmark runs"""
+        for metric in self._metrics.values():
+            metric.reset()
+
+    def render(self):
+        """all metrics in the Prometheus text format"""
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.help))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            metric.render(lines)
+        lines.append('')
+        return '\n'.join(lines)
+
+    def snapshot(self):
+        """all metrics as a dictionary, e.g. to publish them as json"""
+        return {name: metric.snapshot()
+                for name, metric in self._metrics.items()}
+
+
+metrics = Metrics()  # pylint: disable=invalid-name
+
+
+def _handler():
+    """the request handler, http.server is only imported when serving"""
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """serve metrics on /metrics"""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """handle a GET request"""
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = self.server.metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # pylint: disable=redefined-builtin
+        def log_message(self, format, *args):
+            """requests are not logged"""
+
+    return MetricsHandler
+
+
+class MetricsServer(Loggable):
+    """http server exposing metrics in the Prometheus text format"""
+
+    def __init__(self, port, address='', registry=None):
+        """initialize"""
+        from http.server import HTTPServer
+        self._httpd = HTTPServer((address, port), _handler())
+        self._httpd.metrics = registry if registry is not None else metrics
+        self._thread = None
+
+    @property
+    def port(self):
+        """port the server listens on"""
+        return self._httpd.server_address[1]
+
+    def start(self):
+        """serve requests on a daemon thread"""
+        self.log.info('Serving metrics on port %d', self.port)
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        name='metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """stop serving requests"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+batched publishing of mqtt messages
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from pilight2mqtt.log import Loggable
+from pilight2mqtt.metrics import metrics
+
+__all__ = ['Publisher']
+
+# paho.mqtt.client.MQTT_ERR_SUCCESS, paho is imported once connecting
+MQTT_ERR_SUCCESS = 0
+
+MESSAGES_PUBLISHED = metrics.counter(
+    'pilight2mqtt_messages_published_total',
+    'Messages handed to the MQTT client')
+MESSAGES_FAILED = metrics.counter(
+    'pilight2mqtt_messages_failed_total',
+    'Messages the MQTT client did not accept')
+PUBLISH_SECONDS = metrics.histogram(
+    'pilight2mqtt_publish_seconds',
+    'Time to hand one batch to the MQTT client')
+MESSAGES_COALESCED = metrics.counter(
+    'pilight2mqtt_messages_coalesced_total',
+    'Messages replaced by a newer one for the same topic before a flush')
+BATCH_SIZE = metrics.histogram(
+    'pilight2mqtt_publish_batch_size',
+    'Number of messages per batch',
+    (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+DRAIN_RATE = 500
+
+
+class Publisher(Loggable):
+    """collect mqtt messages and hand them to the client in batches
+
+       All messages of one pilight event, or of all events within window
+       seconds, form one batch. Only the latest message per topic is kept
+       in a batch. Results are checked once per flush instead of once per
+       message. Without a client messages wait until one is set.
+
+       With a spool, messages are written to it while the client is not
+       connected and while earlier messages are still waiting in it, so
+       their order is kept. drain publishes them at drain_rate messages
+       per second, at most drain_batch at a time, by default as many as
+       are sent in one second. Flushing and draining hold one lock, so a
+       batch can not overtake the messages spooled before it.
+    """
+
+    def __init__(self, client, window=0, spool=None,
+                 drain_rate=DRAIN_RATE, drain_batch=None):
+        """initialize"""
+        self.client = client
+        self.connected = True
+        self._window = window
+        self._spool = spool
+        self._drain_rate = drain_rate
+        self._drain_batch = max(1, drain_batch or drain_rate)
+        self._drain_tokens = 0
+        self._drained = time.monotonic()
+        self._batch = collections.OrderedDict()
+        self._started = 0
+        self._scheduler = None
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self.flushes = 0
+        self.published = 0
+        self.failed = 0
+        self.last_flush_size = 0
+        self.coalesced = 0
+
+    @property
+    def spool(self):
+        """the spool of messages for outages, None without one"""
+        return self._spool
+
+    @property
+    def window(self):
+        """seconds messages are collected before they are published"""
+        return self._window
+
+    def set_scheduler(self, scheduler):
+        """use scheduler(delay, func) to flush once the window elapsed"""
+        self._scheduler = scheduler
+
+    def __len__(self):
+        """number of messages waiting to be published"""
+        return len(self._batch)
+
+    def add(self, topic, payload, qos=0, retain=False, compact=False):
+        """queue a message for the next flush
+
+           compact messages replace an older one of their topic in the
+           spool, see Spool.append.
+        """
+        with self._lock:
+            first = not self._batch
+            if first:
+                self._started = time.monotonic()
+            if topic in self._batch:
+                self.coalesced += 1
+                MESSAGES_COALESCED.inc()
+            self._batch[topic] = (payload, qos, retain, compact)
+        if first and self._window > 0 and self._scheduler is not None:
+            self._scheduler(self._window, self.flush)
+
+    def due(self):
+        """check if the current batch should be published"""
+        return bool(self._batch) and (
+            time.monotonic() - self._started >= self._window)
+
+    def maybe_flush(self):
+        """publish the current batch if its window elapsed"""
+        if self.due():
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """publish all queued messages, returns the number of messages"""
+        if self.client is None:
+            return 0
+        with self._publish_lock:
+            with self._lock:
+                batch, self._batch = self._batch, collections.OrderedDict()
+            if not batch:
+                return 0
+            return self._publish_batch(batch)
+
+    def _publish_batch(self, batch):
+        """publish or spool a batch, the publish lock is held"""
+        spool = self._spool
+        if spool is not None and (not self.connected or len(spool)):
+            for topic, (payload, qos, retain, compact) in batch.items():
+                spool.append(topic, payload, qos, retain, compact)
+            spool.flush()
+            return len(batch)
+        start = time.perf_counter()
+        publish = self.client.publish
+        failed = 0
+        behind = 0
+        spooling = False
+        for topic, (payload, qos, retain, compact) in batch.items():
+            if spooling:
+                # queued behind a spooled message to keep the order
+                spool.append(topic, payload, qos, retain, compact)
+                behind += 1
+            elif publish(topic, payload, qos, retain)[0] != MQTT_ERR_SUCCESS:
+                failed += 1
+                # paho keeps messages with qos 1 and 2 itself
+                if spool is not None and not qos:
+                    spool.append(topic, payload, qos, retain, compact)
+                    spooling = True
+        if spooling:
+            spool.flush()
+        size = len(batch)
+        sent = size - failed - behind
+        PUBLISH_SECONDS.observe(time.perf_counter() - start)
+        BATCH_SIZE.observe(size)
+        MESSAGES_PUBLISHED.inc(sent)
+        MESSAGES_FAILED.inc(failed)
+        self.flushes += 1
+        self.published += sent
+        self.failed += failed
+        self.last_flush_size = size
+        if failed:
+            self.log.warning('Failed to send %d of %d messages',
+                             failed, size)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('flushed %d messages', size)
+        return size
+
+    def _publish(self, topic, payload, qos, retain):
+        """publish one message from the spool"""
+        return self.client.publish(
+            topic, payload, qos, retain)[0] == MQTT_ERR_SUCCESS
+
+    def drain(self):
+        """publish messages from the spool, returns the number sent"""
+        spool = self._spool
+        if spool is None or self.client is None or not self.connected \
+                or not len(spool):
+            return 0
+        with self._publish_lock:
+            return self._drain(spool)
+
+    def _drain(self, spool):
+        """publish what the rate allows, the publish lock is held"""
+        now = time.monotonic()
+        tokens = min(self._drain_batch, self._drain_tokens +
+                     (now - self._drained) * self._drain_rate)
+        self._drained = now
+        sent = spool.drain(self._publish, int(tokens)) if tokens >= 1 else 0
+        self._drain_tokens = tokens - sent
+        self.published += sent
+        if sent and not len(spool):
+            self.log.info('Published all spooled messages')
+        return sent
+
+    def close(self):
+        """publish what is waiting, or spool it, and close the spool"""
+        self.flush()
+        if self._spool is not None:
+            self._spool.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+registry of the devices configured in pilight
+"""
+
+from pilight2mqtt.log import Loggable
+
+__all__ = ['Device', 'DeviceRegistry']
+
+# device settings in pilight's config that are not readings
+META_KEYS = frozenset(['uuid', 'origin', 'timestamp', 'protocol', 'id'])
+# states that belong together, a device supports the set its state is in
+STATE_SETS = (
+    frozenset(['on', 'off']),
+    frozenset(['up', 'down']),
+    frozenset(['opened', 'closed']),
+)
+
+
+class Device:  # pylint: disable=too-few-public-methods
+    """a device configured in pilight"""
+
+    def __init__(self, name, protocol=(), states=None, readings=()):
+        """initialize, states is None if any state is accepted"""
+        self.name = name
+        self.protocol = tuple(protocol)
+        self.states = states
+        self.readings = frozenset(readings)
+
+    @classmethod
+    def from_config(cls, name, settings):
+        """create a device from its settings in pilight's config"""
+        readings = [key for key in settings if key not in META_KEYS]
+        states = None
+        state = settings.get('state')
+        for state_set in STATE_SETS:
+            if state in state_set:
+                states = state_set
+                break
+        return cls(name, settings.get('protocol', ()), states, readings)
+
+
+class DeviceRegistry(Loggable):
+    """devices known to pilight
+
+       The registry is filled from pilight's config and kept up to date
+       with the devices and values of update events. Until the config was
+       loaded every device and command is accepted.
+    """
+
+    def __init__(self, topics=None):
+        """initialize, topics is a TopicCache to warm for known readings"""
+        self._topics = topics
+        self._devices = {}
+        self.loaded = False
+
+    def __len__(self):
+        """number of known devices"""
+        return len(self._devices)
+
+    def __contains__(self, device):
+        """check if a device is known"""
+        return device in self._devices
+
+    def get(self, device):
+        """the Device called device or None"""
+        return self._devices.get(device)
+
+    def _warm(self, device):
+        """build the topics of all readings of a device"""
+        if self._topics is not None:
+            for reading in device.readings:
+                self._topics.get(device.name, reading.upper())
+
+    def load(self, config):
+        """bring the devices up to date with pilight's config
+
+           Only devices that were added, changed or removed are touched,
+           the others keep their Device and their warm topics.
+        """
+        configured = config.get('devices', {})
+        devices = self._devices
+        removed = [name for name in list(devices) if name not in configured]
+        for name in removed:
+            del devices[name]
+        added = changed = 0
+        for name, settings in configured.items():
+            device = Device.from_config(name, settings)
+            current = devices.get(name)
+            if current is None:
+                added += 1
+            elif current.protocol == device.protocol and \
+                    current.states == device.states and \
+                    current.readings.issuperset(device.readings):
+                continue
+            else:
+                changed += 1
+            self._warm(device)
+            devices[name] = device
+        self.loaded = True
+        self.log.info('Loaded %d devices from the pilight config, '
+                      '%d added, %d changed, %d removed',
+                      len(devices), added, changed, len(removed))
+
+    def update(self, names, values):
+        """record the values an update event reported for devices"""
+        readings = [key for key in values if key not in META_KEYS]
+        for name in names:
+            device = self._devices.get(name)
+            if device is None:
+                device = Device(name, readings=readings)
+            elif not device.readings.issuperset(readings):
+                device = Device(name, device.protocol, device.states,
+                                device.readings.union(readings))
+            else:
+                continue
+            self._warm(device)
+            self._devices[name] = device
+
+    def check(self, name, state):
+        """None if state can be set for device name, else the reason"""
+        if not self.loaded:
+            return None
+        device = self._devices.get(name)
+        if device is None:
+            return 'unknown device "%s"' % name
+        if state is not None and device.states is not None \
+                and state not in device.states:
+            return 'device "%s" does not support state "%s"' % (name, state)
+        return None
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+record and replay of pilight traffic
+
+Frames received from pilight can be recorded with their arrival time. A
+recording is replayed by a stand in pilight server, at its original pace
+or faster, and the messages of the bridge can be received by a stub MQTT
+broker. Together they allow to run the real bridge without pilight or a
+broker, e.g. to benchmark it.
+
+    python -m pilight2mqtt.replay capture.rec --speed 10 --port 5001
+"""
+
+from __future__ import print_function
+
+import argparse
+import socket
+import struct
+import threading
+import time
+
+from pilight2mqtt import codec
+from pilight2mqtt.core import is_response
+from pilight2mqtt.framing import DELIM
+from pilight2mqtt.log import Loggable
+
+__all__ = ['CaptureWriter', 'ReplayServer', 'StubBroker', 'read_capture']
+
+SUCCESS = b'{"status":"success"}' + DELIM
+
+
+class CaptureWriter:
+    """append frames with their arrival time to a file
+
+       Every record is a line "<timestamp> <length>" followed by the frame
+       and a newline. Records are flushed as they are written, so a
+       capture is complete even if the process is killed.
+    """
+
+    def __init__(self, path):
+        """initialize"""
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, frame, now=None):
+        """record a frame"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._file.write(b'%.6f %d\n' % (now, len(frame)))
+            self._file.write(frame)
+            self._file.write(b'\n')
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        """flush and close the file"""
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """the (timestamp, frame) records of a capture file"""
+    records = []
+    with open(path, 'rb') as capture:
+        while True:
+            header = capture.readline()
+            if not header:
+                break
+            stamp, length = header.split()
+            frame = capture.read(int(length))
+            capture.read(1)
+            records.append((float(stamp), frame))
+    return records
+
+
+class ReplayServer(Loggable):
+    """stand in for pilight sending recorded frames to its clients
+
+       Receivers get the recorded events once they request the config,
+       paced by their timestamps divided by speed, or as fast as possible
+       if speed is 0. Requests are answered like pilight does, recorded
+       answers are not replayed.
+    """
+
+    def __init__(self, records, speed=1.0, address='127.0.0.1', port=0):
+        """initialize"""
+        self._records = [(stamp, frame) for stamp, frame in records
+                         if not is_response(frame)]
+        self._speed = speed
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((address, port))
+        self._sock.listen(8)
+        self._stopped = threading.Event()
+        self.sent = 0
+        self.started = None
+        self.finished = threading.Event()
+
+    @property
+    def port(self):
+        """port the server listens on"""
+        return self._sock.getsockname()[1]
+
+    def __len__(self):
+        """number of recorded events"""
+        return len(self._records)
+
+    def start(self):
+        """accept clients on a daemon thread"""
+        thread = threading.Thread(target=self._accept, name='replay')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """stop accepting clients and sending frames"""
+        self._stopped.set()
+        self._sock.close()
+
+    def _accept(self):
+        """serve every client on a thread of its own"""
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        """answer the requests of a client"""
+        lock = threading.Lock()
+        state = {'receiver': False, 'streaming': False}
+        buf = b''
+        try:
+            while not self._stopped.is_set():
+                data = conn.recv(4096)
+                if not data:
+                    return
+                buf += data
+                while buf:
+                    if buf.startswith(b'HEART'):
+                        buf = buf[5:]
+                        with lock:
+                            conn.sendall(b'BEAT' + DELIM)
+                        continue
+                    line, sep, rest = buf.partition(b'\n')
+                    if not sep:
+                        break
+                    buf = rest
+                    self._request(conn, lock, state, line)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _request(self, conn, lock, state, line):
+        """answer one json request"""
+        msg = codec.loads(line)
+        action = msg.get('action')
+        if action == 'identify':
+            state['receiver'] = bool(msg.get('options', {}).get('receiver'))
+            with lock:
+                conn.sendall(SUCCESS)
+        elif action == 'request config' and state['receiver'] \
+                and not state['streaming']:
+            state['streaming'] = True
+            thread = threading.Thread(target=self._stream,
+                                      args=(conn, lock))
+            thread.daemon = True
+            thread.start()
+        elif action == 'control':
+            with lock:
+                conn.sendall(SUCCESS)
+
+    def _stream(self, conn, lock):
+        """send the recorded events"""
+        if not self._records:
+            self.finished.set()
+            return
+        first = self._records[0][0]
+        self.started = start = time.perf_counter()
+        try:
+            for stamp, frame in self._records:
+                if self._speed > 0:
+                    delay = start + (stamp - first) / self._speed \
+                        - time.perf_counter()
+                    if delay > 0 and self._stopped.wait(delay):
+                        return
+                with lock:
+                    conn.sendall(frame + DELIM)
+                self.sent += 1
+        except OSError:
+            pass
+        self.finished.set()
+
+
+def _varint(value):
+    """mqtt remaining length encoding"""
+    out = bytearray()
+    while True:
+        byte, value = value % 128, value // 128
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def _matches(sub, topic):
+    """check if topic matches the subscription sub"""
+    sub_parts = sub.split('/')
+    parts = topic.split('/')
+    for index, part in enumerate(sub_parts):
+        if part == '#':
+            return True
+        if index >= len(parts) or (part != '+' and part != parts[index]):
+            return False
+    return len(parts) == len(sub_parts)
+
+
+class StubBroker(Loggable):
+    """minimal in process MQTT 3.1.1 broker
+
+       Published messages are counted and, if keep is set, recorded with
+       their arrival time instead of being forwarded. Messages can be sent
+       to subscribed clients with publish.
+    """
+
+    def __init__(self, address='127.0.0.1', port=0):
+        """initialize"""
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((address, port))
+        self._sock.listen(8)
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.messages = []
+        self.count = 0
+        self.last = None
+        self.keep = True
+        self.received = threading.Condition()
+
+    @property
+    def port(self):
+        """port the broker listens on"""
+        return self._sock.getsockname()[1]
+
+    def start(self):
+        """accept clients on a daemon thread"""
+        thread = threading.Thread(target=self._accept, name='broker')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """stop accepting clients"""
+        self._sock.close()
+
+    def wait_for(self, count, timeout=None):
+        """wait until count messages arrived, returns False on timeout"""
+        with self.received:
+            return self.received.wait_for(
+                lambda: self.count >= count, timeout)
+
+    def publish(self, topic, payload):
+        """send a message to the subscribed clients"""
+        topic = topic.encode('utf-8')
+        body = struct.pack('!H', len(topic)) + topic + payload
+        packet = b'\x30' + _varint(len(body)) + body
+        with self._lock:
+            clients = [(conn, subs) for conn, subs in self._clients.items()]
+        for conn, subs in clients:
+            if any(_matches(sub, topic.decode('utf-8')) for sub in subs):
+                conn.sendall(packet)
+
+    def _accept(self):
+        """serve every client on a thread of its own"""
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def _recv_exactly(conn, size):
+        """read size bytes or raise EOFError"""
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def _read_packet(self, conn):
+        """the type, flags and body of the next packet"""
+        header = self._recv_exactly(conn, 1)[0]
+        length, shift = 0, 0
+        while True:
+            byte = self._recv_exactly(conn, 1)[0]
+            length += (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return header >> 4, header & 0x0f, self._recv_exactly(conn, length)
+
+    def _serve(self, conn):
+        """handle the packets of a client"""
+        with self._lock:
+            subs = self._clients[conn] = []
+        try:
+            while True:
+                kind, flags, body = self._read_packet(conn)
+                if kind == 1:  # CONNECT
+                    conn.sendall(b'\x20\x02\x00\x00')
+                elif kind == 3:  # PUBLISH
+                    self._on_publish(conn, flags, body)
+                elif kind == 6:  # PUBREL
+                    conn.sendall(b'\x70\x02' + body[:2])
+                elif kind == 8:  # SUBSCRIBE
+                    pos, granted = 2, b''
+                    while pos < len(body):
+                        size, = struct.unpack_from('!H', body, pos)
+                        subs.append(body[pos + 2:pos + 2 + size].decode())
+                        pos += 2 + size + 1
+                        granted += b'\x00'
+                    reply = body[:2] + granted
+                    conn.sendall(b'\x90' + _varint(len(reply)) + reply)
+                elif kind == 12:  # PINGREQ
+                    conn.sendall(b'\xd0\x00')
+                elif kind == 14:  # DISCONNECT
+                    return
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                del self._clients[conn]
+            conn.close()
+
+    def _on_publish(self, conn, flags, body):
+        """record a published message and acknowledge it"""
+        now = time.perf_counter()
+        qos = (flags >> 1) & 3
+        size, = struct.unpack_from('!H', body)
+        topic = body[2:2 + size].decode('utf-8')
+        pos = 2 + size
+        if qos:
+            packet_id = body[pos:pos + 2]
+            pos += 2
+            conn.sendall((b'\x40\x02' if qos == 1 else b'\x50\x02')
+                         + packet_id)
+        with self.received:
+            self.count += 1
+            self.last = now
+            if self.keep:
+                self.messages.append((now, topic, body[pos:]))
+            self.received.notify_all()
+
+
+def main():
+    """serve a recording to a bridge"""
+    parser = argparse.ArgumentParser(
+        description='Replay recorded pilight frames.')
+    parser.add_argument('capture', help='File written by --capture.')
+    parser.add_argument('--speed', default=1.0, type=float,
+                        help='Replay speed, e.g. 10, 0 replays at once.')
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', default=5001, type=int)
+    args = parser.parse_args()
+
+    server = ReplayServer(read_capture(args.capture), args.speed,
+                          args.address, args.port).start()
+    print('Replaying %d events on %s:%d' % (len(server), args.address,
+                                            server.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+windowed aggregates of numeric readings
+
+Sensors report every few seconds. Besides the raw readings the minimum,
+maximum, mean and number of the values within fixed windows, e.g. one
+minute, are published to $TOPIC/status/<device>/<reading>/<window>.
+"""
+
+import array
+import threading
+import time
+
+from pilight2mqtt import codec
+from pilight2mqtt.metrics import metrics
+
+__all__ = ['Rollups', 'RollupWindow', 'parse_window']
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SERIES = 1024
+# count, sum, min and max of a series are kept next to each other
+FIELDS = 4
+
+ROLLUPS_EVICTED = metrics.counter(
+    'pilight2mqtt_rollups_evicted_total',
+    'Rollups published before their window ended to free their slot')
+
+
+def parse_window(text):
+    """parse e.g. 30s, 1m or 1h into (seconds, label)"""
+    text = text.strip().lower()
+    unit = text[-1:] if text[-1:] in UNITS else 's'
+    number = text[:-1] if text[-1:] in UNITS else text
+    try:
+        seconds = float(number) * UNITS[unit]
+    except ValueError:
+        seconds = 0
+    if seconds <= 0:
+        raise ValueError('invalid window "%s", expected e.g. 30s, 1m or 1h'
+                         % text)
+    return seconds, '%s%s' % (number, unit)
+
+
+class RollupWindow:
+    """aggregates of up to size series over tumbling windows
+
+       The aggregates live in one preallocated array. Series get a slot
+       when their first value of a window arrives, once all slots are in
+       use the oldest one is taken over. Its aggregate so far is returned
+       with the finished windows, so no values are lost.
+    """
+
+    def __init__(self, seconds, label, size=SERIES):
+        """initialize"""
+        self.seconds = seconds
+        self.label = label
+        self._size = size
+        self._data = array.array('d', bytes(8 * FIELDS * size))
+        self._slots = {}
+        self._keys = [None] * size
+        self._next = 0
+        self._end = None
+        self.evicted = 0
+
+    def __len__(self):
+        """number of series with values in the current window"""
+        return len(self._slots)
+
+    def _aggregate(self, key, slot):
+        """the (key, count, min, max, mean) of the values in a slot"""
+        data = self._data
+        pos = slot * FIELDS
+        count = data[pos]
+        return (key, int(count), data[pos + 2], data[pos + 3],
+                data[pos + 1] / count)
+
+    def _slot(self, key, done):
+        """the slot of key, taking over the oldest slot if needed
+
+           The aggregate of a series that loses its slot is added to done.
+        """
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._next
+            self._next = (slot + 1) % self._size
+            old = self._keys[slot]
+            if old is not None:
+                del self._slots[old]
+                done.append(self._aggregate(old, slot))
+                self.evicted += 1
+                ROLLUPS_EVICTED.inc()
+            self._keys[slot] = key
+            self._slots[key] = slot
+            self._data[slot * FIELDS] = 0
+        return slot
+
+    def add(self, key, value, now):
+        """add a value, returns the aggregates of a finished window"""
+        done = self.collect(now)
+        if self._end is None:
+            self._end = (now // self.seconds + 1) * self.seconds
+        data = self._data
+        pos = self._slot(key, done) * FIELDS
+        count = data[pos]
+        if count:
+            data[pos + 2] = min(data[pos + 2], value)
+            data[pos + 3] = max(data[pos + 3], value)
+            data[pos + 1] += value
+        else:
+            data[pos + 1] = data[pos + 2] = data[pos + 3] = value
+        data[pos] = count + 1
+        return done
+
+    def collect(self, now):
+        """the (key, count, min, max, mean) of a finished window"""
+        if self._end is None or now < self._end:
+            return []
+        done = [self._aggregate(key, slot)
+                for key, slot in self._slots.items()]
+        self._slots.clear()
+        self._keys = [None] * self._size
+        self._next = 0
+        self._end = None
+        return done
+
+
+class Rollups:
+    """rollups of the numeric readings over one or more windows"""
+
+    def __init__(self, windows, readings=None, size=SERIES):
+        """initialize
+
+           windows is a sequence of (seconds, label), readings the readings
+           to aggregate, all numeric ones if None.
+        """
+        self._windows = [RollupWindow(seconds, label, size)
+                         for seconds, label in windows]
+        self._readings = None if readings is None else frozenset(readings)
+        self._lock = threading.Lock()
+
+    def _messages(self, window, done):
+        """(topic, reading, payload) of the aggregates of a window"""
+        return [('%s/%s' % (topic, window.label), reading, codec.dumps({
+            'count': count, 'min': low, 'max': high, 'mean': mean,
+        })) for (topic, reading), count, low, high, mean in done]
+
+    def add(self, topic, reading, value, now=None):
+        """aggregate a reading, returns messages of finished windows"""
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return []
+        if self._readings is not None and reading not in self._readings:
+            return []
+        now = time.time() if now is None else now
+        messages = []
+        with self._lock:
+            for window in self._windows:
+                done = window.add((topic, reading), value, now)
+                if done:
+                    messages.extend(self._messages(window, done))
+        return messages
+
+    def collect(self, now=None):
+        """messages of all windows that finished by now"""
+        now = time.time() if now is None else now
+        messages = []
+        with self._lock:
+            for window in self._windows:
+                done = window.collect(now)
+                if done:
+                    messages.extend(self._messages(window, done))
+        return messages
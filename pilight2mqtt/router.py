@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+routing of commands received through mqtt
+"""
+
+from pilight2mqtt.log import Loggable, traffic
+
+__all__ = ['CommandRouter', 'VERBS']
+
+VERBS = ('STATE', 'DIMLEVEL', 'VALUES')
+
+
+class CommandRouter(Loggable):
+    """route $TOPIC/set/<device>/<verb> messages to a handler
+
+       Only the command subtrees are subscribed, so the bridge's own status
+       messages never reach it. Every verb gets a callback of its own in the
+       mqtt client, the device is cut out of the topic without a regex.
+    """
+
+    def __init__(self, prefix, handler, verbs=VERBS):
+        """initialize, handler is called as handler(device, verb, payload)"""
+        self._prefix = '%s/set/' % prefix
+        self._handler = handler
+        self._suffixes = {verb: '/%s' % verb for verb in verbs}
+
+    def subscriptions(self, qos=0):
+        """the topics to subscribe to"""
+        return [('%s+%s' % (self._prefix, suffix), qos)
+                for suffix in self._suffixes.values()]
+
+    def _device(self, topic, verb):
+        """extract the device from a command topic or return None"""
+        suffix = self._suffixes[verb]
+        if topic.startswith(self._prefix) and topic.endswith(suffix):
+            device = topic[len(self._prefix):-len(suffix)]
+            if device and '/' not in device:
+                return device
+        return None
+
+    def _callback(self, verb):
+        """mqtt message callback for one verb"""
+        def on_verb(client, userdata, msg):  # pylint: disable=unused-argument
+            traffic('mqtt>', msg.topic, msg.payload)
+            device = self._device(msg.topic, verb)
+            if device is not None:
+                self._handler(device, verb, msg.payload)
+        return on_verb
+
+    def attach(self, client):
+        """register one callback per verb with the mqtt client"""
+        for sub, _ in self.subscriptions():
+            verb = sub[sub.rindex('/') + 1:]
+            client.message_callback_add(sub, self._callback(verb))
+
+    def route(self, topic, payload):
+        """route a message, returns False if it is not a command"""
+        verb = topic[topic.rfind('/') + 1:]
+        if verb not in self._suffixes:
+            return False
+        device = self._device(topic, verb)
+        if device is None:
+            return False
+        self._handler(device, verb, payload)
+        return True
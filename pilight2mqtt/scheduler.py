@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+scheduling of the commands sent to pilight
+
+Commands received through MQTT are queued instead of being sent one round
+trip at a time. Of several commands to the same device only the latest is
+sent, commands are written without waiting for the answer to the previous
+one and no more than rate commands per second go out, as every one of them
+takes air time on 433MHz.
+"""
+
+import collections
+import threading
+import time
+
+from pilight2mqtt import codec
+from pilight2mqtt.control import CONTROL_TIMEOUT, ControlConnection
+from pilight2mqtt.core import ConnectionLostException, PilightServer
+from pilight2mqtt.log import Loggable
+from pilight2mqtt.metrics import metrics
+
+__all__ = ['CommandScheduler']
+
+COMMAND_RATE = 5
+COMMAND_BURST = 2
+PIPELINE_DEPTH = 8
+ATTEMPTS = 2
+
+COMMANDS_SENT = metrics.counter(
+    'pilight2mqtt_commands_sent_total',
+    'Commands pilight confirmed')
+COMMANDS_FAILED = metrics.counter(
+    'pilight2mqtt_commands_failed_total',
+    'Commands pilight rejected or that got lost')
+COMMANDS_COALESCED = metrics.counter(
+    'pilight2mqtt_commands_coalesced_total',
+    'Commands replaced by a newer one for the same device before sending')
+COMMAND_SECONDS = metrics.histogram_family(
+    'pilight2mqtt_command_seconds',
+    'Time from receiving a command until pilight confirmed it',
+    'device',
+    (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+
+
+class CommandScheduler(Loggable):
+    """send commands pipelined and rate limited on one control connection
+
+       Commands wait per device, a newer command replaces one that was
+       not sent yet. Up to depth commands are sent before their answers
+       arrive, pilight answers them in order. Sending is limited to rate
+       commands per second with bursts of up to burst commands, a rate of
+       0 does not limit it. Commands lost with a broken connection are
+       sent again, once. Commands in flight remember their connection,
+       answers on a new connection are never matched with them.
+    """
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 address, port, rate=COMMAND_RATE, burst=COMMAND_BURST,
+                 depth=PIPELINE_DEPTH, timeout=CONTROL_TIMEOUT):
+        """initialize"""
+        self.log.debug('__init__(%s, %s, %s)', address, port, rate)
+        self._address = address
+        self._port = port
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._depth = max(1, depth)
+        self._timeout = timeout
+        self._tokens = self._burst
+        self._filled = time.monotonic()
+        self._pending = collections.OrderedDict()
+        self._inflight = collections.deque()
+        self._cond = threading.Condition()
+        self._conn = None
+        self._threads = []
+        self._stopped = False
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        metrics.gauge('pilight2mqtt_commands_pending',
+                      'Commands waiting to be sent or confirmed',
+                      lambda: len(self._pending) + len(self._inflight))
+
+    @classmethod
+    def for_server(cls, server, **kwargs):
+        """create a scheduler sending to the same pilight as server"""
+        return cls(server.address, server.port, **kwargs)
+
+    def __len__(self):
+        """number of commands waiting to be sent"""
+        return len(self._pending)
+
+    def set_device_state(self, device, state, values=None):
+        """queue a command, returns immediately"""
+        with self._cond:
+            self._start()
+            entry = self._pending.get(device)
+            if entry is not None:
+                self.coalesced += 1
+                COMMANDS_COALESCED.inc()
+                received = entry[2]
+            else:
+                received = time.monotonic()
+            self._pending[device] = (state, values, received, ATTEMPTS)
+            self._cond.notify_all()
+        return True
+
+    def close(self):
+        """stop sending, commands not sent yet are dropped"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.disconnect()
+        for thread in self._threads:
+            thread.join(self._timeout)
+
+    def _start(self):
+        """start the sender and receiver on first use"""
+        if self._threads:
+            return
+        for name, target in (('commands', self._send_loop),
+                             ('answers', self._receive_loop)):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _delay(self, now):
+        """seconds until the next command may be sent, takes a token"""
+        if self._rate <= 0:
+            return 0
+        self._tokens = min(self._burst, self._tokens +
+                           (now - self._filled) * self._rate)
+        self._filled = now
+        if self._tokens < 1:
+            return (1 - self._tokens) / self._rate
+        self._tokens -= 1
+        return 0
+
+    def _next(self):
+        """wait for the next command to send, None once stopped"""
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                if self._pending and len(self._inflight) < self._depth:
+                    delay = self._delay(time.monotonic())
+                    if not delay:
+                        break
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            return self._pending.popitem(last=False)
+
+    def _connection(self):
+        """the control connection, opened if needed"""
+        if self._conn is None:
+            conn = ControlConnection(self._address, self._port,
+                                     timeout=self._timeout)
+            if not conn.connect():
+                conn.disconnect()
+                raise ConnectionLostException('identify failed')
+            self._conn = conn
+        return self._conn
+
+    def _send_loop(self):
+        """send queued commands without waiting for their answers"""
+        while True:
+            command = self._next()
+            if command is None:
+                return
+            device, (state, values, received, attempts) = command
+            msg = codec.message(
+                PilightServer._control_msg(  # pylint: disable=protected-access
+                    device, state, values))
+            try:
+                conn = self._connection()
+            except (ConnectionLostException, OSError, ValueError) as ex:
+                self.log.warning('could not open control connection: %s', ex)
+                self._requeue([(device, state, values, received, attempts)])
+                continue
+            with self._cond:
+                if conn is not self._conn:
+                    # lost while the connection was looked up
+                    lost = True
+                else:
+                    lost = False
+                    self._inflight.append(
+                        (conn, device, state, values, received, attempts))
+                    self._cond.notify_all()
+            if lost:
+                # it was not sent, so it does not count as an attempt
+                self._requeue([(device, state, values, received,
+                                attempts + 1)])
+                continue
+            try:
+                conn.send(msg)
+            except (ConnectionLostException, OSError) as ex:
+                self._lost(conn, ex)
+
+    def _receive_loop(self):
+        """match the answers of pilight with the commands sent"""
+        while True:
+            with self._cond:
+                while not self._stopped and (
+                        not self._inflight or self._conn is None):
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                conn = self._conn
+            try:
+                answer = conn.receive()
+            except (ConnectionLostException, OSError, ValueError) as ex:
+                self._lost(conn, ex)
+                continue
+            with self._cond:
+                if conn is not self._conn or not self._inflight or \
+                        self._inflight[0][0] is not conn:
+                    continue
+                _, device, _, _, received, _ = self._inflight.popleft()
+                self._cond.notify_all()
+            if answer.get('status') == 'success':
+                self.sent += 1
+                COMMANDS_SENT.inc()
+                COMMAND_SECONDS.labels(device).observe(
+                    time.monotonic() - received)
+            else:
+                self.failed += 1
+                COMMANDS_FAILED.inc()
+                self.log.warning('pilight rejected command for "%s"', device)
+
+    def _lost(self, conn, error):
+        """drop a broken connection, its unanswered commands are resent"""
+        with self._cond:
+            if conn is not self._conn:
+                return
+            self._conn = None
+            lost = [command[1:] for command in self._inflight]
+            self._inflight.clear()
+            self._cond.notify_all()
+        conn.disconnect()
+        if not self._stopped:
+            self.log.warning('control connection failed: %s', error)
+            self._requeue(lost)
+
+    def _requeue(self, commands):
+        """queue commands again unless they were tried too often"""
+        with self._cond:
+            for device, state, values, received, attempts in reversed(
+                    commands):
+                if attempts <= 1 or device in self._pending:
+                    if device not in self._pending:
+                        self.failed += 1
+                        COMMANDS_FAILED.inc()
+                    continue
+                self._pending[device] = (state, values, received,
+                                         attempts - 1)
+                self._pending.move_to_end(device, last=False)
+            self._cond.notify_all()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+sharded bridge running on several processes
+
+One process reads frames from pilight, it only splits the stream into
+frames. Updates of one device go to one of several worker processes by
+its name, every worker decodes, filters and publishes the events of its
+devices through an MQTT connection of its own. Frames are copied into a
+ring buffer in shared memory per worker, nothing is pickled. Updates of
+several devices, config and values frames go to all workers, which only
+publish the readings of their own devices. Commands are handled by the
+first worker.
+"""
+
+import ctypes
+import multiprocessing
+import re
+import signal
+import struct
+import time
+import zlib
+
+from pilight2mqtt.core import (HEARTBEAT_INTERVAL, HEARTBEAT_MISSES,
+                               Pilight2MQTT)
+from pilight2mqtt.event import PilightEvent
+from pilight2mqtt.log import Loggable
+from pilight2mqtt.metrics import metrics
+from pilight2mqtt.startup import FIRST_EVENT
+
+__all__ = ['RingBuffer', 'ShardBridge', 'ShardedPilight2MQTT',
+           'frame_shard', 'device_shard']
+
+RING_SIZE = 1 << 20
+# arguments of Pilight2MQTT the workers do not use
+THREAD_ENGINE_ARGS = ('workers', 'queue_size', 'queue_policy')
+PUT_TIMEOUT = 0.1
+GET_TIMEOUT = 1.0
+
+FRAMES_DROPPED = metrics.counter(
+    'pilight2mqtt_shard_dropped_total',
+    'Frames dropped because the ring buffer of a worker was full')
+
+_LENGTH = struct.Struct('<I')
+_CLOSED = 0xffffffff
+_ONE_DEVICE = re.compile(rb'"devices"\s*:\s*\[\s*"([^"]*)"\s*\]')
+_UPDATE = b'"origin":"update"'
+
+
+def device_shard(device, shards):
+    """the worker publishing the events of device"""
+    return zlib.crc32(device.encode('utf-8')) % shards
+
+
+def frame_shard(frame, shards):
+    """the worker for an update frame, None if all workers get it
+
+       The raw frame is searched for its device, it is not parsed.
+       Updates of several devices and names with escapes go to all
+       workers, which decode them.
+    """
+    if _UPDATE not in frame:
+        return None
+    match = _ONE_DEVICE.search(frame)
+    if match is None or b'\\' in match.group(1):
+        return None
+    return zlib.crc32(match.group(1)) % shards
+
+
+class RingBuffer:
+    """frames from one process to another through shared memory
+
+       One process puts, one other process gets. Frames are stored with
+       their length, the positions only ever grow and wrap around the
+       buffer. The positions are only read and written holding a lock,
+       which orders the copies of the frames before the positions that
+       hand them over, also on weakly ordered CPUs like the ARM of a
+       Raspberry Pi. The frames are copied without holding it. The reader
+       takes frames while there are any and only waits for a wakeup from
+       the writer once the buffer is empty.
+    """
+
+    WAKEUP = 0.05
+
+    def __init__(self, size=RING_SIZE, context=multiprocessing):
+        """initialize, the buffer must be created before forking"""
+        self._size = size
+        self._buf = context.RawArray(ctypes.c_char, size)
+        self._view = memoryview(self._buf).cast('B')
+        self._head = context.RawValue(ctypes.c_uint64, 0)
+        self._tail = context.RawValue(ctypes.c_uint64, 0)
+        self._waiting = context.RawValue(ctypes.c_int, 0)
+        self._lock = context.Lock()
+        self._wakeup = context.Semaphore(0)
+        self.dropped = 0
+
+    def __len__(self):
+        """number of bytes in use"""
+        with self._lock:
+            return self._tail.value - self._head.value
+
+    def _room(self):
+        """bytes the writer can store"""
+        with self._lock:
+            return self._size - (self._tail.value - self._head.value)
+
+    def _write(self, pos, data):
+        """copy data to pos, wrapping around the end"""
+        start = pos % self._size
+        end = start + len(data)
+        if end <= self._size:
+            self._view[start:end] = data
+        else:
+            split = self._size - start
+            self._view[start:] = data[:split]
+            self._view[:end - self._size] = data[split:]
+
+    def _read(self, pos, length):
+        """bytes at pos, wrapping around the end"""
+        start = pos % self._size
+        end = start + length
+        if end <= self._size:
+            return self._view[start:end].tobytes()
+        return self._view[start:].tobytes() + \
+            self._view[:end - self._size].tobytes()
+
+    def _put(self, header, frame, timeout):
+        """store a record, False if there was no room in time"""
+        need = _LENGTH.size + len(frame)
+        if need > self._size:
+            return False
+        deadline = None
+        while self._room() < need:
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + timeout
+            if now >= deadline:
+                return False
+            time.sleep(0.0005)
+        # only this process moves the tail
+        tail = self._tail.value
+        self._write(tail, _LENGTH.pack(header))
+        if frame:
+            self._write(tail + _LENGTH.size, frame)
+        with self._lock:
+            self._tail.value = tail + need
+            waiting = self._waiting.value
+            self._waiting.value = 0
+        if waiting:
+            self._wakeup.release()
+        return True
+
+    def put(self, frame, timeout=PUT_TIMEOUT):
+        """add a frame, it is dropped if there is no room within timeout"""
+        if self._put(len(frame), frame, timeout):
+            return True
+        self.dropped += 1
+        FRAMES_DROPPED.inc()
+        return False
+
+    def close(self, timeout=GET_TIMEOUT):
+        """tell the reader that no more frames follow"""
+        return self._put(_CLOSED, b'', timeout)
+
+    def _ready(self, head, waiting=0):
+        """check for a frame at head, else flag that the reader waits"""
+        with self._lock:
+            if self._tail.value != head:
+                return True
+            self._waiting.value = waiting
+            return False
+
+    def get(self, timeout=None):
+        """the next frame, None on timeout and b'' once closed"""
+        # only this process moves the head
+        head = self._head.value
+        if not self._ready(head):
+            deadline = None if timeout is None else \
+                time.monotonic() + timeout
+            while not self._ready(head, waiting=1):
+                wait = self.WAKEUP
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        self._ready(head)
+                        return None
+                self._wakeup.acquire(timeout=wait)
+        length, = _LENGTH.unpack(self._read(head, _LENGTH.size))
+        if length == _CLOSED:
+            head += _LENGTH.size
+            frame = b''
+        else:
+            frame = self._read(head + _LENGTH.size, length)
+            head += _LENGTH.size + length
+        with self._lock:
+            self._head.value = head
+        return frame
+
+
+class ShardBridge(Pilight2MQTT):
+    """the bridge of one worker, handling the frames of a ring buffer"""
+
+    def __init__(self, shard, shards, *args, **kwargs):
+        """initialize, the other arguments are those of Pilight2MQTT"""
+        super().__init__(*args, **kwargs)
+        self._shard = shard
+        self._shards = shards
+        self._stats_topic = '%s/%d' % (self._stats_topic, shard)
+        if shard:
+            # commands are only received by the first worker
+            self._routers = []
+
+    def _handle_update(self, site, event):
+        """publish the readings of the devices that belong to this worker"""
+        devices = tuple([device for device in event.devices
+                         if device_shard(device, self._shards) == self._shard])
+        if len(devices) < len(event.devices):
+            if not devices:
+                return
+            event = PilightEvent(event.origin, event.type, devices,
+                                 event.values)
+        super()._handle_update(site, event)
+
+    def serve(self, ring):
+        """handle frames until the ring buffer is closed"""
+        if not self._mqtt_connect():
+            return 1
+        self._mqtt_client.loop_start()
+        while True:
+            frame = ring.get(GET_TIMEOUT)
+            if frame is None:
+                self._tick()
+            elif not frame:
+                break
+            else:
+                self._handle_event(frame)
+        self._publisher.close()
+        self._close_controls()
+        self._mqtt_client.loop_stop()
+        self._mqtt_client.disconnect()
+        return 0
+
+
+def _work(shard, shards, ring, args, kwargs):
+    """main function of a worker process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    return ShardBridge(shard, shards, *args, **kwargs).serve(ring)
+
+
+class ShardedPilight2MQTT(Loggable):
+    """read pilight in this process, handle events in worker processes
+
+       Takes the arguments of Pilight2MQTT, every worker gets a copy of
+       them when it is forked. shards is the number of workers and
+       ring_size the bytes of the ring buffer of each worker. The workers
+       handle events on their main thread, the worker threads and queues
+       of the thread engine are not used.
+    """
+
+    def __init__(self, server, *args, shards=2, ring_size=RING_SIZE,
+                 **kwargs):
+        """initialize"""
+        self._server = server
+        self._args = (server,) + args
+        self._startup = kwargs.pop('startup', None)
+        for name in THREAD_ENGINE_ARGS:
+            kwargs.pop(name, None)
+        self._kwargs = kwargs
+        self._shards = max(1, shards)
+        self._context = multiprocessing.get_context('fork')
+        self._rings = [RingBuffer(ring_size, self._context)
+                       for _ in range(self._shards)]
+        self._processes = []
+        metrics.gauge('pilight2mqtt_shard_buffer_bytes',
+                      'Bytes waiting in the ring buffers of the workers',
+                      lambda: sum(len(ring) for ring in self._rings))
+
+    @property
+    def dropped(self):
+        """number of frames dropped because a ring buffer was full"""
+        return sum(ring.dropped for ring in self._rings)
+
+    def put(self, frame):
+        """hand a frame to the worker of its devices, or to all"""
+        shard = frame_shard(frame, self._shards)
+        if shard is None:
+            for ring in self._rings:
+                ring.put(frame)
+        else:
+            self._rings[shard].put(frame)
+        if self._startup is not None:
+            self._startup.mark(FIRST_EVENT)
+            self._startup = None
+
+    def _start_workers(self):
+        """fork the workers"""
+        for shard, ring in enumerate(self._rings):
+            process = self._context.Process(
+                target=_work, name='shard-%d' % shard,
+                args=(shard, self._shards, ring, self._args, self._kwargs))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+
+    def _stop_workers(self):
+        """let the workers handle what is queued and wait for them"""
+        for ring in self._rings:
+            ring.close()
+        for process in self._processes:
+            process.join(GET_TIMEOUT * 5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+    def run(self):
+        """main run method"""
+        self.log.debug('run')
+        if isinstance(self._server, dict):
+            self.log.error('Several pilight servers need the asyncio engine')
+            return 1
+
+        def stop_server(signum, frame):  # pylint: disable=missing-docstring
+            self.log.debug("SIGINT")
+            self._server.terminate()
+
+        self._start_workers()
+        signal.signal(signal.SIGINT, stop_server)
+        try:
+            if not self._server.connect():
+                self.log.error('Could not connect to server')
+                return 1
+            if self._startup is not None:
+                self._startup.mark('pilight identify')
+            if not self._server.heartbeat():
+                self.log.error('pilight did not answer the heartbeat')
+                self._server.disconnect()
+                return 1
+            self._server.keepalive(
+                self._kwargs.get('heartbeat_interval', HEARTBEAT_INTERVAL),
+                self._kwargs.get('heartbeat_misses', HEARTBEAT_MISSES))
+            self._server.request_config()
+            self._server.request_values()
+            self._server.process_events(self.put)
+            self._server.disconnect()
+        finally:
+            self._stop_workers()
+        if self.dropped:
+            self.log.warning('Dropped %d frames', self.dropped)
+        return 0
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+spool of mqtt messages for outages of the broker
+
+While the broker can not be reached messages are appended to a memory
+mapped file instead of being lost. Of compacted messages, the state of a
+device, only the latest per topic is kept. Other messages, e.g. sensor
+readings, are all kept in order, so their history has no gaps. Once
+connected again the spool is published in batches at a limited rate, new
+messages queue up behind it.
+"""
+
+import mmap
+import os
+import struct
+import threading
+
+from pilight2mqtt.log import Loggable
+from pilight2mqtt.metrics import metrics
+
+__all__ = ['Spool', 'SPOOL_SIZE']
+
+SPOOL_SIZE = 16 << 20
+MAGIC = b'P2MSPL01'
+
+# magic, offset of the first and behind the last record
+_HEADER = struct.Struct('<8sQQ')
+# live, qos, retain, compact, length of topic and payload
+_RECORD = struct.Struct('<BBBBHI')
+
+MESSAGES_SPOOLED = metrics.counter(
+    'pilight2mqtt_spool_messages_total',
+    'Messages written to the spool')
+MESSAGES_DRAINED = metrics.counter(
+    'pilight2mqtt_spool_drained_total',
+    'Messages published from the spool')
+MESSAGES_DROPPED = metrics.counter(
+    'pilight2mqtt_spool_dropped_total',
+    'Messages dropped because the spool was full')
+
+
+def _payload(payload):
+    """payload as bytes, converted like paho does"""
+    if isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, str):
+        return payload.encode('utf-8')
+    if payload is None:
+        return b''
+    if isinstance(payload, (int, float)):
+        return str(payload).encode('ascii')
+    return bytes(payload)
+
+
+class Spool(Loggable):
+    """append only file of messages with a size limit
+
+       The file is size bytes, a larger existing file keeps its size.
+       Records start with a live flag, a compacted record is marked dead
+       once a newer compacted one of its topic is written. Which messages
+       are compacted is up to the caller, see StateStore.compact. When
+       the end of the file is reached the live records are moved to its
+       start, when that is not enough the oldest ones are dropped.
+    """
+
+    def __init__(self, path, size=SPOOL_SIZE):
+        """open or create the spool at path"""
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            size = max(size, os.fstat(fd).st_size, _HEADER.size * 2)
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._size = size
+        self._lock = threading.RLock()
+        self._latest = {}
+        self._count = 0
+        self.dropped = 0
+        magic, self._head, self._tail = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or not \
+                _HEADER.size <= self._head <= self._tail <= size:
+            self._head = self._tail = _HEADER.size
+            self._write_header()
+        self._load()
+        metrics.gauge('pilight2mqtt_spool_bytes',
+                      'Bytes of messages in the spool',
+                      lambda: self._tail - self._head)
+
+    def __len__(self):
+        """number of messages waiting to be published"""
+        return self._count
+
+    def _write_header(self):
+        """store the positions of the first and last record"""
+        _HEADER.pack_into(self._map, 0, MAGIC, self._head, self._tail)
+
+    def _records(self):
+        """(pos, end, live, qos, retain, compact, topic, payload) each"""
+        pos = self._head
+        while pos < self._tail:
+            live, qos, retain, compact, topic_len, payload_len = \
+                _RECORD.unpack_from(self._map, pos)
+            start = pos + _RECORD.size
+            end = start + topic_len + payload_len
+            if end > self._tail:
+                raise ValueError('record at %d ends behind the spool' % pos)
+            yield (pos, end, live, qos, retain, compact,
+                   self._map[start:start + topic_len],
+                   self._map[start + topic_len:end])
+            pos = end
+
+    def _load(self):
+        """index the records of an existing spool"""
+        try:
+            for pos, _, live, _, _, compact, topic, _ in self._records():
+                if live:
+                    self._count += 1
+                    if compact:
+                        self._latest[topic] = pos
+        except (ValueError, struct.error) as ex:
+            self.log.warning('Discarding damaged spool %s: %s',
+                             self.path, ex)
+            self._head = self._tail = _HEADER.size
+            self._write_header()
+            self._latest = {}
+            self._count = 0
+        if self._count:
+            self.log.info('%d messages waiting in %s', self._count, self.path)
+
+    def _compact(self, need):
+        """move the live records to the start, dropping the oldest ones
+           until need bytes are free behind them
+        """
+        live = [(end - pos, qos, retain, compact, topic, payload)
+                for pos, end, alive, qos, retain, compact, topic, payload
+                in self._records() if alive]
+        used = sum(record[0] for record in live)
+        room = self._size - _HEADER.size
+        dropped = 0
+        while live and used + need > room:
+            used -= live[dropped][0]
+            dropped += 1
+            if dropped == len(live):
+                break
+        if dropped:
+            self.dropped += dropped
+            MESSAGES_DROPPED.inc(dropped)
+            self.log.warning('Spool full, dropped %d messages', dropped)
+            live = live[dropped:]
+        self._latest = {}
+        self._count = 0
+        pos = _HEADER.size
+        for _, qos, retain, compact, topic, payload in live:
+            pos = self._put(pos, qos, retain, compact, topic, payload)
+        self._head = _HEADER.size
+        self._tail = pos
+        self._write_header()
+
+    def _put(self, pos, qos, retain, compact, topic, payload):
+        """write a live record at pos, returns the end of it"""
+        _RECORD.pack_into(self._map, pos, 1, qos, retain, compact,
+                          len(topic), len(payload))
+        start = pos + _RECORD.size
+        end = start + len(topic) + len(payload)
+        self._map[start:start + len(topic)] = topic
+        self._map[start + len(topic):end] = payload
+        self._count += 1
+        if compact:
+            self._latest[topic] = pos
+        return end
+
+    def append(self, topic, payload, qos=0, retain=False, compact=False):
+        """add a message, False if it is larger than the spool
+
+           A compacted message replaces the compacted message of its topic
+           that is still waiting.
+        """
+        topic = topic.encode('utf-8')
+        payload = _payload(payload)
+        need = _RECORD.size + len(topic) + len(payload)
+        if need > self._size - _HEADER.size:
+            self.dropped += 1
+            MESSAGES_DROPPED.inc()
+            return False
+        with self._lock:
+            if compact:
+                older = self._latest.pop(topic, None)
+                if older is not None:
+                    # only the latest state of a topic is published
+                    self._map[older] = 0
+                    self._count -= 1
+            if self._tail + need > self._size:
+                self._compact(need)
+            self._tail = self._put(self._tail, qos, int(bool(retain)),
+                                   int(bool(compact)), topic, payload)
+            self._write_header()
+        MESSAGES_SPOOLED.inc()
+        return True
+
+    def drain(self, publish, count):
+        """publish up to count messages in order, returns the number sent
+
+           publish(topic, payload, qos, retain) returns False if the
+           message could not be sent, it stays in the spool then.
+        """
+        sent = 0
+        with self._lock:
+            head = self._head
+            for pos, end, live, qos, retain, compact, topic, payload in \
+                    self._records():
+                if live:
+                    if sent >= count or not publish(
+                            topic.decode('utf-8'), payload, qos,
+                            bool(retain)):
+                        break
+                    sent += 1
+                    self._count -= 1
+                    if compact and self._latest.get(topic) == pos:
+                        del self._latest[topic]
+                head = end
+            self._head = head
+            if self._head == self._tail:
+                self._head = self._tail = _HEADER.size
+            self._write_header()
+        MESSAGES_DRAINED.inc(sent)
+        return sent
+
+    def flush(self):
+        """write the changes to disk"""
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        """flush and unmap the file"""
+        with self._lock:
+            self._map.flush()
+            self._map.close()
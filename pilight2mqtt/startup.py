@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+time spent starting pilight2mqtt
+
+Every phase lasts from the end of the previous one until it is marked,
+so the phases add up to the time from parsing the arguments until the
+first event from pilight was handled.
+"""
+
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+__all__ = ['StartupProfile', 'PHASES', 'FIRST_EVENT']
+
+FIRST_EVENT = 'first event'
+PHASES = ('arguments', 'imports', 'discovery', 'setup', 'mqtt connect',
+          'pilight identify', FIRST_EVENT)
+
+
+class StartupProfile:
+    """seconds per phase of the startup, reported after the first event"""
+
+    def __init__(self, start=None, stream=None, clock=time.perf_counter):
+        """initialize, the first phase starts at start, by default now"""
+        self._stream = stream
+        self._clock = clock
+        self._last = clock() if start is None else start
+        self._lock = threading.Lock()
+        self.phases = {}
+        self.done = False
+
+    @property
+    def total(self):
+        """seconds of all phases so far"""
+        return sum(self.phases.values())
+
+    def mark(self, phase):
+        """end phase now, the first event completes the profile"""
+        with self._lock:
+            if self.done:
+                return
+            now = self._clock()
+            self.phases[phase] = self.phases.get(phase, 0) + now - self._last
+            self._last = now
+            self.done = phase == FIRST_EVENT
+        if self.done:
+            self.report()
+
+    def report(self):
+        """write the time of every phase"""
+        stream = self._stream if self._stream is not None else sys.stderr
+        for phase in PHASES:
+            if phase in self.phases:
+                print('startup %-18s %8.1f ms' % (
+                    phase, self.phases[phase] * 1000), file=stream)
+        print('startup %-18s %8.1f ms' % ('total', self.total * 1000),
+              file=stream)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+latest state of all devices
+
+The last value of every reading is kept, so it can be published retained
+and published again whenever the connection to the broker is renewed.
+"""
+
+import threading
+
+__all__ = ['StateStore', 'parse_publish_rule']
+
+RETAIN_FLAGS = {'retain': True, 'noretain': False}
+# readings that are the state of a device, not a history of measurements
+COMPACT = ('STATE', 'DIMLEVEL')
+
+
+def parse_publish_rule(text):
+    """parse READING=QOS[:retain|:noretain] into (reading, qos, retain)
+
+       retain is None if the rule does not set it.
+    """
+    try:
+        reading, spec = text.split('=', 1)
+        qos, _, flag = spec.partition(':')
+        qos = int(qos)
+        if qos not in (0, 1, 2):
+            raise ValueError(qos)
+        retain = RETAIN_FLAGS[flag.lower()] if flag else None
+        return reading.strip().upper(), qos, retain
+    except (ValueError, KeyError):
+        raise ValueError('invalid rule "%s", expected '
+                         'READING=QOS[:retain|:noretain]' % text)
+
+
+class StateStore:
+    """latest value per status topic and publish options per reading"""
+
+    def __init__(self, qos=0, retain=True, rules=(), compact=COMPACT):
+        """initialize, rules is a sequence of (reading, qos, retain)
+
+           compact are the readings of which only the latest value matters,
+           older ones need not be published once a newer one is known.
+        """
+        self._default = (qos, retain)
+        self._compact = frozenset(compact)
+        self._options = {}
+        for reading, rqos, rretain in rules:
+            self._options[reading] = (
+                rqos, retain if rretain is None else rretain)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """number of known readings"""
+        return len(self._values)
+
+    def options(self, reading):
+        """(qos, retain) to publish reading with"""
+        return self._options.get(reading, self._default)
+
+    def compact(self, reading):
+        """check if only the latest value of reading needs publishing"""
+        return reading in self._compact
+
+    def update(self, topic, reading, value):
+        """remember the latest value of a topic"""
+        with self._lock:
+            self._values[topic] = (reading, value)
+
+    def get(self, topic, default=None):
+        """latest value of a topic"""
+        entry = self._values.get(topic)
+        return default if entry is None else entry[1]
+
+    def snapshot(self):
+        """(topic, value, qos, retain) of every retained reading"""
+        with self._lock:
+            items = list(self._values.items())
+        messages = []
+        for topic, (reading, value) in items:
+            qos, retain = self.options(reading)
+            if retain:
+                messages.append((topic, value, qos, retain))
+        return messages
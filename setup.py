@@ -11,9 +11,15 @@ DOWNLOAD_URL = ('https://github.com/mcdeck/pilight2mqtt/archive/'
 PACKAGES = find_packages(exclude=['tests', 'tests.*'])
 
 REQUIRES = [
-    'paho-mqtt'
+    'paho-mqtt>=1.5,<2'
 ]
 
+EXTRAS = {
+    # orjson has no wheels for older pythons, ujson is used there instead
+    'fast-json': ['orjson; python_version >= "3.6"',
+                  'ujson; python_version < "3.6"'],
+}
+
 setup(
     name=PACKAGE_NAME,
     version=__version__,
@@ -28,6 +34,7 @@ setup(
     zip_safe=False,
     platforms='any',
     install_requires=REQUIRES,
+    extras_require=EXTRAS,
     test_suite='tests',
     keywords=['home', 'automation'],
     entry_points={
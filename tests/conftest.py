@@ -0,0 +1,169 @@
+import json
+import socketserver
+import threading
+import time
+
+import pytest
+from paho.mqtt.client import topic_matches_sub
+
+SUCCESS = b'{"status":"success"}\n\n'
+BEAT = b'BEAT\n\n'
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeClient:
+    """records what would be published, publish returns result
+
+       Messages given to deliver are passed to the callbacks of the
+       subscriptions they match.
+    """
+
+    def __init__(self, result=0):
+        self.result = result
+        self.published = []
+        self.callbacks = {}
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if self.result == 0:
+            self.published.append((topic, payload, qos, retain))
+        return (self.result, len(self.published))
+
+    def subscribe(self, topics):
+        return (0, 0)
+
+    def message_callback_add(self, sub, callback):
+        self.callbacks[sub] = callback
+
+    def deliver(self, topic, payload):
+        for sub, callback in self.callbacks.items():
+            if topic_matches_sub(sub, topic):
+                callback(self, None, FakeMessage(topic, payload))
+
+
+@pytest.fixture
+def mqtt_client():
+    return FakeClient()
+
+
+class FakePilight(socketserver.ThreadingTCPServer):
+    """a pilight daemon answering with canned frames
+
+       replies maps the action of a message to the frames sent back, heart
+       is the answer to a heartbeat, None leaves them unanswered. Each new
+       connection is sent the next of greetings after identifying, and is
+       closed right away if its number is in hang_ups. Control messages
+       are answered once hold is set, the connection is closed instead
+       when close_after commands were received.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, replies=None, heart=BEAT, greetings=(), hang_ups=()):
+        super().__init__(('127.0.0.1', 0), FakePilightHandler)
+        self.replies = {'identify': SUCCESS, 'control': SUCCESS}
+        self.replies.update(replies or {})
+        self.heart = heart
+        self.greetings = list(greetings)
+        self.hang_ups = set(hang_ups)
+        self.messages = []
+        self.commands = []
+        self.connections = 0
+        self.sockets = []
+        self.hold = threading.Event()
+        self.hold.set()
+        self.close_after = None
+        self.received = threading.Condition()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def wait_for(self, count, timeout=2):
+        with self.received:
+            return self.received.wait_for(
+                lambda: len(self.commands) >= count, timeout)
+
+    def stop(self):
+        self.hold.set()
+        self.shutdown()
+        self.server_close()
+        for sock in self.sockets:
+            sock.close()
+
+
+class FakePilightHandler(socketserver.BaseRequestHandler):
+    def frames(self):
+        """heartbeats and json messages sent by the client"""
+        data = b''
+        while True:
+            if data.startswith(b'HEART'):
+                yield b'HEART'
+                data = data[5:].lstrip(b'\n')
+            elif b'\n' in data:
+                line, data = data.split(b'\n', 1)
+                if line.strip():
+                    yield line
+            else:
+                try:
+                    chunk = self.request.recv(1024)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                data += chunk
+
+    def handle(self):
+        server = self.server
+        number = server.connections
+        server.connections += 1
+        server.sockets.append(self.request)
+        for frame in self.frames():
+            if frame == b'HEART':
+                if server.heart is not None:
+                    self.request.sendall(server.heart)
+                continue
+            msg = json.loads(frame.decode('utf-8'))
+            server.messages.append(msg)
+            action = msg.get('action')
+            if action == 'control':
+                with server.received:
+                    server.commands.append((time.monotonic(), msg['code']))
+                    server.received.notify_all()
+                if server.close_after == len(server.commands):
+                    server.close_after = None
+                    return
+                server.hold.wait()
+            self.request.sendall(server.replies.get(action, b''))
+            if action == 'identify':
+                if number < len(server.greetings):
+                    self.request.sendall(server.greetings[number])
+                if number in server.hang_ups:
+                    return
+
+
+@pytest.fixture
+def fake_pilight():
+    """start fake pilight daemons, see FakePilight for the options"""
+    servers = []
+
+    def start(**options):
+        server = FakePilight(**options)
+        threading.Thread(target=server.serve_forever, args=(0.05,),
+                         daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def pilight(fake_pilight):
+    return fake_pilight()
@@ -0,0 +1,89 @@
+import asyncio
+
+from pilight2mqtt.aio import AsyncPilightServer
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            pending = asyncio.all_tasks(loop)
+        except AttributeError:
+            # python < 3.7
+            pending = asyncio.Task.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+
+UPDATE = b'{"origin":"update","type":1,"devices":["a"],' \
+    b'"values":{"state":"on"}}\n\n'
+SUCCESS = b'{"status":"success"}\n\n'
+
+
+def test_responses_and_events_are_dispatched(fake_pilight):
+    pilight = fake_pilight(replies={'control': UPDATE + SUCCESS})
+
+    async def scenario():
+        server = AsyncPilightServer('127.0.0.1', pilight.port)
+        events = []
+        assert await server.connect()
+        task = asyncio.ensure_future(server.process_events(events.append))
+        assert await server.set_device_state('a', 'on\n')
+        server.terminate()
+        await task
+        return events
+
+    events = run(scenario())
+    assert len(events) == 1
+    assert events[0].startswith(b'{"origin":"update"')
+
+
+def test_heartbeat_before_dispatching(pilight):
+    async def scenario():
+        server = AsyncPilightServer('127.0.0.1', pilight.port)
+        assert await server.connect()
+        alive = await server.heartbeat()
+        server.disconnect()
+        return alive
+
+    assert run(scenario())
+
+
+def test_async_server_is_not_a_blocking_server():
+    from pilight2mqtt.core import PilightProtocol, PilightServer
+    server = AsyncPilightServer('127.0.0.1', 5001)
+    assert isinstance(server, PilightProtocol)
+    assert not isinstance(server, PilightServer)
+    assert not asyncio.iscoroutinefunction(server.resume)
+
+
+def test_engine_leaves_no_task_pending(pilight, mqtt_client):
+    from pilight2mqtt.aio import AsyncPilight2MQTT
+
+    mqtt_client.connect = lambda host, port, keepalive: 0
+    mqtt_client.loop_misc = lambda: 0
+    mqtt_client.disconnect = lambda: 0
+
+    async def scenario():
+        p2m = AsyncPilight2MQTT(
+            AsyncPilightServer('127.0.0.1', pilight.port), 'localhost',
+            stats_interval=0.05)
+        p2m._mqtt_client = mqtt_client
+        asyncio.get_event_loop().call_later(0.2, p2m._terminate)
+        result = await p2m._run()
+        try:
+            tasks = asyncio.all_tasks()
+        except AttributeError:
+            # python < 3.7
+            tasks = asyncio.Task.all_tasks()
+        return result, [task for task in tasks if not task.done()]
+
+    result, pending = run(scenario())
+    assert result == 0
+    assert len(pending) == 1  # the scenario itself
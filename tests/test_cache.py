@@ -0,0 +1,80 @@
+import socket
+
+import pytest
+
+from pilight2mqtt import core
+from pilight2mqtt.cache import DiscoveryCache
+from pilight2mqtt.core import PilightServer
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    calls = []
+
+    def discover(service, timeout=2, count=None):
+        calls.append(count)
+        return [('10.0.0.9', 5001)]
+
+    monkeypatch.setattr(core, 'discover', discover)
+    return calls
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_store_and_load(tmp_path):
+    cache = DiscoveryCache(str(tmp_path / 'state' / 'discovery.json'), ttl=60)
+    assert cache.load() == []
+    assert cache.store([('10.0.0.1', 5001)], now=1000)
+    assert cache.load(now=1030) == [('10.0.0.1', 5001)]
+    assert cache.load(now=1061) == []
+
+
+def test_corrupt_file_is_ignored(tmp_path):
+    path = tmp_path / 'discovery.json'
+    path.write_bytes(b'{"servers":')
+    assert DiscoveryCache(str(path)).load() == []
+
+
+def test_cached_server_is_used(tmp_path, pilight, searches):
+    cache = DiscoveryCache(str(tmp_path / 'discovery.json'))
+    cache.store([('127.0.0.1', pilight.port)])
+    server = PilightServer.discover(cache=cache)
+    assert (server.address, server.port) == ('127.0.0.1', pilight.port)
+    assert cache._thread is None
+    try:
+        assert server.connect()
+    finally:
+        server.disconnect()
+    cache._thread.join(1)
+    assert searches == [None]
+    assert cache.load() == [('10.0.0.9', 5001)]
+
+
+def test_dead_cached_server_falls_back_to_discovery(tmp_path, searches):
+    cache = DiscoveryCache(str(tmp_path / 'discovery.json'))
+    dead = [('127.0.0.1', free_port())]
+    cache.store(dead)
+    server = PilightServer.discover(cache=cache)
+    assert (server.address, server.port) == ('10.0.0.9', 5001)
+    assert searches == [1]
+    assert cache.load() == dead
+    server._connected()
+    assert cache.load() == [('10.0.0.9', 5001)]
+
+
+def test_failed_start_keeps_the_cache(tmp_path, pilight, searches):
+    cache = DiscoveryCache(str(tmp_path / 'discovery.json'))
+    cache.store([('127.0.0.1', pilight.port)])
+    server = PilightServer.discover(cache=cache)
+    server._port = free_port()
+    with pytest.raises(OSError):
+        server.connect()
+    assert cache._thread is None
+    assert searches == []
+    assert cache.load() == [('127.0.0.1', pilight.port)]
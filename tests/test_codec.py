@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from pilight2mqtt import codec
+
+
+@pytest.fixture(params=codec.BACKENDS)
+def backend(request):
+    try:
+        codec.use(request.param)
+    except ImportError:
+        pytest.skip('%s is not installed' % request.param)
+    yield request.param
+    codec.use()
+
+
+def test_loads_from_bytes(backend):
+    frame = b'{"origin":"update","devices":["a"],"values":{"t":21.5}}'
+    expected = json.loads(frame.decode('utf-8'))
+    assert codec.loads(frame) == expected
+    assert codec.loads(memoryview(frame)) == expected
+    assert codec.loads(bytearray(frame)) == expected
+
+
+def test_invalid_json_raises(backend):
+    with pytest.raises(codec.DecodeError):
+        codec.loads(b'{"status":')
+
+
+def test_message_is_one_line(backend):
+    msg = codec.message({'action': 'control', 'code': {'device': 'ä'}})
+    assert isinstance(msg, bytes)
+    assert msg.endswith(b'\n') and msg.count(b'\n') == 1
+    assert json.loads(msg.decode('utf-8'))['code']['device'] == 'ä'
+
+
+def test_dumps_sorts_keys(backend):
+    assert codec.dumps({'b': 1, 'a': 2}, sort_keys=True) == b'{"a":2,"b":1}'
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        codec.use('pickle')
+    assert codec.backend in codec.BACKENDS
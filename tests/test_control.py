@@ -0,0 +1,51 @@
+import pytest
+
+from pilight2mqtt.control import ControlConnection, ControlPool
+from pilight2mqtt.core import ConnectionLostException
+
+
+def test_control_connection_is_reused(pilight):
+    pool = ControlPool('127.0.0.1', pilight.port)
+    assert pool.set_device_state('lamp', 'on')
+    assert pool.set_device_state('lamp', 'off')
+    pool.close()
+    assert pilight.connections == 1
+    identify = pilight.messages[0]
+    assert identify['action'] == 'identify'
+    assert identify['options']['receiver'] == 0
+    assert [m['code']['state'] for m in pilight.messages[1:]] == [
+        'on', 'off']
+
+
+def test_broken_connection_is_replaced(pilight):
+    pool = ControlPool('127.0.0.1', pilight.port, timeout=0.5)
+    assert pool.set_device_state('lamp', 'on')
+    pilight.close_after = 2
+    assert pool.set_device_state('lamp', 'off')
+    pool.close()
+    assert pilight.connections == 2
+
+
+def test_unreachable_pilight():
+    pool = ControlPool('127.0.0.1', 1, timeout=0.5)
+    assert not pool.set_device_state('lamp', 'on')
+
+
+def test_closed_control_connection_raises(pilight):
+    conn = ControlConnection('127.0.0.1', pilight.port, timeout=0.5)
+    assert conn.connect()
+    conn.disconnect()
+    with pytest.raises(ConnectionLostException):
+        conn.send({'action': 'control'})
+    with pytest.raises(ConnectionLostException):
+        conn.receive()
+
+
+def test_bridge_sends_commands_through_a_pool_by_default():
+    from pilight2mqtt.core import Pilight2MQTT, PilightServer
+    servers = {'up': PilightServer('127.0.0.1', 5001),
+               'down': PilightServer('127.0.0.1', 5002)}
+    p2m = Pilight2MQTT(servers, 'localhost')
+    pools = [site.control for site in p2m._sites]
+    assert all(isinstance(pool, ControlPool) for pool in pools)
+    assert [pool._port for pool in pools] == [5002, 5001]
@@ -0,0 +1,39 @@
+import pytest
+
+from pilight2mqtt.dedup import ChangeFilter, parse_rule
+
+
+def test_repeats_are_suppressed_within_window():
+    cfilter = ChangeFilter(window=10)
+    assert cfilter.accept('lamp', 'STATE', 'on', now=0)
+    assert not cfilter.accept('lamp', 'STATE', 'on', now=1)
+    assert cfilter.accept('lamp', 'STATE', 'off', now=2)
+    assert cfilter.accept('lamp', 'STATE', 'off', now=12)
+    assert cfilter.suppressed == 1
+
+
+def test_deadband_per_reading():
+    cfilter = ChangeFilter(rules=[('TEMPERATURE', 30, 0.1)])
+    assert cfilter.accept('w', 'TEMPERATURE', 20.0, now=0)
+    assert not cfilter.accept('w', 'TEMPERATURE', 20.05, now=5)
+    assert cfilter.accept('w', 'TEMPERATURE', 20.2, now=6)
+    assert cfilter.accept('w', 'TEMPERATURE', 20.2, now=40)
+    # readings without a rule use the default window, 0 here
+    assert cfilter.accept('w', 'HUMIDITY', 40, now=40)
+    assert cfilter.accept('w', 'HUMIDITY', 40, now=40)
+
+
+def test_least_recently_updated_entries_are_evicted():
+    cfilter = ChangeFilter(window=10, size=2)
+    cfilter.accept('a', 'STATE', 'on', now=0)
+    cfilter.accept('b', 'STATE', 'on', now=0)
+    cfilter.accept('c', 'STATE', 'on', now=0)
+    assert len(cfilter) == 2
+    assert cfilter.accept('a', 'STATE', 'on', now=1)
+
+
+def test_parse_rule():
+    assert parse_rule('temperature=30:0.1') == ('TEMPERATURE', 30.0, 0.1)
+    assert parse_rule('STATE=5') == ('STATE', 5.0, 0.0)
+    with pytest.raises(ValueError):
+        parse_rule('STATE')
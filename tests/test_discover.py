@@ -0,0 +1,68 @@
+import socket
+import threading
+import time
+
+from pilight2mqtt.discover import discover, parse_location
+
+SERVICE = 'urn:schemas-upnp-org:service:pilight:1'
+
+
+def response(location, service=SERVICE):
+    return ('HTTP/1.1 200 OK\r\nCache-Control:max-age=900\r\n'
+            'Location:%s\r\nST:%s\r\n\r\n' % (location, service)
+            ).encode('utf-8')
+
+
+def test_parse_location():
+    assert parse_location(response('192.168.1.2:5001')) == \
+        ('192.168.1.2', 5001)
+    assert parse_location(b'LOCATION: http://10.0.0.1:5002/desc.xml\r\n') \
+        == ('10.0.0.1', 5002)
+    assert parse_location(response('192.168.1.2:5001', 'upnp:rootdevice'),
+                          SERVICE) is None
+    assert parse_location(b'HTTP/1.1 200 OK\r\n\r\n') is None
+
+
+def responder(answers):
+    """udp server answering every search with all answers"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5)
+
+    def serve():
+        try:
+            while True:
+                data, peer = sock.recvfrom(2048)
+                assert data.startswith(b'M-SEARCH')
+                for answer in answers:
+                    sock.sendto(answer, peer)
+        except (socket.timeout, OSError):
+            pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock
+
+
+def test_collects_and_deduplicates_servers():
+    sock = responder([response('10.0.0.1:5001'), response('10.0.0.1:5001'),
+                      response('10.0.0.2:5001')])
+    try:
+        servers = discover(SERVICE, timeout=0.3, retries=2,
+                           group=sock.getsockname(),
+                           interfaces=['127.0.0.1'])
+    finally:
+        sock.close()
+    assert servers == [('10.0.0.1', 5001), ('10.0.0.2', 5001)]
+
+
+def test_returns_once_count_servers_answered():
+    sock = responder([response('10.0.0.1:5001')])
+    start = time.monotonic()
+    try:
+        servers = discover(SERVICE, timeout=5, count=1,
+                           group=sock.getsockname(),
+                           interfaces=['127.0.0.1'])
+    finally:
+        sock.close()
+    assert servers == [('10.0.0.1', 5001)]
+    assert time.monotonic() - start < 1
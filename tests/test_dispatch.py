@@ -0,0 +1,29 @@
+import json
+
+from pilight2mqtt.dispatch import EventDispatcher, TopicCache
+
+
+def test_known_and_unknown_types():
+    dispatcher = EventDispatcher()
+    assert dispatcher.readings(1) == (('STATE', 'state'),)
+    assert dispatcher.readings(99) is None
+    assert dispatcher.readings(99) is None
+    assert dispatcher.unknown[99] == 2
+
+
+def test_load_merges_over_defaults(tmpdir):
+    path = tmpdir.join('types.json')
+    path.write(json.dumps({'99': {'LEVEL': 'level'}}))
+    dispatcher = EventDispatcher.load(str(path))
+    assert dispatcher.readings(99) == (('LEVEL', 'level'),)
+    assert dispatcher.readings(1) == (('STATE', 'state'),)
+
+
+def test_topics_are_cached():
+    topics = TopicCache('PILIGHT', size=2)
+    topic = topics.get('lamp', 'STATE')
+    assert topic == 'PILIGHT/status/lamp/STATE'
+    assert topics.get('lamp', 'STATE') is topic
+    topics.get('a', 'STATE')
+    topics.get('b', 'STATE')
+    assert topics.get('lamp', 'STATE') == topic
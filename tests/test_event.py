@@ -0,0 +1,56 @@
+import sys
+
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.dedup import ChangeFilter
+from pilight2mqtt.event import CONFIG, UPDATE, PilightEvent, parse_events
+from pilight2mqtt.publish import Publisher
+
+
+def test_update_is_one_event():
+    [event] = parse_events(
+        b'{"origin":"update","type":3,"devices":["weather"],'
+        b'"values":{"temperature":21.5,"humidity":48.0}}')
+    assert event == PilightEvent(UPDATE, 3, ('weather',),
+                                 {'temperature': 21.5, 'humidity': 48.0})
+    assert not hasattr(event, '__dict__')
+
+
+def test_values_are_one_event_per_entry():
+    events = parse_events(
+        b'{"message":"values","values":['
+        b'{"type":1,"devices":["a"],"values":{"state":"on"}},'
+        b'{"type":1,"devices":["b","c"],"values":{"state":"off"}}]}')
+    assert [event.devices for event in events] == [('a',), ('b', 'c')]
+    assert all(event.origin == UPDATE for event in events)
+
+
+def test_config_and_other_messages():
+    [event] = parse_events(b'{"message":"config","config":{"devices":{}}}')
+    assert event.origin == CONFIG
+    assert event.values == {'devices': {}}
+    assert parse_events(b'{"status":"success"}') == ()
+
+
+def test_names_and_keys_are_interned():
+    frame = (b'{"origin":"update","type":1,"devices":["lamp"],'
+             b'"values":{"state":"on"}}')
+    [first] = parse_events(frame)
+    [second] = parse_events(frame)
+    assert first.devices[0] is second.devices[0]
+    assert list(first.values)[0] is list(second.values)[0]
+
+
+def test_downstream_stages_share_the_interned_names():
+    change_filter = ChangeFilter(60)
+    p2m = Pilight2MQTT({'up': PilightServer('localhost', 5001)}, 'localhost',
+                       change_filter=change_filter)
+    p2m._publisher = Publisher(None)
+    name = ''.join(['kitchen', '-lamp'])
+    frame = ('{"origin":"update","type":1,"devices":["%s"],'
+             '"values":{"state":"on"}}' % name).encode('utf-8')
+    for _ in range(2):
+        p2m._handle_event(frame)
+    [(device, reading)] = list(change_filter._cache)
+    assert device is p2m._sites[0].qualify(sys.intern(name))
+    assert reading is sys.intern('STATE')
+    assert change_filter.suppressed == 1
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from pilight2mqtt.eventqueue import EventQueue, WorkerPool, frame_key
+
+UPDATE_A1 = b'{"origin":"update","type":3,"devices":["a"],' \
+    b'"values":{"temperature":1}}'
+UPDATE_A2 = b'{"origin":"update","type":3,"devices":["a"],' \
+    b'"values":{"temperature":2}}'
+UPDATE_B = b'{"origin":"update","type":3,"devices":["b"],' \
+    b'"values":{"temperature":3}}'
+
+
+def test_frame_key():
+    assert frame_key(UPDATE_A1) == b'["a"]'
+    assert frame_key(b'{"message":"config","config":{"devices":[]}}') \
+        is None
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        EventQueue(policy='random')
+
+
+def test_drop_oldest():
+    queue = EventQueue(2, 'drop-oldest')
+    for frame in (b'1', b'2', b'3'):
+        queue.put(frame)
+    assert queue.dropped == 1
+    assert [queue.get(0), queue.get(0), queue.get(0)] == [b'2', b'3', None]
+
+
+def test_coalesce_replaces_queued_update_when_full():
+    queue = EventQueue(2, 'coalesce')
+    queue.put(UPDATE_A1)
+    queue.put(UPDATE_B)
+    queue.put(UPDATE_A2)
+    assert len(queue) == 2
+    assert queue.coalesced == 1
+    assert queue.dropped == 0
+    assert queue.get(0) == UPDATE_A2
+    assert queue.get(0) == UPDATE_B
+    queue.put(UPDATE_A1)
+    assert len(queue) == 1
+
+
+def test_coalesce_keeps_updates_while_there_is_room():
+    queue = EventQueue(4, 'coalesce')
+    for frame in (UPDATE_A1, UPDATE_B, UPDATE_A2):
+        queue.put(frame)
+    assert queue.coalesced == 0
+    assert [queue.get(0) for _ in range(3)] == [
+        UPDATE_A1, UPDATE_B, UPDATE_A2]
+
+
+def test_block_waits_for_room():
+    queue = EventQueue(1, 'block')
+    queue.put(UPDATE_A1)
+    thread = threading.Thread(target=queue.put, args=(UPDATE_A2,))
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive()
+    assert queue.get(1) == UPDATE_A1
+    thread.join(1)
+    assert queue.get(1) == UPDATE_A2
+    assert queue.coalesced == 0
+
+
+def test_closed_queue_is_drained():
+    queue = EventQueue()
+    queue.put(b'1')
+    queue.close()
+    assert queue.get() == b'1'
+    assert queue.get() is None
+
+
+def test_pool_keeps_order_of_device():
+    handled = []
+    lock = threading.Lock()
+
+    def handler(frame):
+        with lock:
+            handled.append(frame)
+
+    pool = WorkerPool(handler, workers=3, maxsize=64, policy='block')
+    pool.start()
+    frames = [b'{"origin":"update","devices":["%d"],"values":{"n":%d}}'
+              % (i % 5, i) for i in range(40)]
+    for frame in frames:
+        pool.put(frame)
+    pool.stop(1)
+    assert sorted(handled) == sorted(frames)
+    for device in range(5):
+        key = b'["%d"]' % device
+        assert [f for f in handled if key in f] == \
+            [f for f in frames if key in f]
@@ -0,0 +1,110 @@
+import asyncio
+
+from pilight2mqtt.aio import AsyncPilight2MQTT, AsyncPilightServer
+from pilight2mqtt.core import Pilight2MQTT
+from pilight2mqtt.publish import Publisher
+
+
+class FakeServer:
+    def __init__(self):
+        self.commands = []
+
+    def set_device_state(self, device, state, values=None):
+        self.commands.append((device, state, values))
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def config(*devices):
+    return ('{"message":"config","config":{"devices":{%s}}}' % ','.join(
+        '"%s":{"protocol":["kaku_switch"],"state":"off"}' % device
+        for device in devices)).encode('utf-8')
+
+
+def bridge(client=None):
+    servers = {'up': FakeServer(), 'down': FakeServer()}
+    p2m = Pilight2MQTT(servers, 'localhost', control=servers)
+    p2m._publisher = Publisher(client)
+    sites = {site.name: site for site in p2m._sites}
+    return p2m, servers, sites
+
+
+def test_topics_are_namespaced_per_server(mqtt_client):
+    p2m, _, sites = bridge(mqtt_client)
+    update = b'{"origin":"update","type":1,"devices":["lamp"],' \
+        b'"values":{"state":"on"}}'
+    p2m._handle_event(update, site=sites['up'])
+    p2m._handle_event(update, site=sites['down'])
+    assert mqtt_client.published == [
+        ('PILIGHT/up/status/lamp/STATE', 'on', 0, True),
+        ('PILIGHT/down/status/lamp/STATE', 'on', 0, True)]
+
+
+def test_commands_go_to_the_owning_server():
+    p2m, servers, sites = bridge()
+    p2m._handle_event(config('lamp'), site=sites['up'])
+    p2m._handle_event(config('heater'), site=sites['down'])
+    p2m._on_message(None, None, FakeMessage('PILIGHT/set/heater/STATE',
+                                            b'on'))
+    p2m._on_message(None, None, FakeMessage('PILIGHT/up/set/lamp/STATE',
+                                            b'off'))
+    p2m._on_message(None, None, FakeMessage('PILIGHT/set/garage/STATE',
+                                            b'on'))
+    assert servers['down'].commands == [('heater', 'on', None)]
+    assert servers['up'].commands == [('lamp', 'off', None)]
+
+
+def test_subscriptions_cover_all_servers():
+    p2m, _, _ = bridge()
+    subscribed = []
+
+    class Client:
+        def subscribe(self, subs):
+            subscribed.extend(topic for topic, _ in subs)
+
+    p2m._on_connect(Client(), None, None, 0)
+    assert 'PILIGHT/up/set/+/STATE' in subscribed
+    assert 'PILIGHT/down/set/+/STATE' in subscribed
+    assert 'PILIGHT/set/+/STATE' in subscribed
+
+
+def pilight_of(fake_pilight, device):
+    """a fake pilight knowing one device, switched on"""
+    return fake_pilight(replies={
+        'request config': config(device) + b'\n\n' +
+        b'{"origin":"update","type":1,"devices":["%s"],'
+        b'"values":{"state":"on"}}\n\n' % device.encode('utf-8')})
+
+
+def test_servers_share_one_loop(fake_pilight, mqtt_client):
+    pilights = {'up': pilight_of(fake_pilight, 'lamp'),
+                'down': pilight_of(fake_pilight, 'heater')}
+
+    async def scenario():
+        servers = {name: AsyncPilightServer('127.0.0.1', pilight.port)
+                   for name, pilight in pilights.items()}
+        p2m = AsyncPilight2MQTT(servers, 'localhost')
+        p2m._publisher = Publisher(mqtt_client)
+        tasks = asyncio.gather(*[p2m._serve(site) for site in p2m._sites])
+        for _ in range(100):
+            if len(mqtt_client.published) == 2:
+                break
+            await asyncio.sleep(0.01)
+        p2m._terminate()
+        results = await tasks
+        return results, mqtt_client.published, p2m._owner('heater').name
+
+    loop = asyncio.new_event_loop()
+    try:
+        results, published, owner = loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+    assert results == [0, 0]
+    assert sorted(published) == [
+        ('PILIGHT/down/status/heater/STATE', 'on', 0, True),
+        ('PILIGHT/up/status/lamp/STATE', 'on', 0, True)]
+    assert owner == 'down'
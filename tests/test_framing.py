@@ -0,0 +1,85 @@
+import socket
+
+import pytest
+
+from pilight2mqtt.framing import FrameDecoder
+from pilight2mqtt.core import PilightServer, ConnectionLostException
+
+
+def test_frames_split_across_reads():
+    decoder = FrameDecoder(recv_size=4)
+    decoder.feed(b'{"a":1}\n')
+    assert decoder.next_frame() is None
+    decoder.feed(b'\n{"b"')
+    assert decoder.next_frame() == b'{"a":1}'
+    assert decoder.next_frame() is None
+    decoder.feed(b':2}\n\nBEAT\n\n')
+    assert list(decoder.frames()) == [b'{"b":2}', b'BEAT']
+    assert len(decoder) == 0
+
+
+def test_recv_from_socket_keeps_remaining_frames():
+    left, right = socket.socketpair()
+    try:
+        decoder = FrameDecoder(recv_size=3)
+        left.sendall(b'one\n\ntwo\n\nthree')
+        received = []
+        while len(received) < 2:
+            decoder.recv_from(right)
+            received.extend(decoder.frames())
+        assert received == [b'one', b'two']
+        left.sendall(b'\n\n')
+        while decoder.next_frame() is None:
+            decoder.recv_from(right)
+        assert len(decoder) == 0
+    finally:
+        left.close()
+        right.close()
+
+
+def test_large_frames_grow_buffer():
+    decoder = FrameDecoder(recv_size=16)
+    payload = b'x' * 100000
+    decoder.feed(payload[:50000])
+    assert decoder.next_frame() is None
+    decoder.feed(payload[50000:] + b'\n\n')
+    assert decoder.next_frame() == payload
+
+
+def test_invalid_recv_size():
+    with pytest.raises(ValueError):
+        FrameDecoder(recv_size=0)
+
+
+def test_server_read_does_not_drop_buffered_frames():
+    left, right = socket.socketpair()
+    try:
+        server = PilightServer('localhost', 5001, recv_size=1024)
+        server._socket = right
+        server._should_terminate = False
+        left.sendall(b'first\n\nsecond\n\n')
+        assert server._read() == b'first'
+        assert server._read() == b'second'
+        left.close()
+        with pytest.raises(ConnectionLostException):
+            server._read()
+    finally:
+        right.close()
+
+
+def test_server_reads_frames_from_one_iterator():
+    left, right = socket.socketpair()
+    try:
+        server = PilightServer('localhost', 5001, recv_size=1024)
+        server._socket = right
+        server._should_terminate = False
+        left.sendall(b'first\n\nsecond\n\n')
+        assert server._read() == b'first'
+        lines = server._lines
+        assert server._read() == b'second'
+        assert server._lines is lines
+        server._close_socket()
+        assert server._lines is None
+    finally:
+        left.close()
+        right.close()
@@ -0,0 +1,70 @@
+import socket
+import time
+
+from pilight2mqtt.backoff import Backoff
+from pilight2mqtt.core import HEARTBEAT_RTT, PilightServer
+
+
+def start(fake_pilight, answer):
+    """a fake pilight answering heartbeats with an event first, if answer"""
+    pilight = fake_pilight(heart=b'{"origin":"update","type":1,'
+                           b'"devices":["a"],"values":{"state":"on"}}\n\n'
+                           b'BEAT\n\n' if answer else None)
+    server = PilightServer('127.0.0.1', pilight.port, timeout=0.01)
+    server._backoff = Backoff(initial=0.01, jitter=0)
+    return pilight, server
+
+
+def test_heartbeats_do_not_steal_events(fake_pilight):
+    _, server = start(fake_pilight, answer=True)
+    HEARTBEAT_RTT.reset()
+    events = []
+
+    def callback(frame):
+        events.append(frame)
+        if len(events) == 3:
+            server.terminate()
+
+    assert server.connect()
+    server.keepalive(0.02)
+    server.process_events(callback)
+    server.disconnect()
+    assert all(event.startswith(b'{"origin"') for event in events)
+    assert HEARTBEAT_RTT.count >= 2
+
+
+def test_missed_heartbeats_reconnect(fake_pilight):
+    pilight, server = start(fake_pilight, answer=False)
+
+    def idle():
+        if pilight.connections == 2:
+            server.terminate()
+
+    assert server.connect()
+    server.keepalive(0.02, misses=2)
+    server.process_events(lambda frame: None, idle=idle)
+    server.disconnect()
+    assert pilight.connections == 2
+
+
+def test_late_beat_is_not_timed_against_the_next_heartbeat():
+    left, right = socket.socketpair()
+    try:
+        server = PilightServer('localhost', 5001)
+        server._socket = right
+        server._should_terminate = False
+        server.keepalive(10)
+        server._beats.append(time.monotonic() - 20)
+        server._beat_due = 0
+        server._check_heartbeat()
+        assert server._missed == 1
+        assert len(server._beats) == 1
+        HEARTBEAT_RTT.reset()
+        left.sendall(b'BEAT\n\nBEAT\n\n{"origin":"update"}\n\n')
+        assert server._read() == b'{"origin":"update"}'
+        assert HEARTBEAT_RTT.count == 1
+        assert HEARTBEAT_RTT.sum < 10
+        assert not server._beats
+    finally:
+        left.close()
+        right.close()
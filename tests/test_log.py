@@ -0,0 +1,30 @@
+import logging
+
+from pilight2mqtt.log import Loggable, TrafficTrace
+
+
+class Parent(Loggable):
+    pass
+
+
+class Child(Parent):
+    pass
+
+
+def test_loggers_are_cached_per_class():
+    assert Parent().log is Parent().log
+    assert Parent().log.name == 'Parent'
+    assert Child().log.name == 'Child'
+
+
+def test_traffic_is_sampled(caplog):
+    trace = TrafficTrace('test.traffic')
+    trace('pilight>', b'ignored')
+    trace.configure(3)
+    with caplog.at_level(logging.DEBUG, logger='test.traffic'):
+        for i in range(7):
+            trace('pilight>', i)
+    assert [r.getMessage() for r in caplog.records] == [
+        'pilight> 2', 'pilight> 5']
+    trace.configure(0)
+    assert logging.getLogger('test.traffic').level == logging.WARNING
@@ -0,0 +1,68 @@
+import json
+from urllib.request import urlopen
+
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.metrics import Metrics, MetricsServer
+
+
+def test_histogram_buckets_and_quantiles():
+    registry = Metrics()
+    hist = registry.histogram('test_seconds', 'test', (0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5):
+        hist.observe(value)
+    assert hist.quantile(0.5) == 1.0
+    assert hist.snapshot()['p99'] is None
+    text = registry.render()
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1.0"} 3' in text
+    assert 'test_seconds_bucket{le="+Inf"} 4' in text
+    assert 'test_seconds_count 4' in text
+
+
+def test_histogram_family_per_label_value():
+    registry = Metrics()
+    family = registry.histogram_family('test_seconds', 'test', 'device',
+                                       (0.1, 1.0))
+    family.labels('lamp').observe(0.05)
+    family.labels('say "hi"').observe(0.5)
+    assert registry.histogram_family('test_seconds', 'test',
+                                     'device') is family
+    text = registry.render()
+    assert 'test_seconds_bucket{device="lamp",le="0.1"} 1' in text
+    assert 'test_seconds_count{device="say \\"hi\\""} 1' in text
+    assert registry.snapshot()['test_seconds']['lamp']['count'] == 1
+
+
+def test_metrics_are_registered_once():
+    registry = Metrics()
+    counter = registry.counter('test_total', 'test')
+    counter.inc(2)
+    assert registry.counter('test_total', 'test') is counter
+    assert registry.snapshot() == {'test_total': 2}
+
+
+def test_metrics_endpoint():
+    registry = Metrics()
+    registry.counter('test_total', 'a test').inc()
+    server = MetricsServer(0, '127.0.0.1', registry)
+    server.start()
+    try:
+        body = urlopen('http://127.0.0.1:%d/metrics' % server.port).read()
+    finally:
+        server.stop()
+    assert b'# TYPE test_total counter\ntest_total 1\n' in body
+
+
+def test_stats_are_published(mqtt_client):
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost',
+                       stats_interval=60)
+    p2m._mqtt_client = mqtt_client
+    p2m._handle_event(
+        b'{"origin":"update","type":1,"devices":["a"],'
+        b'"values":{"state":"on"}}')
+    p2m._tick()
+    stats = [payload for topic, payload, _, _ in mqtt_client.published
+             if topic == 'PILIGHT/bridge/stats']
+    assert len(stats) == 1
+    snapshot = json.loads(stats[0])
+    assert snapshot['pilight2mqtt_handle_seconds']['count'] >= 1
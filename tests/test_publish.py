@@ -0,0 +1,75 @@
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.publish import Publisher
+
+
+def test_flush_publishes_batch(mqtt_client):
+    publisher = Publisher(mqtt_client)
+    publisher.add('a', 1)
+    publisher.add('b', 2)
+    assert not mqtt_client.published
+    assert publisher.maybe_flush() == 2
+    assert mqtt_client.published == [('a', 1, 0, False),
+                                     ('b', 2, 0, False)]
+    assert publisher.last_flush_size == 2
+    assert publisher.flush() == 0
+
+
+def test_window_delays_flush(mqtt_client):
+    publisher = Publisher(mqtt_client, window=60)
+    publisher.add('a', 1)
+    assert publisher.maybe_flush() == 0
+    assert len(publisher) == 1
+
+
+def test_scheduler_is_used_for_window(mqtt_client):
+    scheduled = []
+    publisher = Publisher(mqtt_client, window=5)
+    publisher.set_scheduler(lambda delay, func: scheduled.append(delay))
+    publisher.add('a', 1)
+    publisher.add('b', 1)
+    assert scheduled == [5]
+
+
+def test_failures_are_counted(mqtt_client):
+    mqtt_client.result = 4
+    publisher = Publisher(mqtt_client)
+    publisher.add('a', 1)
+    publisher.flush()
+    assert publisher.failed == 1
+    assert publisher.published == 0
+
+
+def test_event_is_published_as_one_batch(mqtt_client):
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost')
+    p2m._publisher = Publisher(mqtt_client)
+    p2m._handle_event(
+        b'{"origin":"update","type":3,"devices":["a","b"],'
+        b'"values":{"temperature":20.5,"humidity":40}}')
+    assert p2m._publisher.flushes == 1
+    assert p2m._publisher.last_flush_size == 4
+    assert ('PILIGHT/status/b/TEMPERATURE', 20.5, 0, True) in \
+        mqtt_client.published
+
+
+def test_unknown_event_type_is_dropped(mqtt_client):
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost')
+    p2m._publisher = Publisher(mqtt_client)
+    p2m._handle_event(
+        b'{"origin":"update","type":42,"devices":["a"],"values":{}}')
+    p2m._handle_event(
+        b'{"origin":"update","type":3,"devices":["a"],'
+        b'"values":{"temperature":20.5}}')
+    assert p2m._dispatcher.unknown[42] == 1
+    assert mqtt_client.published == [
+        ('PILIGHT/status/a/TEMPERATURE', 20.5, 0, True)]
+
+
+def test_updates_of_a_topic_are_coalesced(mqtt_client):
+    publisher = Publisher(mqtt_client, window=60)
+    publisher.add('a', 1)
+    publisher.add('b', 1)
+    publisher.add('a', 2)
+    assert publisher.flush() == 2
+    assert mqtt_client.published == [('a', 2, 0, False),
+                                     ('b', 1, 0, False)]
+    assert publisher.coalesced == 1
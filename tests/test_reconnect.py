@@ -0,0 +1,62 @@
+import json
+
+from pilight2mqtt.backoff import Backoff
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+
+
+def test_backoff_grows_and_is_capped():
+    backoff = Backoff(initial=1, maximum=4, jitter=0)
+    assert [backoff.next() for _ in range(4)] == [1, 2, 4, 4]
+    backoff.reset()
+    assert backoff.next() == 1
+
+
+def test_backoff_stays_at_maximum_after_long_outage():
+    backoff = Backoff(initial=0.25, maximum=30, jitter=0)
+    delays = [backoff.next() for _ in range(5000)]
+    assert delays[-1] == 30
+    assert max(delays) == 30
+
+
+def test_backoff_jitter_shortens_delay():
+    backoff = Backoff(initial=1, jitter=0.5, rand=lambda: 1.0)
+    assert backoff.next() == 0.5
+
+
+def test_process_events_reconnects_and_resumes(fake_pilight):
+    pilight = fake_pilight(
+        greetings=[b'{"origin":"update","type":1,"devices":["a"],'
+                   b'"values":{"state":"on"}}\n\n'],
+        hang_ups=[0],
+        replies={'request values': b'{"message":"values","values":[{'
+                 b'"type":1,"devices":["a"],"values":{"state":"off"}}]}'
+                 b'\n\n'})
+    events = []
+    server = PilightServer('127.0.0.1', pilight.port, timeout=0.1)
+    server._backoff = Backoff(initial=0.01, jitter=0)
+    assert server.connect()
+
+    def callback(frame):
+        events.append(frame)
+        if len(events) == 2:
+            server.terminate()
+
+    server.process_events(callback)
+    server.disconnect()
+    assert [msg['action'] for msg in pilight.messages] == [
+        'identify', 'identify', 'request config', 'request values']
+    assert b'"message":"values"' in events[1]
+
+
+def test_values_are_published_like_updates(mqtt_client):
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost')
+    p2m._mqtt_client = mqtt_client
+    p2m._handle_event(json.dumps({
+        'message': 'values',
+        'values': [
+            {'type': 1, 'devices': ['a'], 'values': {'state': 'off'}},
+            {'type': 3, 'devices': ['w'], 'values': {'temperature': 1.5}},
+        ]}).encode('utf-8'))
+    assert mqtt_client.published == [
+        ('PILIGHT/status/a/STATE', 'off', 0, True),
+        ('PILIGHT/status/w/TEMPERATURE', 1.5, 0, True)]
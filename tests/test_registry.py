@@ -0,0 +1,97 @@
+from pilight2mqtt.dispatch import TopicCache
+from pilight2mqtt.registry import DeviceRegistry
+
+CONFIG = {
+    'devices': {
+        'lamp': {
+            'protocol': ['kaku_switch'],
+            'id': [{'id': 1, 'unit': 0}],
+            'state': 'off'
+        },
+        'weather': {
+            'protocol': ['alecto_ws1700'],
+            'id': [{'id': 2}],
+            'temperature': 20.0,
+            'humidity': 40.0
+        }
+    }
+}
+
+
+def test_everything_is_accepted_before_load():
+    registry = DeviceRegistry()
+    assert registry.check('anything', 'on') is None
+
+
+def test_commands_are_validated_after_load():
+    registry = DeviceRegistry()
+    registry.load(CONFIG)
+    assert len(registry) == 2
+    assert registry.check('lamp', 'on') is None
+    assert 'unknown device' in registry.check('door', 'on')
+    assert 'does not support' in registry.check('lamp', 'up')
+    assert registry.get('lamp').protocol == ('kaku_switch',)
+
+
+def test_load_warms_topics():
+    topics = TopicCache('PILIGHT')
+    DeviceRegistry(topics).load(CONFIG)
+    assert ('weather', 'TEMPERATURE') in topics._topics
+    assert ('lamp', 'STATE') in topics._topics
+
+
+def test_load_only_touches_changed_devices():
+    registry = DeviceRegistry()
+    registry.load(CONFIG)
+    lamp = registry.get('lamp')
+    weather = registry.get('weather')
+    registry.load({'devices': {
+        'lamp': CONFIG['devices']['lamp'],
+        'weather': dict(CONFIG['devices']['weather'], battery=1),
+        'door': {'protocol': ['kaku_contact'], 'state': 'closed'}
+    }})
+    assert registry.get('lamp') is lamp
+    assert registry.get('weather') is not weather
+    assert 'battery' in registry.get('weather').readings
+    assert registry.check('door', 'opened') is None
+    registry.load({'devices': {'lamp': CONFIG['devices']['lamp']}})
+    assert registry.get('lamp') is lamp
+    assert len(registry) == 1
+
+
+def test_update_adds_devices_and_readings():
+    registry = DeviceRegistry()
+    registry.load(CONFIG)
+    registry.update(['weather'], {'battery': 1, 'timestamp': 0})
+    registry.update(['new'], {'state': 'on'})
+    assert registry.get('weather').readings == {
+        'temperature', 'humidity', 'battery'}
+    assert registry.check('new', 'off') is None
+
+
+class FakeControl:
+    def __init__(self):
+        self.commands = []
+
+    def set_device_state(self, device, state, values=None):
+        self.commands.append((device, state, values))
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def test_bridge_rejects_unknown_devices_locally():
+    import json
+    from pilight2mqtt.core import PilightServer, Pilight2MQTT
+
+    control = FakeControl()
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost',
+                       control=control)
+    p2m._handle_event(json.dumps(
+        {'message': 'config', 'config': CONFIG}).encode('utf-8'))
+    p2m._on_message(None, None, FakeMessage('PILIGHT/set/door/STATE', b'on'))
+    p2m._on_message(None, None, FakeMessage('PILIGHT/set/lamp/STATE', b'on'))
+    assert control.commands == [('lamp', 'on', None)]
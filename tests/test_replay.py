@@ -0,0 +1,80 @@
+import time
+
+import paho.mqtt.client as mqtt
+
+from pilight2mqtt.core import PilightServer
+from pilight2mqtt.replay import (CaptureWriter, ReplayServer, StubBroker,
+                                 read_capture)
+
+FRAMES = [b'{"origin":"update","type":1,"devices":["a"],'
+          b'"values":{"state":"on"}}',
+          b'{"status":"success"}',
+          b'{"origin":"update","type":1,"devices":["a"],\n'
+          b'"values":{"state":"off"}}']
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / 'capture.rec')
+    capture = CaptureWriter(path)
+    for stamp, frame in enumerate(FRAMES):
+        capture.write(frame, now=100.0 + stamp)
+    capture.close()
+    assert read_capture(path) == [(100.0 + stamp, frame)
+                                  for stamp, frame in enumerate(FRAMES)]
+
+
+def test_capture_is_readable_before_it_is_closed(tmp_path):
+    path = str(tmp_path / 'capture.rec')
+    capture = CaptureWriter(path)
+    capture.write(FRAMES[0], now=100.0)
+    assert read_capture(path) == [(100.0, FRAMES[0])]
+    capture.close()
+
+
+def test_replayed_events_are_read_and_recorded(tmp_path):
+    replay = ReplayServer(list(enumerate(FRAMES)), speed=0).start()
+    server = PilightServer('127.0.0.1', replay.port)
+    capture = CaptureWriter(str(tmp_path / 'capture.rec'))
+    server.record(capture)
+    try:
+        assert server.connect()
+        assert server.heartbeat()
+        server.request_config()
+        frames = server._readlines()
+        received = [next(frames), next(frames)]
+    finally:
+        server.disconnect()
+        replay.stop()
+        capture.close()
+    assert received == [FRAMES[0], FRAMES[2]]
+    recorded = [frame for _, frame in
+                read_capture(str(tmp_path / 'capture.rec'))]
+    assert recorded == [b'{"status":"success"}', b'BEAT'] + received
+
+
+def test_stub_broker_records_messages():
+    broker = StubBroker().start()
+    client = mqtt.Client()
+    commands = []
+    client.on_message = lambda client, userdata, msg: commands.append(
+        msg.payload)
+    try:
+        client.connect('127.0.0.1', broker.port)
+        client.loop_start()
+        client.subscribe('PILIGHT/set/#')
+        client.publish('PILIGHT/status/a/STATE', 'on')
+        client.publish('PILIGHT/status/a/DIMLEVEL', '3', qos=1)
+        assert broker.wait_for(2, timeout=5)
+        broker.publish('PILIGHT/set/a/STATE', b'off')
+        broker.publish('PILIGHT/other', b'ignored')
+        for _ in range(100):
+            if commands:
+                break
+            time.sleep(0.01)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        broker.stop()
+    assert [(topic, payload) for _, topic, payload in broker.messages] == [
+        ('PILIGHT/status/a/STATE', b'on'), ('PILIGHT/status/a/DIMLEVEL', b'3')]
+    assert commands == [b'off']
@@ -0,0 +1,82 @@
+import json
+import time
+
+import pytest
+
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.publish import Publisher
+from pilight2mqtt.rollup import Rollups, RollupWindow, parse_window
+
+
+def time_of_next_hour():
+    return (time.time() // 3600 + 1) * 3600
+
+
+def test_parse_window():
+    assert parse_window('1m') == (60, '1m')
+    assert parse_window('90') == (90, '90s')
+    assert parse_window('1H') == (3600, '1h')
+    for text in ('', 'm', '0s', '-1m', 'xm'):
+        with pytest.raises(ValueError):
+            parse_window(text)
+
+
+def test_window_aggregates_until_it_ends():
+    window = RollupWindow(60, '1m')
+    assert window.add('a', 20.0, 120) == []
+    assert window.add('a', 22.0, 150) == []
+    assert window.add('b', 5, 179) == []
+    assert len(window) == 2
+    done = window.add('a', 30.0, 180)
+    assert sorted(done) == [('a', 2, 20.0, 22.0, 21.0),
+                            ('b', 1, 5.0, 5.0, 5.0)]
+    assert len(window) == 1
+    assert window.collect(239) == []
+    assert window.collect(240) == [('a', 1, 30.0, 30.0, 30.0)]
+    assert window.collect(300) == []
+
+
+def test_window_takes_over_the_oldest_slot_when_full():
+    window = RollupWindow(60, '1m', size=2)
+    window.add('a', 1, 0)
+    window.add('b', 2, 0)
+    assert window.add('c', 3, 0) == [('a', 1, 1.0, 1.0, 1.0)]
+    assert window.evicted == 1
+    assert sorted(window.collect(60)) == [('b', 1, 2.0, 2.0, 2.0),
+                                          ('c', 1, 3.0, 3.0, 3.0)]
+
+
+def test_rollups_skip_other_values_and_readings():
+    rollups = Rollups([(60, '1m')], readings=['TEMPERATURE', 'STATE'])
+    assert rollups.add('t/h', 'HUMIDITY', 50.0, 0) == []
+    assert rollups.add('t/s', 'STATE', 'on', 0) == []
+    assert rollups.add('t/s', 'STATE', True, 0) == []
+    assert rollups.add('t/t', 'TEMPERATURE', 20, 0) == []
+    [(topic, reading, payload)] = rollups.collect(60)
+    assert (topic, reading) == ('t/t/1m', 'TEMPERATURE')
+    assert json.loads(payload) == {'count': 1, 'min': 20.0, 'max': 20.0,
+                                   'mean': 20.0}
+
+
+def test_rollups_are_published_alongside_the_readings(mqtt_client):
+    rollups = Rollups([(60, '1m'), (3600, '1h')])
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost',
+                       rollups=rollups)
+    p2m._publisher = Publisher(mqtt_client)
+    for temperature in (20.0, 21.0):
+        p2m._handle_event(
+            b'{"origin":"update","type":3,"devices":["w"],'
+            b'"values":{"temperature":%.1f}}' % temperature)
+    assert [topic for topic, _, _, _ in mqtt_client.published] == [
+        'PILIGHT/status/w/TEMPERATURE'] * 2
+    del mqtt_client.published[:]
+    p2m._publish_rollups(rollups.collect(time_of_next_hour()))
+    p2m._publisher.flush()
+    published = {topic: json.loads(payload)
+                 for topic, payload, _, _ in mqtt_client.published}
+    assert published == {
+        'PILIGHT/status/w/TEMPERATURE/1m':
+            {'count': 2, 'min': 20.0, 'max': 21.0, 'mean': 20.5},
+        'PILIGHT/status/w/TEMPERATURE/1h':
+            {'count': 2, 'min': 20.0, 'max': 21.0, 'mean': 20.5},
+    }
@@ -0,0 +1,55 @@
+from paho.mqtt.client import topic_matches_sub
+
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.router import CommandRouter
+
+
+def test_only_command_subtrees_are_subscribed():
+    router = CommandRouter('PILIGHT', None)
+    subs = [sub for sub, _ in router.subscriptions()]
+    assert 'PILIGHT/set/+/STATE' in subs
+    assert not any(topic_matches_sub(sub, 'PILIGHT/status/lamp/STATE')
+                   for sub in subs)
+
+
+def test_verbs_are_routed_per_callback(mqtt_client):
+    received = []
+    router = CommandRouter('PILIGHT', lambda *args: received.append(args))
+    router.attach(mqtt_client)
+    mqtt_client.deliver('PILIGHT/set/lamp/STATE', b'on')
+    mqtt_client.deliver('PILIGHT/set/dimmer/DIMLEVEL', b'5')
+    mqtt_client.deliver('PILIGHT/status/lamp/STATE', b'on')
+    assert received == [('lamp', 'STATE', b'on'),
+                        ('dimmer', 'DIMLEVEL', b'5')]
+
+
+def test_route_rejects_other_topics():
+    router = CommandRouter('PILIGHT', lambda *args: None)
+    assert router.route('PILIGHT/set/lamp/STATE', b'on')
+    assert not router.route('PILIGHT/set/lamp/OTHER', b'on')
+    assert not router.route('OTHER/set/lamp/STATE', b'on')
+    assert not router.route('PILIGHT/set/a/b/STATE', b'on')
+
+
+class FakeControl:
+    def __init__(self):
+        self.commands = []
+
+    def set_device_state(self, device, state, values=None):
+        self.commands.append((device, state, values))
+
+
+def test_commands_are_translated():
+    control = FakeControl()
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost',
+                       control=control)
+    p2m._on_command('lamp', 'STATE', b'off')
+    p2m._on_command('dimmer', 'DIMLEVEL', b'7')
+    p2m._on_command('dimmer', 'VALUES', b'{"state":"on","dimlevel":3}')
+    p2m._on_command('dimmer', 'DIMLEVEL', b'high')
+    p2m._on_command('dimmer', 'VALUES', b'[1]')
+    assert control.commands == [
+        ('lamp', 'off', None),
+        ('dimmer', 'on', {'dimlevel': 7}),
+        ('dimmer', 'on', {'dimlevel': 3}),
+    ]
@@ -0,0 +1,102 @@
+import time
+
+from pilight2mqtt.metrics import metrics
+from pilight2mqtt.scheduler import CommandScheduler
+
+
+def wait_until(check, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not check() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return check()
+
+
+def test_latest_command_per_device_wins(pilight):
+    scheduler = CommandScheduler('127.0.0.1', pilight.port, rate=0, depth=1)
+    pilight.hold.clear()
+    scheduler.set_device_state('lamp', 'on')
+    assert pilight.wait_for(1)
+    scheduler.set_device_state('dimmer', 'on', {'dimlevel': 3})
+    scheduler.set_device_state('dimmer', 'on', {'dimlevel': 9})
+    scheduler.set_device_state('lamp', 'off')
+    assert scheduler.coalesced == 1
+    pilight.hold.set()
+    assert pilight.wait_for(3)
+    assert wait_until(lambda: scheduler.sent == 3)
+    scheduler.close()
+    assert [code for _, code in pilight.commands] == [
+        {'device': 'lamp', 'state': 'on'},
+        {'device': 'dimmer', 'state': 'on', 'values': {'dimlevel': 9}},
+        {'device': 'lamp', 'state': 'off'}]
+
+
+def test_commands_are_pipelined(pilight):
+    scheduler = CommandScheduler('127.0.0.1', pilight.port, rate=0, depth=4)
+    pilight.hold.clear()
+    for device in ('a', 'b', 'c'):
+        scheduler.set_device_state(device, 'on')
+    # all commands are written although none was answered yet
+    assert wait_until(lambda: len(scheduler._inflight) == 3)
+    pilight.hold.set()
+    assert wait_until(lambda: scheduler.sent == 3)
+    scheduler.close()
+    assert pilight.connections == 1
+
+
+def test_commands_are_rate_limited(pilight):
+    scheduler = CommandScheduler('127.0.0.1', pilight.port, rate=20,
+                                 burst=1)
+    for device in range(5):
+        scheduler.set_device_state('lamp%d' % device, 'on')
+    assert pilight.wait_for(5)
+    scheduler.close()
+    stamps = [stamp for stamp, _ in pilight.commands]
+    assert stamps[-1] - stamps[0] >= 4 / 20.0 * 0.9
+
+
+def test_latency_is_reported_per_device(pilight):
+    family = metrics['pilight2mqtt_command_seconds']
+    family.reset()
+    scheduler = CommandScheduler('127.0.0.1', pilight.port, rate=0)
+    scheduler.set_device_state('lamp', 'on')
+    scheduler.set_device_state('fan', 'off')
+    assert wait_until(lambda: scheduler.sent == 2)
+    scheduler.close()
+    snapshot = family.snapshot()
+    assert snapshot['lamp']['count'] == 1
+    assert snapshot['fan']['count'] == 1
+
+
+def test_lost_commands_are_sent_again(pilight):
+    scheduler = CommandScheduler('127.0.0.1', pilight.port, rate=0,
+                                 timeout=0.5)
+    pilight.close_after = 1
+    scheduler.set_device_state('lamp', 'on')
+    assert wait_until(lambda: scheduler.sent == 1)
+    scheduler.close()
+    assert pilight.connections == 2
+    assert len(pilight.commands) == 2
+    assert scheduler.failed == 0
+
+
+def test_connection_lost_with_commands_in_flight(pilight):
+    family = metrics['pilight2mqtt_command_seconds']
+    family.reset()
+    scheduler = CommandScheduler('127.0.0.1', pilight.port, rate=0, depth=4,
+                                 timeout=0.5)
+    pilight.hold.clear()
+    pilight.close_after = 2
+    for device in ('a', 'b', 'c', 'd'):
+        scheduler.set_device_state(device, 'on')
+    assert wait_until(lambda: len(scheduler._inflight) == 4)
+    pilight.hold.set()
+    assert wait_until(lambda: scheduler.sent == 4)
+    assert pilight.connections == 2
+    # the scheduler keeps working on the new connection
+    scheduler.set_device_state('e', 'on')
+    assert wait_until(lambda: scheduler.sent == 5)
+    scheduler.close()
+    assert scheduler.failed == 0
+    snapshot = family.snapshot()
+    assert sorted(snapshot) == ['a', 'b', 'c', 'd', 'e']
+    assert all(snapshot[device]['count'] == 1 for device in snapshot)
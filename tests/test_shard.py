@@ -0,0 +1,123 @@
+import multiprocessing
+import threading
+
+from pilight2mqtt.core import PilightServer
+from pilight2mqtt.replay import ReplayServer, StubBroker
+from pilight2mqtt.shard import (RingBuffer, ShardBridge, ShardedPilight2MQTT,
+                                device_shard, frame_shard)
+
+CONTEXT = multiprocessing.get_context('fork')
+
+
+def update(device, state='on'):
+    return (b'{"origin":"update","type":1,"devices":["%s"],'
+            b'"values":{"state":"%s"}}' % (device.encode(), state.encode()))
+
+
+def test_ring_buffer_wraps_around():
+    ring = RingBuffer(64, CONTEXT)
+    for i in range(20):
+        frame = b'frame %d' % i + b'x' * (i % 7)
+        assert ring.put(frame)
+        assert ring.get(0) == frame
+    assert ring.get(0) is None
+
+
+def test_full_ring_buffer_drops_frames():
+    ring = RingBuffer(32, CONTEXT)
+    assert ring.put(b'a' * 20, timeout=0)
+    assert not ring.put(b'b' * 20, timeout=0)
+    assert not ring.put(b'c' * 40, timeout=0)
+    assert ring.dropped == 2
+    assert ring.get(0) == b'a' * 20
+    assert ring.close()
+    assert ring.get(0) == b''
+
+
+def test_frames_cross_processes():
+    ring = RingBuffer(256, CONTEXT)
+    frames = [b'%d' % i * (i % 30 + 1) for i in range(500)]
+
+    def produce():
+        for frame in frames:
+            ring.put(frame, timeout=5)
+        ring.close()
+
+    process = CONTEXT.Process(target=produce)
+    process.start()
+    received = []
+    while True:
+        frame = ring.get(5)
+        if not frame:
+            break
+        received.append(frame)
+    process.join()
+    assert received == frames
+
+
+def test_reader_and_workers_agree_on_the_shard():
+    for device in ('lamp', 'weather3', 'kitchen light', 'käse'):
+        frame = ('{"origin":"update","type":1,"devices":[ "%s" ],'
+                 '"values":{}}' % device).encode('utf-8')
+        assert frame_shard(frame, 4) == device_shard(device, 4)
+    # updates of several devices go to all workers
+    assert frame_shard(b'{"origin":"update","type":1,"devices":["a","b"],'
+                       b'"values":{}}', 4) is None
+    assert frame_shard(b'{"origin":"update","devices":["a\\"b"]}', 4) is None
+    assert frame_shard(b'{"message":"values","values":[]}', 4) is None
+
+
+def test_workers_only_publish_their_own_devices(mqtt_client):
+    devices = ['lamp%d' % i for i in range(8)]
+    frame = ('{"origin":"update","type":1,"devices":[%s],'
+             '"values":{"state":"on"}}' % ','.join(
+                 '"%s"' % device for device in devices)).encode('utf-8')
+    published = []
+    for shard in range(2):
+        p2m = ShardBridge(shard, 2, PilightServer('localhost', 5001),
+                          'localhost')
+        p2m._mqtt_client = mqtt_client
+        p2m._handle_event(frame)
+        topics = [topic for topic, _, _, _ in mqtt_client.published]
+        del mqtt_client.published[:]
+        assert topics == ['PILIGHT/status/%s/STATE' % device
+                          for device in devices
+                          if device_shard(device, 2) == shard]
+        published.extend(topics)
+    assert len(published) == len(devices)
+
+
+def test_events_are_published_by_the_workers():
+    devices = ['lamp%d' % i for i in range(8)]
+    records = [(i, update(device, 'on' if i % 2 else 'off'))
+               for i, device in enumerate(devices * 5)]
+    broker = StubBroker().start()
+    replay = ReplayServer(records, speed=0).start()
+    p2m = ShardedPilight2MQTT(PilightServer('127.0.0.1', replay.port),
+                              '127.0.0.1', mqtt_port=broker.port, shards=2)
+
+    def stop():
+        broker.wait_for(len(records), timeout=10)
+        p2m._server.terminate()
+
+    threading.Thread(target=stop, daemon=True).start()
+    try:
+        assert p2m.run() == 0
+    finally:
+        replay.stop()
+        broker.stop()
+    published = {}
+    for _, topic, payload in broker.messages:
+        published.setdefault(topic, set()).add(payload)
+    # retained readings may be published again once the broker answers
+    assert published == {
+        'PILIGHT/status/%s/STATE' % device: {b'on' if index % 2 else b'off'}
+        for index, device in enumerate(devices)}
+    assert p2m.dropped == 0
+
+
+def test_workers_do_not_get_the_thread_engine_arguments():
+    p2m = ShardedPilight2MQTT(PilightServer('localhost', 5001), 'localhost',
+                              shards=1, workers=4, queue_size=16,
+                              queue_policy='block', publish_window=1)
+    assert p2m._kwargs == {'publish_window': 1}
@@ -0,0 +1,168 @@
+import threading
+
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.publish import Publisher
+from pilight2mqtt.spool import Spool
+
+
+def drain_all(spool):
+    messages = []
+    spool.drain(lambda *message: messages.append(message) or True, 1000)
+    return messages
+
+
+def test_spool_keeps_order_and_latest_state(tmp_path):
+    spool = Spool(str(tmp_path / 'spool'), 4096)
+    spool.append('a/STATE', 'on', 0, True, compact=True)
+    spool.append('w/TEMPERATURE', 1.5, 0, True)
+    spool.append('a/STATE', 'off', 0, True, compact=True)
+    spool.append('w/TEMPERATURE', 2, 0, True)
+    assert len(spool) == 3
+    assert drain_all(spool) == [('w/TEMPERATURE', b'1.5', 0, True),
+                                ('a/STATE', b'off', 0, True),
+                                ('w/TEMPERATURE', b'2', 0, True)]
+    assert len(spool) == 0
+
+
+def test_spool_survives_reopening(tmp_path):
+    path = str(tmp_path / 'spool')
+    spool = Spool(path, 4096)
+    spool.append('a/STATE', 'on', 1, True, compact=True)
+    spool.append('b/STATE', 'off', 0, True, compact=True)
+    spool.close()
+    spool = Spool(path, 4096)
+    assert len(spool) == 2
+    spool.append('a/STATE', 'off', 1, True, compact=True)
+    assert drain_all(spool) == [('b/STATE', b'off', 0, True),
+                                ('a/STATE', b'off', 1, True)]
+
+
+def test_full_spool_compacts_then_drops_oldest(tmp_path):
+    spool = Spool(str(tmp_path / 'spool'), 256)
+    for value in range(20):
+        spool.append('a/STATE', str(value), 0, True, compact=True)
+    assert spool.dropped == 0
+    for value in range(20):
+        spool.append('w/TEMPERATURE', value)
+    assert spool.dropped > 0
+    messages = drain_all(spool)
+    assert messages[-1] == ('w/TEMPERATURE', b'19', 0, False)
+    assert ('a/STATE', b'19', 0, True) not in messages[1:]
+
+
+def test_drain_stops_at_failure(tmp_path):
+    spool = Spool(str(tmp_path / 'spool'), 4096)
+    for value in range(3):
+        spool.append('w/TEMPERATURE', value)
+    results = [True, False]
+    assert spool.drain(lambda *message: results.pop(0), 10) == 1
+    assert len(spool) == 2
+
+
+def test_publisher_spools_while_disconnected(tmp_path, mqtt_client):
+    spool = Spool(str(tmp_path / 'spool'), 4096)
+    publisher = Publisher(mqtt_client, spool=spool, drain_rate=2)
+    publisher.connected = False
+    for value in range(3):
+        publisher.add('w/TEMPERATURE', value)
+        publisher.flush()
+    assert not mqtt_client.published
+    assert publisher.drain() == 0
+    publisher.connected = True
+    publisher.add('w/TEMPERATURE', 3)
+    publisher.flush()
+    assert not mqtt_client.published
+    publisher._drained -= 1
+    assert publisher.drain() == 2
+    publisher._drained -= 10
+    assert publisher.drain() == 2
+    assert [payload for _, payload, _, _ in mqtt_client.published] == [
+        b'0', b'1', b'2', b'3']
+    publisher.add('w/TEMPERATURE', 4)
+    publisher.flush()
+    assert mqtt_client.published[-1] == ('w/TEMPERATURE', 4, 0, False)
+
+
+def test_failed_messages_are_spooled(tmp_path, mqtt_client):
+    mqtt_client.result = 4
+    spool = Spool(str(tmp_path / 'spool'), 4096)
+    publisher = Publisher(mqtt_client, spool=spool)
+    publisher.add('a/STATE', 'on', 1)
+    publisher.add('w/TEMPERATURE', 1.5)
+    publisher.add('w/HUMIDITY', 40, 1)
+    publisher.flush()
+    # the message behind a spooled one is spooled too
+    assert drain_all(spool) == [('w/TEMPERATURE', b'1.5', 0, False),
+                                ('w/HUMIDITY', b'40', 1, False)]
+    assert publisher.failed == 2
+
+
+class SlowSpool(Spool):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def append(self, *args):
+        self.entered.set()
+        self.release.wait(2)
+        return super().append(*args)
+
+
+def test_flush_waits_for_spooling_batch(tmp_path, mqtt_client):
+    spool = SlowSpool(str(tmp_path / 'spool'), 4096)
+    publisher = Publisher(mqtt_client, spool=spool)
+    publisher.connected = False
+    publisher.add('a/STATE', 'on', 0, True, compact=True)
+    first = threading.Thread(target=publisher.flush)
+    first.start()
+    assert spool.entered.wait(2)
+    publisher.connected = True
+    publisher.add('a/STATE', 'off', 0, True, compact=True)
+    second = threading.Thread(target=publisher.flush)
+    second.start()
+    second.join(0.1)
+    assert not mqtt_client.published
+    spool.release.set()
+    first.join(2)
+    second.join(2)
+    assert not mqtt_client.published
+    assert drain_all(spool) == [('a/STATE', b'off', 0, True)]
+
+
+def test_bridge_spools_after_disconnect(tmp_path, mqtt_client):
+    spool = Spool(str(tmp_path / 'spool'), 4096)
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost',
+                       spool=spool)
+    p2m._mqtt_client = mqtt_client
+    p2m._on_disconnect(mqtt_client, None, 7)
+    p2m._handle_event(b'{"origin":"update","type":1,"devices":["a"],'
+                      b'"values":{"state":"on"}}')
+    assert not mqtt_client.published
+    assert len(spool) == 1
+    p2m._on_connect(mqtt_client, None, {}, 0)
+    p2m._publisher._drained -= 1
+    p2m._tick()
+    assert ('PILIGHT/status/a/STATE', b'on', 0, True) in mqtt_client.published
+    assert len(spool) == 0
+
+
+def test_bridge_spools_every_sensor_reading(tmp_path, mqtt_client):
+    spool = Spool(str(tmp_path / 'spool'), 4096)
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost',
+                       spool=spool)
+    p2m._mqtt_client = mqtt_client
+    p2m._on_disconnect(mqtt_client, None, 7)
+    for temperature in (20.0, 20.5, 21.0):
+        p2m._handle_event(
+            b'{"origin":"update","type":3,"devices":["w"],'
+            b'"values":{"temperature":%.1f}}' % temperature)
+    assert len(spool) == 3
+    p2m._on_connect(mqtt_client, None, {}, 0)
+    del mqtt_client.published[:]
+    p2m._publisher._drained -= 1
+    p2m._tick()
+    # the retained state republished on connect follows the history
+    assert mqtt_client.published[:3] == [
+        ('PILIGHT/status/w/TEMPERATURE', payload, 0, True)
+        for payload in (b'20.0', b'20.5', b'21.0')]
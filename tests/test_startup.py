@@ -0,0 +1,80 @@
+import io
+import subprocess
+import sys
+import threading
+import time
+
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.replay import ReplayServer, StubBroker
+from pilight2mqtt.startup import PHASES, StartupProfile
+
+# generous, a regression is a multiple of the typical startup
+VERSION_BUDGET = 1.0
+STARTUP_BUDGET = 2.0
+
+FRAMES = [b'{"origin":"update","type":1,"devices":["a"],'
+          b'"values":{"state":"on"}}']
+
+
+def imported(code):
+    """modules of pilight2mqtt and its heavy dependencies after code"""
+    out = subprocess.check_output([sys.executable, '-c', code + (
+        '\nimport sys\nprint(" ".join(sorted(name for name in sys.modules '
+        'if name.split(".")[0] in ("paho", "http", "orjson", '
+        '"pilight2mqtt"))))')])
+    return out.decode('utf-8').split()
+
+
+def test_heavy_modules_are_imported_when_needed():
+    modules = imported('import pilight2mqtt.__main__')
+    assert 'pilight2mqtt.core' not in modules
+    assert 'orjson' not in modules
+    modules = imported(
+        'from pilight2mqtt.core import PilightServer, Pilight2MQTT\n'
+        'Pilight2MQTT(PilightServer("localhost", 5001), "localhost")')
+    assert 'paho' not in modules
+    assert 'http.server' not in modules
+
+
+def test_version_is_within_budget():
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.check_output([sys.executable, '-m', 'pilight2mqtt',
+                                 '--version'])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert best < VERSION_BUDGET
+
+
+def test_startup_profile_is_within_budget():
+    broker = StubBroker().start()
+    replay = ReplayServer(list(enumerate(FRAMES)), speed=0).start()
+    out = io.StringIO()
+    startup = StartupProfile(stream=out)
+    p2m = Pilight2MQTT(PilightServer('127.0.0.1', replay.port), '127.0.0.1',
+                       mqtt_port=broker.port, startup=startup)
+    startup.mark('setup')
+
+    def stop():
+        replay.finished.wait(5)
+        for _ in range(100):
+            if startup.done:
+                break
+            time.sleep(0.01)
+        p2m._server.terminate()
+
+    threading.Thread(target=stop, daemon=True).start()
+    try:
+        assert p2m.run() == 0
+    finally:
+        replay.stop()
+        broker.stop()
+    assert startup.done
+    assert list(startup.phases) == [
+        'setup', 'mqtt connect', 'pilight identify', 'first event']
+    assert startup.total < STARTUP_BUDGET
+    lines = out.getvalue().splitlines()
+    assert [line.split()[1] for line in lines] == [
+        'setup', 'mqtt', 'pilight', 'first', 'total']
+    assert set(startup.phases) <= set(PHASES)
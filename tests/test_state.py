@@ -0,0 +1,42 @@
+import pytest
+
+from pilight2mqtt.core import PilightServer, Pilight2MQTT
+from pilight2mqtt.publish import Publisher
+from pilight2mqtt.state import StateStore, parse_publish_rule
+
+
+def test_parse_publish_rule():
+    assert parse_publish_rule('state=1') == ('STATE', 1, None)
+    assert parse_publish_rule('BATTERY=0:noretain') == ('BATTERY', 0, False)
+    for text in ('STATE', 'STATE=3', 'STATE=1:sometimes'):
+        with pytest.raises(ValueError):
+            parse_publish_rule(text)
+
+
+def test_options_per_reading():
+    state = StateStore(rules=[('STATE', 1, None), ('BATTERY', 0, False)])
+    assert state.options('STATE') == (1, True)
+    assert state.options('BATTERY') == (0, False)
+    assert state.options('TEMPERATURE') == (0, True)
+
+
+def test_only_device_states_are_compacted():
+    assert StateStore().compact('STATE')
+    assert not StateStore().compact('TEMPERATURE')
+    assert not StateStore(compact=()).compact('STATE')
+
+
+def test_values_seed_the_store_and_are_republished(mqtt_client):
+    state = StateStore(rules=[('BATTERY', 0, False)])
+    p2m = Pilight2MQTT(PilightServer('localhost', 5001), 'localhost',
+                       state=state)
+    p2m._publisher = Publisher(mqtt_client)
+    p2m._handle_event(
+        b'{"message":"values","values":[{"type":3,"devices":["w"],'
+        b'"values":{"temperature":20.5,"battery":1}}]}')
+    assert state.get('PILIGHT/status/w/TEMPERATURE') == 20.5
+    assert len(state) == 2
+    del mqtt_client.published[:]
+    p2m._on_connect(mqtt_client, None, None, 0)
+    assert mqtt_client.published == [
+        ('PILIGHT/status/w/TEMPERATURE', 20.5, 0, True)]